@@ -0,0 +1,199 @@
+"""
+Offline analysis of positions : reads them as JSON lines, writes the legal moves, the best move and its
+evaluation of each one as JSON lines, in the same order.
+
+A position is a state as sent by kahmate.server, with an optional "id" and the colors in playing order:
+    {"id": any, "colors": ["BLUE", "PINK"], "turn": int, "ball": [row, col], "decks": [mask, mask],
+     "pieces": [[row, col, turn_death, has_moved], ...]}
+turn_death is -1 for a piece up and a deck mask has bit k set when the card k + 1 is left. The result is
+    {"id": any, "moves": [move, ...], "best": move, "score": float, "depth": int, "nodes": int}
+with the moves as in kahmate.server and the score from the point of view of the team to play, or
+{"id": any, "error": str} for a line which is not a position. The id is the line number if none is given.
+
+The lines are read as they are needed and sent by batches to a pool of processes. At most WINDOW
+batches per process are in flight : once the window is full, the oldest one is waited for and written
+before reading on, so that the memory stays bounded and a slow output slows the reading down.
+
+    python analyze.py positions.jsonl --output results.jsonl --workers 4 --level hard
+    cat positions.jsonl | python analyze.py > results.jsonl
+"""
+import argparse
+import collections
+import itertools
+import json
+import os
+import sys
+from kahmate import ai, engine, simulate, tablebase
+from kahmate.engine import NPIECES, FULL_DECK
+from kahmate.rules import DISPLACEMENT, PASS, SKIP, KIND_NAMES, Color, Level, Team
+from kahmate.tables import NROWS, NCOLS
+from kahmate.zobrist import position_hash
+
+
+BATCH = 32
+WINDOW = 4
+
+
+def read_position(message):
+    """
+    input : position as read from a line
+    output : engine.Position
+    raise : ValueError if the position is not valid
+    """
+    if not isinstance(message, dict):
+        raise ValueError('a position is a JSON object')
+    colors = [Color[color] for color in message.get('colors', ['BLUE', 'PINK'])]
+    if sorted(color.name for color in colors) != ['BLUE', 'PINK']:
+        raise ValueError('colors are BLUE and PINK')
+    pieces = message['pieces']
+    if len(pieces) != NPIECES:
+        raise ValueError(f'{NPIECES} pieces expected')
+    position = engine.Position([piece.piece_type for color in colors for piece in Team(color).pieces], colors)
+    for index, (row, col, turn_death, has_moved) in enumerate(pieces):
+        if not (0 <= row < NROWS and 0 <= col < NCOLS):
+            raise ValueError(f'piece {index} off the board')
+        square = row * NCOLS + col
+        if position.board[square]:
+            raise ValueError(f'pieces {position.board[square] - 1} and {index} on the same square')
+        position.square[index] = square
+        position.board[square] = index + 1
+        position.death[index] = turn_death
+        if has_moved:
+            position.moved |= 1 << index
+    row, col = message['ball']
+    if not (0 <= row < NROWS and 0 <= col < NCOLS):
+        raise ValueError('ball off the board')
+    position.ball = row * NCOLS + col
+    position.decks = list(message['decks'])
+    if len(position.decks) != 2 or not all(0 < deck <= FULL_DECK for deck in position.decks):
+        raise ValueError('two decks of at least one card expected')
+    position.turn_count = message['turn']
+    position.hash = position_hash(position)
+    return position
+
+
+def move_message(position, move):
+    """
+    output : encoded move as sent by kahmate.server
+    """
+    kind = engine.move_kind(move)
+    if kind == SKIP:
+        return {'kind': 'skip'}
+    square = engine.move_square(move)
+    if kind == DISPLACEMENT:
+        target = list(divmod(square, NCOLS))
+    elif kind == PASS:
+        target = position.board[square] - 1
+    else:
+        target = engine.move_opponent(move)
+    return {'kind': KIND_NAMES[kind], 'piece': engine.move_piece(move), 'target': target}
+
+
+def analyze(line, number, level, budget):
+    """
+    input : line of the input, its number, level and budget of the search
+    output : the result line
+    """
+    try:
+        message = json.loads(line)
+        position = read_position(message)
+        key = message.get('id', number)
+    except (ValueError, KeyError, TypeError, IndexError) as error:
+        return json.dumps({'id': number, 'error': f'{type(error).__name__}: {error}'})
+    result = {'id': key}
+    winner = position.winner()
+    if winner >= 0:
+        result.update(moves=[], best=None, score=ai.WIN if winner == position.next_player() else -ai.WIN,
+                      depth=0, nodes=0)
+        return json.dumps(result)
+    moves = position.legal_moves()
+    searcher = ai.Searcher(level, tablebase=tablebase.load(), **budget)
+    completed = searcher.root_scores(position, moves)
+    if completed:
+        scores = completed[-1]
+        best = max(moves, key=scores.get)
+        score = round(scores[best], 4)
+    else:
+        best, score = moves[0], None
+    result.update(moves=[move_message(position, move) for move in moves], best=move_message(position, best),
+                  score=score, depth=len(completed), nodes=searcher.nodes_searched)
+    return json.dumps(result)
+
+
+def analyze_batch(batch, level, budget):
+    """
+    input : list of (line number, line)
+    output : the result lines, in the same order
+    """
+    return [analyze(line, number, level, budget) for number, line in batch]
+
+
+def batches(lines, size):
+    numbered = ((number, line) for number, line in enumerate(lines, 1) if line.strip())
+    while True:
+        batch = list(itertools.islice(numbered, size))
+        if not batch:
+            return
+        yield batch
+
+
+def run(lines, output, level=Level.NORMAL, budget=None, workers=None, batch=BATCH, window=WINDOW):
+    """
+    input : iterable of lines, file to write the results to, level and budget of the searches (the nodes of
+        the level without time limit by default), number of processes (all the cores by default, 0 to analyze
+        in this process), lines per batch, batches in flight per process
+    output : number of positions analyzed
+    """
+    budget = {'time': float('inf'), **(budget or {})}
+    count = 0
+    if workers == 0:
+        for lines_batch in batches(lines, batch):
+            for result in analyze_batch(lines_batch, level, budget):
+                output.write(result + '\n')
+                count += 1
+        return count
+    workers = workers or os.cpu_count() or 1
+    with simulate.spawn_pool(workers) as pool:
+        limit = window * workers
+        pending = collections.deque()
+        for lines_batch in batches(lines, batch):
+            if len(pending) >= limit:
+                count += _write(pending.popleft().get(), output)
+            pending.append(pool.apply_async(analyze_batch, (lines_batch, level, budget)))
+        while pending:
+            count += _write(pending.popleft().get(), output)
+    return count
+
+
+def _write(results, output):
+    output.write(''.join(result + '\n' for result in results))
+    return len(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', nargs='?', default='-', help='JSON lines of positions, - for the standard input')
+    parser.add_argument('--output', default='-', help='file of the results, - for the standard output')
+    parser.add_argument('--level', default='normal', choices=[level.value for level in Level])
+    parser.add_argument('--nodes', type=int, default=None, help='node budget of every search')
+    parser.add_argument('--depth', type=int, default=None, help='deepest search')
+    parser.add_argument('--time', type=float, default=None, help='seconds of every search, no limit by default')
+    parser.add_argument('--workers', type=int, default=None, help='all the cores by default, 0 for none')
+    parser.add_argument('--batch', type=int, default=BATCH, help='positions sent to a process at once')
+    args = parser.parse_args(argv)
+    budget = {name: value for name, value in (('nodes', args.nodes), ('depth', args.depth), ('time', args.time))
+              if value is not None}
+    source = sys.stdin if args.input == '-' else open(args.input)
+    target = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        count = run(source, target, Level(args.level), budget, args.workers, args.batch)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+    print(f'{count} positions analyzed', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,453 @@
+"""
+Move selection of the AI players.
+
+The search is an expectimax on an `engine.Position`, made and unmade in place:
+the decision nodes of the two teams are searched with alpha-beta pruning, and a
+move with a face off is a chance node averaging over its results, weighted by
+their exact probabilities from `faceoff`. The search deepens one ply at a time
+until the node budget or the deadline of its `Level` is reached, and returns
+the best move of the deepest search completed. The values, bounds, best moves
+and legal moves of the decision nodes are kept in a `zobrist.TranspositionTable`,
+so that a position reached again, by another order of the moves or by the next
+iteration, is not searched nor generated twice. When an endgame `tablebase` is
+given, the leaves it holds count the chances of the ball holder to score.
+
+A `ParallelSearcher` shares the root moves among processes, each with the budget
+of the level, so that more cores search deeper in the same time:
+
+    python -m kahmate.ai --level hard --workers 4       # nodes per second of each worker
+"""
+import argparse
+import atexit
+import functools
+import json
+import os
+import random
+import time
+from kahmate.settings import *
+from kahmate import engine, faceoff, simulate, tablebase
+from kahmate.zobrist import TranspositionTable, ROOT, EXACT, LOWER, UPPER
+from kahmate.engine import NCOLS, TEAM_SIZE, NPIECES, CARDS
+from kahmate.rules import Color, Level
+
+
+WIN = 10000
+
+# terms of the evaluation, from the point of view of one team
+FEATURES = ('ball', 'possession', 'down', 'speed', 'attack', 'defense', 'deck')
+WEIGHTS = {'ball': 10, 'possession': 20, 'down': 8, 'speed': 1, 'attack': 1, 'defense': 1, 'deck': 0.5}
+# weights of each level fitted by kahmate.tuning, WEIGHTS for a level it does not hold
+WEIGHTS_PATH = PARENT_PATH / 'weights.json'
+
+# search budget of each level : deepest search, nodes, seconds
+LEVELS = {
+    Level.EASY: {'depth': 1, 'nodes': 2000, 'time': 0.05},
+    Level.NORMAL: {'depth': 2, 'nodes': 20000, 'time': 0.1},
+    Level.HARD: {'depth': 6, 'nodes': 200000, 'time': 0.18},
+}
+
+
+class Timeout(Exception):
+    pass
+
+
+def features(position, team):
+    """
+    input : engine.Position, index of a team
+    output : list of the values of FEATURES for the team, the opponent's counting negatively
+    """
+    direction = 1 if position.colors[team] == Color.BLUE else -1
+    ball = direction * (position.ball % NCOLS - (NCOLS - 1) / 2) / COLS
+    holder = position.board[position.ball] - 1
+    possession = 0 if holder < 0 else (1 if holder // TEAM_SIZE == team else -1)
+    down = speed = attack = defense = 0
+    for piece in range(NPIECES):
+        sign = 1 if piece // TEAM_SIZE == team else -1
+        if position.death[piece] >= 0:
+            down -= sign
+        else:
+            speed += sign * position.speed[piece]
+            attack += sign * position.attack[piece]
+            defense += sign * position.defense[piece]
+    deck = sum(CARDS[position.decks[team]]) - sum(CARDS[position.decks[1 - team]])
+    return [ball, possession, down, speed, attack, defense, deck]
+
+
+def evaluate(position, team, weights=None):
+    """
+    output : value of the position for the team, WIN if it has already won
+    """
+    winner = position.winner()
+    if winner >= 0:
+        return WIN if winner == team else -WIN
+    weights = weights or WEIGHTS
+    return sum(weights[name] * value for name, value in zip(FEATURES, features(position, team)))
+
+
+@functools.lru_cache(maxsize=None)
+def load_weights(path=WEIGHTS_PATH):
+    """
+    output : {Level : weights} of the weight file, empty if it has not been written
+    """
+    try:
+        with open(path) as file:
+            levels = json.load(file)
+    except FileNotFoundError:
+        return {}
+    return {Level(level): {**WEIGHTS, **weights} for level, weights in levels.items()}
+
+
+def level_weights(level):
+    """
+    output : weights of the evaluation of a level, from the weight file if it holds them
+    """
+    return load_weights().get(level, WEIGHTS)
+
+
+class Searcher:
+    """
+    PARAMETERS :
+    depth, nodes, time          -> budget of the search, see LEVELS
+    weights : dict              -> weights of the evaluation, those of the level by default
+    nodes_searched : int        -> nodes visited by the last search
+    depth_reached : int         -> depth of the last search completed
+    table : TranspositionTable  -> positions already searched, kept from one search to the next
+    tablebase : Tablebase       -> exact chances of the endgames at the leaves, None to only evaluate them
+    stop : callable             -> returns True when the search has to stop before its budget, None to never stop it
+    report : callable           -> called with the depth, the best move and the nodes searched after each depth
+
+    METHODS :
+    choose(position)            -> best encoded move found for the next player of the position
+    ponder(position, team)      -> fills the table with the positions the team can face, the other team to play
+    """
+    def __init__(self, level=Level.NORMAL, deadline=None, weights=None, table=None, tablebase=None, stop=None,
+                 report=None, **budget):
+        """
+        input : level = default budget, deadline = seconds overriding the time of the level,
+            weights of the evaluation, table = transposition table to use (a new one by default),
+            tablebase = endgame tablebase, stop and report = see above, budget = depth, nodes or time
+        """
+        config = dict(LEVELS[level])
+        config.update(budget)
+        if deadline is not None:
+            config['time'] = deadline
+        self.depth = config['depth']
+        self.nodes = config['nodes']
+        self.time = config['time']
+        self.weights = weights or level_weights(level)
+        self.table = table if table is not None else TranspositionTable()
+        self.tablebase = tablebase
+        self.stop = stop
+        self.report = report
+        self.nodes_searched = 0
+        self.depth_reached = 0
+        self._position = None
+        self._team = 0
+        self._stop_time = 0
+
+    def _start(self, position):
+        self._position = position
+        self._team = position.next_player()
+        self._stop_time = time.perf_counter() + self.time
+        self.nodes_searched = 0
+        self.depth_reached = 0
+        self.table.new_search()
+
+    def choose(self, position):
+        """
+        input : engine.Position, it is left as it was found
+        output : encoded move, within the time of the level
+        """
+        self._start(position)
+        moves = position.legal_moves()
+        if len(moves) == 1:
+            return moves[0]
+        best_move = moves[0]
+        for depth in range(1, self.depth + 1):
+            scores = {}
+            try:
+                for move in moves:
+                    scores[move] = self._move_value(move, depth - 1, -WIN - 1, WIN + 1)
+            except Timeout:
+                # the moves already searched are only trusted if the previous best one is among them
+                if moves[0] in scores:
+                    best_move = max(scores, key=scores.get)
+                break
+            moves.sort(key=scores.get, reverse=True)
+            best_move = moves[0]
+            self.depth_reached = depth
+            if self.report is not None:
+                self.report(depth, best_move, self.nodes_searched)
+            if abs(scores[best_move]) >= WIN:
+                break
+        return best_move
+
+    def ponder(self, position, team):
+        """
+        input : engine.Position, the other team to play, team of the searcher
+        action : searches the position for the team, deeper and deeper until the budget runs out, so that
+            the transposition table already holds the positions of its next search
+        """
+        self._start(position)
+        self._team = team
+        for depth in range(1, self.depth + 1):
+            try:
+                self._value(depth, -WIN - 1, WIN + 1)
+            except Timeout:
+                break
+            self.depth_reached = depth
+
+    def root_scores(self, position, moves):
+        """
+        input : engine.Position, some of its legal moves
+        output : list of the {move : score} of each depth completed within the budget, the deepest last
+        """
+        self._start(position)
+        moves = list(moves)
+        completed = []
+        for depth in range(1, self.depth + 1):
+            scores = {}
+            try:
+                for move in moves:
+                    scores[move] = self._move_value(move, depth - 1, -WIN - 1, WIN + 1)
+            except Timeout:
+                break
+            completed.append(scores)
+            self.depth_reached = depth
+            moves.sort(key=scores.get, reverse=True)
+            if scores[moves[0]] >= WIN:
+                break
+        return completed
+
+    def _check(self):
+        self.nodes_searched += 1
+        if self.nodes_searched >= self.nodes or (self.nodes_searched & 127 == 0 and (
+                time.perf_counter() > self._stop_time or (self.stop is not None and self.stop()))):
+            raise Timeout
+
+    def _chances(self, move):
+        """
+        output : (probability, outcome) of each result of the face off of the move
+        """
+        position = self._position
+        team = position.next_player()
+        return faceoff.result_chances(position.decks[team], position.decks[1 - team],
+                                      position.attack[engine.move_piece(move)],
+                                      position.defense[engine.move_opponent(move)])
+
+    def _move_value(self, move, depth, alpha, beta):
+        position = self._position
+        if engine.move_opponent(move) >= 0 and move & 3 != engine.PASS:
+            value = 0
+            for probability, outcome in self._chances(move):
+                position.make_move(move, outcome)
+                try:
+                    value += probability * self._value(depth, -WIN - 1, WIN + 1)
+                finally:
+                    position.unmake_move(move)
+            return value
+        position.make_move(move)
+        try:
+            return self._value(depth, alpha, beta)
+        finally:
+            position.unmake_move(move)
+
+    def _leaf(self, position):
+        """
+        output : evaluation of the position, or the chances of the ball holder to score if it is an endgame
+        """
+        value = evaluate(position, self._team, self.weights)
+        if self.tablebase is not None and position.winner() < 0:
+            chances = self.tablebase.value(position)
+            if chances:
+                win = WIN if position.holder() // TEAM_SIZE == self._team else -WIN
+                value = chances * win + (1 - chances) * value
+        return value
+
+    def _value(self, depth, alpha, beta):
+        self._check()
+        position = self._position
+        if depth == 0 or position.winner() >= 0:
+            return self._leaf(position)
+        # the values are from the point of view of the searching team, which is part of the key
+        key = position.hash ^ ROOT[self._team]
+        entry = self.table.probe(key)
+        moves = best_move = None
+        if entry is not None:
+            stored_depth, value, flag, best_move, moves = entry
+            if stored_depth >= depth and (flag == EXACT or (flag == LOWER and value >= beta)
+                                          or (flag == UPPER and value <= alpha)):
+                return value
+        if moves is None:
+            moves = position.legal_moves()
+        if best_move is not None and best_move != moves[0]:
+            ordered = [best_move] + [move for move in moves if move != best_move]
+        else:
+            ordered = moves
+        maximize = position.next_player() == self._team
+        best = -WIN - 1 if maximize else WIN + 1
+        first_alpha, first_beta = alpha, beta
+        for move in ordered:
+            value = self._move_value(move, depth - 1, alpha, beta)
+            if maximize:
+                if value > best:
+                    best, best_move = value, move
+                alpha = max(alpha, value)
+            else:
+                if value < best:
+                    best, best_move = value, move
+                beta = min(beta, value)
+            if alpha >= beta:
+                break
+        if best <= first_alpha:
+            flag = UPPER
+        elif best >= first_beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table.store(key, depth, best, flag, best_move, moves)
+        return best
+
+
+# searcher of each process of a ParallelSearcher
+_worker = None
+
+
+def _start_worker(level, deadline, weights, tablebase_path, budget):
+    global _worker
+    endgames = tablebase.load(tablebase_path) if tablebase_path is not None else None
+    _worker = Searcher(level, deadline, weights, tablebase=endgames, **budget)
+
+
+def _search_root(position, moves):
+    """
+    output : scores of each depth completed by the searcher of the process, nodes searched, seconds
+    """
+    start = time.perf_counter()
+    completed = _worker.root_scores(position, moves)
+    return completed, _worker.nodes_searched, time.perf_counter() - start
+
+
+class ParallelSearcher:
+    """
+    Root parallel search : the moves of the root are shared among processes, each one searching its
+    moves with its own Searcher, the budget of the level and its own transposition table. As the root
+    moves are searched with a full window one by one, their scores do not depend on the others.
+
+    PARAMETERS :
+    workers : int               -> number of processes
+    nodes_searched : int        -> nodes visited by all the workers in the last search
+    depth_reached : int         -> depth completed for every root move in the last search
+    worker_stats : list         -> (nodes, seconds) of each worker in the last search
+
+    METHODS :
+    choose(position)            -> best encoded move found for the next player of the position
+    nodes_per_second()          -> list of the speed of each worker in the last search
+    close()                     -> stops the processes
+    """
+    def __init__(self, level=Level.NORMAL, deadline=None, weights=None, workers=None, tablebase_path=None, **budget):
+        """
+        input : as for Searcher, workers = number of processes (all the cores by default),
+            tablebase_path = file of the endgame tablebase, opened by each process
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.nodes_searched = 0
+        self.depth_reached = 0
+        self.worker_stats = []
+        self._pool = simulate.spawn_pool(self.workers, _start_worker,
+                                         (level, deadline, weights, tablebase_path, budget))
+
+    def choose(self, position):
+        """
+        input : engine.Position
+        output : encoded move, the best of the deepest search completed for all the root moves
+        """
+        moves = position.legal_moves()
+        if len(moves) == 1:
+            return moves[0]
+        shares = [moves[worker::self.workers] for worker in range(self.workers)]
+        tasks = [self._pool.apply_async(_search_root, (position, share)) for share in shares if share]
+        results = [task.get() for task in tasks]
+        self.worker_stats = [(nodes, seconds) for _, nodes, seconds in results]
+        self.nodes_searched = sum(nodes for nodes, _ in self.worker_stats)
+        self.depth_reached = min(len(completed) for completed, _, _ in results)
+        scores = {}
+        for completed, _, _ in results:
+            if completed:
+                scores.update(completed[self.depth_reached - 1] if self.depth_reached else completed[0])
+        if not scores:
+            return moves[0]
+        return max(scores, key=scores.get)
+
+    def nodes_per_second(self):
+        return [nodes / seconds if seconds else 0 for nodes, seconds in self.worker_stats]
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+
+
+# ParallelSearcher of the last level, deadline and workers asked for, started on the first move of an AI
+_parallel = {}
+
+
+@atexit.register
+def close_parallel():
+    """
+    Stops the processes of the ParallelSearcher of choose_move, started again on its next call
+    """
+    while _parallel:
+        _, searcher = _parallel.popitem()
+        searcher.close()
+
+
+def choose_move(state, level, deadline=None, workers=AI_WORKERS):
+    """
+    input : rules.GameState, refreshed, level of the AI, seconds to answer (the level's by default),
+        number of processes searching the move (see ParallelSearcher), 0 for all the cores
+    output : move of the next player, as generated by the state
+    """
+    position = engine.Position.from_state(state)
+    if workers == 1:
+        move = Searcher(level, deadline, tablebase=tablebase.load()).choose(position)
+    else:
+        key = (level, deadline, workers)
+        if key not in _parallel:
+            # the pool of another level is not kept, so that a single one runs at a time
+            close_parallel()
+            path = tablebase.DEFAULT_PATH if tablebase.load() is not None else None
+            _parallel[key] = ParallelSearcher(level, deadline, workers=workers, tablebase_path=path)
+        move = _parallel[key].choose(position)
+    return engine.to_rules_move(state, move)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Times the searches of a level, in parallel or not.')
+    parser.add_argument('--level', default='hard', choices=[level.value for level in Level])
+    parser.add_argument('--workers', type=int, default=None, help='all the cores by default')
+    parser.add_argument('--positions', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    rng = random.Random(args.seed)
+    searcher = ParallelSearcher(Level(args.level), workers=args.workers)
+    try:
+        position = engine.Position.initial(rng=rng)
+        rates = [[] for _ in range(searcher.workers)]
+        for _ in range(args.positions):
+            if position.winner() >= 0:
+                position = engine.Position.initial(rng=rng)
+            move = searcher.choose(position)
+            for worker, rate in enumerate(searcher.nodes_per_second()):
+                rates[worker].append(rate)
+            print(f'turn {position.turn_count:>3}  depth {searcher.depth_reached}  nodes {searcher.nodes_searched:>7}'
+                  f'  {sum(searcher.nodes_per_second()):>9,.0f} nodes/s')
+            position.play(move, position.sample_outcome(move, rng))
+        for worker, worker_rates in enumerate(rates):
+            if worker_rates:
+                print(f'worker {worker} : {sum(worker_rates) / len(worker_rates):,.0f} nodes/s')
+    finally:
+        searcher.close()
+
+
+if __name__ == '__main__':
+    main()
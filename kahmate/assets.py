@@ -0,0 +1,61 @@
+"""
+Images and texts of the pygame front-end.
+Only the display imports this module, so that the rules can run without pygame.
+
+Every image goes through `image`, which decodes and scales a file once for the
+whole process: all the players, all the frames and every new game share the
+same surfaces. Fonts and rendered texts are cached the same way.
+"""
+import functools
+import pygame as pg
+from kahmate.settings import *
+
+# surfaces by (file name, size), and the keys already converted to the display format
+_images = {}
+_converted = set()
+
+
+def image(name, size):
+    """
+    input : name of a file of img/, size of the surface
+    output : the scaled surface, converted to the display format as soon as a display exists
+    """
+    key = (name, size)
+    surface = _images.get(key)
+    if surface is None or (key not in _converted and pg.display.get_surface() is not None):
+        if surface is None:
+            surface = pg.transform.scale(pg.image.load(IMG_PATH / name), size)
+        if pg.display.get_surface() is not None:
+            if surface.get_flags() & pg.SRCALPHA:
+                surface = surface.convert_alpha()
+            else:
+                surface = surface.convert()
+            _converted.add(key)
+        _images[key] = surface
+    return surface
+
+
+def ball():
+    return image('ball.png', (32, 32))
+
+
+def lightning():
+    return image('lightning.png', (32, 32))
+
+
+@functools.lru_cache(maxsize=None)
+def system_font(font, size, is_bold):
+    """
+    output : pygame font, looked up in the system fonts once
+    """
+    return pg.font.SysFont(font, size, bold=is_bold)
+
+
+@functools.lru_cache(maxsize=256)
+def create_text(text, font, size, color, is_bold):
+    """
+    output : surface of the rendered text, shared by every caller asking for the same text
+    """
+    font = system_font(font, size, is_bold)
+    image = font.render(text, True, color)
+    return image
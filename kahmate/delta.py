@@ -0,0 +1,138 @@
+"""
+Changes of a game from one move to the next, to keep remote copies of a state up to date
+without sending the whole state after each move.
+
+A move only changes one or two pieces, the ball, the decks and the last cards drawn after a face
+off and the turn count, and a delta only holds what changed:
+    {"turn": int, "ball": square, "decks": [mask, mask], "cards": [card, card],
+     "pieces": [[piece, square, turn_death, has_moved], ...], "checksum": int}
+"turn" and "checksum" are always there, the other keys only when they changed. The pieces
+are numbered as in engine.Position, the squares are row * NCOLS + col, turn_death is -1 for
+a piece up and a mask has bit k set when the card k + 1 is left in the deck. A card draw
+is the bit of the card cleared from its deck, and the card is the last one drawn by each team,
+shown by the face off, 0 before its first draw.
+
+The checksum is the low 32 bits of the zobrist hash of the state xor the keys of the last cards
+drawn, which a copy computes from what it holds, so that a copy which missed or misapplied a delta
+finds it out.
+
+    before = Snapshot.from_state(state)
+    state.play(move)
+    after = Snapshot.from_state(state)
+    message = before.diff(after)        # sent to the remote copies
+    copy.apply(message)                 # on a remote copy, raises Desync if it differs
+"""
+from kahmate.tables import NCOLS
+from kahmate.zobrist import PIECE_SQUARE, BALL, MOVED, DECK, down_key, turn_key, mix
+
+
+CHECKSUM_MASK = 0xffffffff
+# key of the last card drawn by each team, none for no card so far; not part of the hash of the state,
+# the card drawn last having no effect on the game
+CARD = [[0] + [mix(0x63617264 ^ team << 8 ^ card) for card in range(1, 6)] for team in range(2)]
+
+
+class Desync(ValueError):
+    pass
+
+
+def checksum(state):
+    """
+    input : rules.GameState
+    output : checksum of the state, as sent in the deltas
+    """
+    key = state.hash
+    for team, player in enumerate(state.players):
+        key ^= CARD[team][player.last_strength_picked or 0]
+    return key & CHECKSUM_MASK
+
+
+class Snapshot:
+    """
+    What a remote copy needs to know of a state.
+
+    PARAMETERS :
+    turn : int                  -> turn count
+    ball : int                  -> square of the ball
+    decks : list of int         -> bitmask of the cards left in the deck of each team
+    cards : list of int         -> last card drawn by each team, 0 if none
+    pieces : list               -> (square, turn_death, has_moved) of each piece, turn_death -1 when up
+
+    METHODS :
+    from_state(state)           -> snapshot of a rules.GameState
+    diff(other) : dict          -> delta turning this snapshot into the other one
+    apply(delta)                -> applies a delta, checks its checksum
+    checksum() : int            -> checksum of the snapshot, computed from scratch
+    """
+    __slots__ = ('turn', 'ball', 'decks', 'pieces', 'cards')
+
+    def __init__(self, turn, ball, decks, pieces, cards=(0, 0)):
+        self.turn = turn
+        self.ball = ball
+        self.decks = list(decks)
+        self.pieces = [tuple(piece) for piece in pieces]
+        self.cards = list(cards)
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        input : rules.GameState
+        """
+        return cls(state.turn_count, state.ball_position[0] * NCOLS + state.ball_position[1],
+                   state.deck_masks(),
+                   [(piece.position[0] * NCOLS + piece.position[1], piece.turn_death if piece.is_down else -1,
+                     int(piece.has_moved)) for piece in state.index_of],
+                   [player.last_strength_picked or 0 for player in state.players])
+
+    def copy(self):
+        return Snapshot(self.turn, self.ball, self.decks, self.pieces, self.cards)
+
+    def __eq__(self, other):
+        return isinstance(other, Snapshot) and (self.turn, self.ball, self.decks, self.pieces, self.cards) == \
+            (other.turn, other.ball, other.decks, other.pieces, other.cards)
+
+    def diff(self, other):
+        """
+        input : snapshot of the same game, later
+        output : delta from this snapshot to the other one
+        """
+        delta = {'turn': other.turn}
+        if other.ball != self.ball:
+            delta['ball'] = other.ball
+        if other.decks != self.decks:
+            delta['decks'] = list(other.decks)
+        if other.cards != self.cards:
+            delta['cards'] = list(other.cards)
+        pieces = [[index, *piece] for index, (piece, old) in enumerate(zip(other.pieces, self.pieces))
+                  if piece != old]
+        if pieces:
+            delta['pieces'] = pieces
+        delta['checksum'] = other.checksum()
+        return delta
+
+    def apply(self, delta):
+        """
+        input : delta from this snapshot, as made by diff
+        raise : Desync if the snapshot does not match the checksum of the delta once applied
+        """
+        self.turn = delta['turn']
+        self.ball = delta.get('ball', self.ball)
+        if 'decks' in delta:
+            self.decks = list(delta['decks'])
+        if 'cards' in delta:
+            self.cards = list(delta['cards'])
+        for index, square, turn_death, has_moved in delta.get('pieces', ()):
+            self.pieces[index] = (square, turn_death, has_moved)
+        if self.checksum() != delta['checksum']:
+            raise Desync(f'checksum mismatch at turn {self.turn}')
+
+    def checksum(self):
+        key = BALL[self.ball] ^ DECK[0][self.decks[0]] ^ DECK[1][self.decks[1]] ^ turn_key(self.turn)
+        key ^= CARD[0][self.cards[0]] ^ CARD[1][self.cards[1]]
+        for index, (square, turn_death, has_moved) in enumerate(self.pieces):
+            key ^= PIECE_SQUARE[index][square]
+            if has_moved:
+                key ^= MOVED[index]
+            if turn_death >= 0:
+                key ^= down_key(index, turn_death)
+        return key & CHECKSUM_MASK
@@ -0,0 +1,523 @@
+"""
+Compact state of a game, for searches and simulations.
+
+The squares of the board are numbered row * NCOLS + col and the pieces are
+numbered 0 to 5 for the first team and 6 to 11 for the second one, in the order
+of `rules.Team.pieces`. A `Position` keeps fixed-size arrays of integers only:
+- board : bytearray, 0 for an empty square, piece + 1 otherwise
+- square : square of each piece
+- death : turn_death of each piece, -1 when it is up
+- moved : bitmask of the pieces which have moved this turn
+- ball : square of the ball, its holder is the piece standing on it
+- decks : bitmask of the strength cards left in each deck, bit k for card k + 1
+- hash : Zobrist hash of all the above and of the turn count, kept up to date by the moves
+
+A move is an int packing its kind, piece, target square and face off opponent.
+A face off outcome is an int packing the result and the two decks left after it,
+so that `make_move` is deterministic and `unmake_move` can restore everything.
+"""
+import random
+from kahmate.settings import *
+from kahmate.tables import NROWS, NCOLS, NSQUARES
+from kahmate.rules import DISPLACEMENT, PASS, TACKLE, SKIP, PERFECT_TACKLE, ATTACK_WINS, DEFENSE_WINS
+from kahmate.rules import Color, Team, GameState, REACH, PATH, THROUGH
+from kahmate import tables
+from kahmate.zobrist import PIECE_SQUARE, BALL, MOVED_MASK, DECK, down_key, turn_key, position_hash
+
+
+TEAM_SIZE = 6
+NPIECES = 2 * TEAM_SIZE
+TEAM_MASK = (1 << TEAM_SIZE) - 1
+FULL_DECK = 0b11111
+MAX_PLY = 1024
+
+# face off results
+NO_FACE_OFF = 0
+PERFECT = 1
+ATTACK = 2
+DEFENSE = 3
+RESULTS = {PERFECT_TACKLE: PERFECT, ATTACK_WINS: ATTACK, DEFENSE_WINS: DEFENSE}
+
+# cards of a deck bitmask
+CARDS = tuple(tuple(card for card in range(1, 6) if mask >> (card - 1) & 1) for mask in range(FULL_DECK + 1))
+
+# undo frame : ball, moved, deck 0, deck 1, turn, piece square, piece death, opponent death, revived, hash, deaths
+FRAME = 10 + NPIECES
+
+
+def encode(kind, piece, square, opponent=-1):
+    return kind | piece << 2 | square << 6 | (opponent + 1) << 14
+
+
+SKIP_MOVE = encode(SKIP, 0, 0)
+
+
+def move_kind(move):
+    return move & 3
+
+
+def move_piece(move):
+    return move >> 2 & 15
+
+
+def move_square(move):
+    return move >> 6 & 255
+
+
+def move_opponent(move):
+    return (move >> 14) - 1
+
+
+def encode_outcome(result, attack_deck, defense_deck):
+    return result | attack_deck << 2 | defense_deck << 7
+
+
+def outcome_result(outcome):
+    return outcome & 3
+
+
+def draw_card(deck, rng=random):
+    """
+    input : deck bitmask
+    output : card picked at random, deck bitmask left (refilled when empty)
+    """
+    cards = CARDS[deck]
+    card = cards[rng.randrange(len(cards))]
+    deck &= ~(1 << (card - 1))
+    if deck == 0:
+        deck = FULL_DECK
+    return card, deck
+
+
+def face_off_outcome(attack_deck, defense_deck, attack, defense, rng=random):
+    """
+    Same draws as rules.GameState.face_off, on deck bitmasks
+    output : face off outcome
+    """
+    attack_strength, attack_deck = draw_card(attack_deck, rng)
+    defense_strength, defense_deck = draw_card(defense_deck, rng)
+    attack_score = attack_strength + attack
+    defense_score = defense_strength + defense
+    if attack_score >= defense_score + 2:
+        result = PERFECT
+    elif defense_score + 2 > attack_score > defense_score:
+        result = ATTACK
+    elif defense_score > attack_score:
+        result = DEFENSE
+    else:
+        attack_pick, attack_deck = draw_card(attack_deck, rng)
+        defense_pick, defense_deck = draw_card(defense_deck, rng)
+        result = ATTACK if attack_pick + attack > defense_pick + defense else DEFENSE
+    return encode_outcome(result, attack_deck, defense_deck)
+
+
+def deck_mask(strength_deck):
+    mask = 0
+    for card in strength_deck:
+        mask |= 1 << (card - 1)
+    return mask
+
+
+def from_rules_move(state, move):
+    """
+    input : rules.GameState, move as generated by it
+    output : encoded move
+    """
+    kind, piece, target, face_off_opponent = move
+    if kind == SKIP:
+        return SKIP_MOVE
+    pieces = state.players[0].pieces + state.players[1].pieces
+    if kind == DISPLACEMENT:
+        square = target[0] * NCOLS + target[1]
+    else:
+        square = target.position[0] * NCOLS + target.position[1]
+    if kind == TACKLE:
+        face_off_opponent = target
+    opponent = -1 if face_off_opponent is None else pieces.index(face_off_opponent)
+    return encode(kind, pieces.index(piece), square, opponent)
+
+
+def to_rules_move(state, move):
+    """
+    input : rules.GameState, encoded move
+    output : the same move, as generated by the rules.GameState
+    """
+    pieces = state.players[0].pieces + state.players[1].pieces
+    kind = move_kind(move)
+    if kind == SKIP:
+        return SKIP, None, None, None
+    piece = pieces[move_piece(move)]
+    opponent = move_opponent(move)
+    face_off_opponent = None if opponent < 0 else pieces[opponent]
+    row, col = divmod(move_square(move), NCOLS)
+    if kind == DISPLACEMENT:
+        return kind, piece, [row, col], face_off_opponent
+    if kind == PASS:
+        return kind, piece, state.board.matrix[row][col], face_off_opponent
+    return kind, piece, face_off_opponent, None
+
+
+class Position:
+    """
+    PARAMETERS :
+    board, square, death, moved, ball, decks -> see the module docstring
+    turn_count : int            -> same as rules.GameState.turn_count
+    speed, attack, defense      -> characteristics of each piece
+    back : (int, int)           -> column offset of a ball lost by each team
+    colors : (Color, Color)     -> color of each team
+    hash : int                  -> Zobrist hash of the position, see zobrist
+
+    METHODS :
+    next_player() : int         -> index of the team to play
+    legal_moves()               -> list of the encoded moves of the next player
+    blockers(square)            -> face off opponents of every displacement or pass from the square
+    sample_outcome(move, rng)   -> random face off outcome of a move, NO_FACE_OFF if there is none
+    make_move(move, outcome)    -> applies a move, in place
+    play(move, outcome)         -> applies a move for good, without keeping it on the undo stack
+    unmake_move(move)           -> takes back the last move made
+
+    A position is pickled without its undo stack, to be searched by another process.
+    winner()                    -> index of the winning team, -1 while the game goes on
+    """
+    __slots__ = ('board', 'square', 'death', 'moved', 'ball', 'decks', 'turn_count',
+                 'speed', 'attack', 'defense', 'back', 'colors', 'hash', '_undo', '_ply')
+
+    def __init__(self, piece_types, colors):
+        """
+        input : piece_types = list of the 12 rules.PieceType, colors = color of the two teams
+        output : empty position, to be filled by from_state or by hand
+        """
+        self.board = bytearray(NSQUARES)
+        self.square = [0] * NPIECES
+        self.death = [-1] * NPIECES
+        self.moved = 0
+        self.ball = 0
+        self.decks = [FULL_DECK, FULL_DECK]
+        self.turn_count = 0
+        self.speed = tuple(piece_type[0] for piece_type in piece_types)
+        self.attack = tuple(piece_type[1] for piece_type in piece_types)
+        self.defense = tuple(piece_type[2] for piece_type in piece_types)
+        self.colors = tuple(colors)
+        self.back = tuple(1 if color == Color.PINK else -1 for color in colors)
+        self.hash = 0
+        self._undo = None
+        self._ply = 0
+
+    @classmethod
+    def initial(cls, colors=(Color.BLUE, Color.PINK), rng=random):
+        """
+        input : color of the two teams in playing order, random generator choosing the ball holder
+        output : position of a new game, as rules.GameState would start it
+        """
+        teams = [Team(color) for color in colors]
+        for team in teams:
+            team.init_positions()
+        return cls.from_state(GameState(teams, rng))
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        input : rules.GameState, refreshed
+        output : the same position in compact form
+        """
+        pieces = state.players[0].pieces + state.players[1].pieces
+        position = cls([piece.piece_type for piece in pieces], [player.color for player in state.players])
+        for index, piece in enumerate(pieces):
+            square = piece.position[0] * NCOLS + piece.position[1]
+            position.square[index] = square
+            position.board[square] = index + 1
+            position.death[index] = piece.turn_death if piece.is_down else -1
+            if piece.has_moved:
+                position.moved |= 1 << index
+        position.ball = state.ball_position[0] * NCOLS + state.ball_position[1]
+        position.decks = [deck_mask(player.strength_deck) for player in state.players]
+        position.turn_count = state.turn_count
+        position.hash = position_hash(position)
+        return position
+
+    def copy(self):
+        position = Position.__new__(Position)
+        position.board = bytearray(self.board)
+        position.square = self.square[:]
+        position.death = self.death[:]
+        position.moved = self.moved
+        position.ball = self.ball
+        position.decks = self.decks[:]
+        position.turn_count = self.turn_count
+        position.speed = self.speed
+        position.attack = self.attack
+        position.defense = self.defense
+        position.colors = self.colors
+        position.back = self.back
+        position.hash = self.hash
+        position._undo = None
+        position._ply = 0
+        return position
+
+    def __getstate__(self):
+        """
+        Pickled without the undo stack, so that a position is cheap to send to another process
+        """
+        if self._ply:
+            raise ValueError('a position is pickled with moves still to unmake')
+        return tuple(getattr(self, name) for name in self.__slots__[:-2])
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+        self._undo = None
+        self._ply = 0
+
+    def next_player(self):
+        return (self.turn_count // 2) % 2
+
+    def holder(self):
+        """
+        output : index of the piece holding the ball, -1 if the ball is free
+        """
+        return self.board[self.ball] - 1
+
+    def winner(self):
+        col = self.ball % NCOLS
+        if col < COLSAUX:
+            return self.colors.index(Color.PINK)
+        if col >= COLS + COLSAUX:
+            return self.colors.index(Color.BLUE)
+        return -1
+
+    def opponent_search(self, search_square, piece_square):
+        """
+        Same path as rules.GameState.opponent_search
+        output : index of the face off opponent, -1 if there is none
+        """
+        first = TEAM_SIZE * (1 - self.next_player())
+        face_off_opponent = -1
+        cells = PATH.get(piece_square * NSQUARES + search_square)
+        if cells is None:
+            cells = tables.path_cells(*divmod(piece_square, NCOLS), *divmod(search_square, NCOLS))
+        for _, _, cell in cells:
+            occupant = self.board[cell] - 1
+            if first <= occupant < first + TEAM_SIZE and self.death[occupant] < 0:
+                face_off_opponent = occupant
+        return face_off_opponent
+
+    def blockers(self, piece_square):
+        """
+        Same as rules.GameState.blockers, in a single pass over the opponents standing
+        output : {target square : index of the face off opponent}
+        """
+        found = {}
+        rank_found = {}
+        through = THROUGH[piece_square]
+        first = TEAM_SIZE * (1 - self.next_player())
+        for opponent in range(first, first + TEAM_SIZE):
+            if self.death[opponent] < 0:
+                for target, rank in through.get(self.square[opponent], ()):
+                    if rank > rank_found.get(target, -1):
+                        found[target] = opponent
+                        rank_found[target] = rank
+        return found
+
+    def generate_displacement(self, piece, moves):
+        """
+        Appends to moves the displacements and tackles of the piece, in the order of rules.GameState
+        """
+        team = self.next_player()
+        if piece // TEAM_SIZE != team or self.death[piece] >= 0 or self.moved >> piece & 1:
+            return
+        first = TEAM_SIZE * (1 - team)
+        holder = self.board[self.ball] - 1
+        board = self.board
+        piece_square = self.square[piece]
+        blockers = self.blockers(piece_square)
+        for _, _, square in REACH[team][self.speed[piece]][piece_square]:
+            occupant = board[square] - 1
+            if occupant < 0:
+                moves.append(encode(DISPLACEMENT, piece, square, blockers.get(square, -1)))
+            elif occupant == holder and first <= occupant < first + TEAM_SIZE:
+                moves.append(encode(TACKLE, piece, square, occupant))
+
+    def generate_pass(self, piece, moves):
+        """
+        Appends to moves the passes of the piece, in the order of rules.GameState
+        """
+        team = self.next_player()
+        piece_square = self.square[piece]
+        if piece // TEAM_SIZE != team or self.death[piece] >= 0 or self.ball != piece_square:
+            return
+        first = TEAM_SIZE * team
+        blockers = self.blockers(piece_square)
+        row, col = divmod(piece_square, NCOLS)
+        if team == 0:
+            mini, maxi = max(1, col - 2), col
+        else:
+            mini, maxi = min(COLS + 4, col + 1), min(COLS + 4, col + 3)
+        for i in range(max(1, row - 2), min(ROWS + 1, row + 3)):
+            for j in range(mini, maxi):
+                square = i * NCOLS + j
+                occupant = self.board[square] - 1
+                if first <= occupant < first + TEAM_SIZE:
+                    moves.append(encode(PASS, piece, square, blockers.get(square, -1)))
+
+    def legal_moves(self):
+        moves = []
+        first = TEAM_SIZE * self.next_player()
+        for piece in range(first, first + TEAM_SIZE):
+            self.generate_displacement(piece, moves)
+            self.generate_pass(piece, moves)
+        return moves or [SKIP_MOVE]
+
+    def sample_outcome(self, move, rng=random):
+        """
+        output : random outcome of the face off of the move, NO_FACE_OFF if there is none
+        """
+        opponent = move_opponent(move)
+        if opponent < 0 or move & 3 == PASS:
+            return NO_FACE_OFF
+        team = self.next_player()
+        return face_off_outcome(self.decks[team], self.decks[1 - team],
+                                self.attack[move_piece(move)], self.defense[opponent], rng)
+
+    def _relocate(self, piece, square):
+        self.board[self.square[piece]] = 0
+        self.board[square] = piece + 1
+        self.square[piece] = square
+
+    def make_move(self, move, outcome=NO_FACE_OFF):
+        """
+        input : encoded move, outcome of its face off if any
+        action : the move is applied in place and can be taken back by unmake_move
+        """
+        kind = move & 3
+        piece = move >> 2 & 15
+        square = move >> 6 & 255
+        opponent = (move >> 14) - 1
+        team = (self.turn_count // 2) % 2
+        death = self.death
+        undo = self._undo
+        if undo is None:
+            # allocated on the first move, a position often being only read
+            undo = self._undo = [0] * (FRAME * MAX_PLY)
+        base = self._ply * FRAME
+        self._ply += 1
+        undo[base] = self.ball
+        undo[base + 1] = self.moved
+        undo[base + 2] = self.decks[0]
+        undo[base + 3] = self.decks[1]
+        undo[base + 4] = self.turn_count
+        undo[base + 5] = self.square[piece]
+        undo[base + 6] = death[piece]
+        undo[base + 7] = death[opponent] if opponent >= 0 else -1
+        undo[base + 9] = self.hash
+
+        if kind == PASS:
+            self.ball = square
+        elif kind == SKIP:
+            if self.turn_count % 2 == 1:
+                self.moved &= ~(TEAM_MASK << (TEAM_SIZE * team))
+            self.turn_count += 1
+        else:
+            result = outcome & 3
+            if result:
+                self.decks[team] = outcome >> 2 & FULL_DECK
+                self.decks[1 - team] = outcome >> 7 & FULL_DECK
+            if kind == DISPLACEMENT:
+                had_ball = self.ball == self.square[piece]
+                if result == DEFENSE:
+                    if had_ball:
+                        self.ball = self.square[piece] + self.back[team]
+                    death[piece] = self.turn_count
+                else:
+                    self._relocate(piece, square)
+                    if had_ball:
+                        self.ball = square
+                    if result:
+                        death[opponent] = self.turn_count
+                self.moved |= 1 << piece
+            elif result == DEFENSE:
+                death[piece] = self.turn_count
+            else:
+                death[opponent] = self.turn_count
+                if result == PERFECT:
+                    self.ball = self.square[piece]
+                else:
+                    self.ball = self.square[opponent] + self.back[1 - team]
+            if self.turn_count % 2 == 1:
+                self.moved &= ~(TEAM_MASK << (TEAM_SIZE * team))
+            self.turn_count += 1
+
+        # the keys of what has changed, as saved in the undo frame, are xored out and the new ones in
+        key = undo[base + 9]
+        if self.ball != undo[base]:
+            key ^= BALL[undo[base]] ^ BALL[self.ball]
+        if kind != PASS:
+            key ^= MOVED_MASK[undo[base + 1]] ^ MOVED_MASK[self.moved] \
+                ^ turn_key(undo[base + 4]) ^ turn_key(self.turn_count)
+            if outcome & 3:
+                key ^= DECK[0][undo[base + 2]] ^ DECK[0][self.decks[0]] \
+                    ^ DECK[1][undo[base + 3]] ^ DECK[1][self.decks[1]]
+            if self.square[piece] != undo[base + 5]:
+                key ^= PIECE_SQUARE[piece][undo[base + 5]] ^ PIECE_SQUARE[piece][self.square[piece]]
+            if death[piece] != undo[base + 6]:
+                key ^= down_key(piece, death[piece])
+            if opponent >= 0 and death[opponent] != undo[base + 7]:
+                if undo[base + 7] >= 0:
+                    key ^= down_key(opponent, undo[base + 7])
+                key ^= down_key(opponent, death[opponent])
+
+        # pieces down for long enough come back up
+        revived = 0
+        turn_count = self.turn_count
+        for index in range(NPIECES):
+            if -1 < death[index] and death[index] + 3 < turn_count:
+                revived |= 1 << index
+                undo[base + 10 + index] = death[index]
+                key ^= down_key(index, death[index])
+                death[index] = -1
+        undo[base + 8] = revived
+        self.hash = key
+
+    def play(self, move, outcome=NO_FACE_OFF):
+        """
+        Applies a move for good, as in a game : it is not kept on the undo stack and cannot be unmade,
+        so that games of any length can be played. Not to be used while moves are made and not unmade yet.
+        """
+        self.make_move(move, outcome)
+        self._ply -= 1
+
+    def unmake_move(self, move):
+        """
+        input : the last move made
+        action : the position is restored as it was before the move
+        """
+        piece = move >> 2 & 15
+        opponent = (move >> 14) - 1
+        self._ply -= 1
+        base = self._ply * FRAME
+        undo = self._undo
+        death = self.death
+        revived = undo[base + 8]
+        index = 0
+        while revived:
+            if revived & 1:
+                death[index] = undo[base + 10 + index]
+            revived >>= 1
+            index += 1
+        self.ball = undo[base]
+        self.moved = undo[base + 1]
+        self.decks[0] = undo[base + 2]
+        self.decks[1] = undo[base + 3]
+        self.turn_count = undo[base + 4]
+        self.hash = undo[base + 9]
+        if self.square[piece] != undo[base + 5]:
+            self._relocate(piece, undo[base + 5])
+        death[piece] = undo[base + 6]
+        if opponent >= 0:
+            death[opponent] = undo[base + 7]
+
+    def key(self):
+        """
+        output : hashable summary of the position, equal for equal positions
+        """
+        return (bytes(self.board), tuple(self.death), self.moved, self.ball,
+                self.decks[0], self.decks[1], self.turn_count)
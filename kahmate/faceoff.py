@@ -0,0 +1,112 @@
+"""
+Exact probabilities of a face off, from the strength decks left.
+
+`rules.GameState.face_off` draws one card from each deck, and draws again on a
+tie. As a deck is a set of at most 5 cards, every outcome can be enumerated:
+`distribution` gives the exact probability of each result together with the
+decks left after it, memoized on (attack deck, defense deck, attack, defense),
+with the decks as the bitmasks of `engine`.
+"""
+import functools
+from fractions import Fraction
+from kahmate.rules import PERFECT_TACKLE, ATTACK_WINS, DEFENSE_WINS
+from kahmate.engine import FULL_DECK, PERFECT, ATTACK, DEFENSE, encode_outcome
+
+
+RESULT_NAMES = {PERFECT: PERFECT_TACKLE, ATTACK: ATTACK_WINS, DEFENSE: DEFENSE_WINS}
+
+
+def draws(deck):
+    """
+    input : deck bitmask
+    output : list of (card, deck bitmask left), each equally likely, the deck being refilled once empty
+    """
+    ans = []
+    for card in range(1, 6):
+        if deck >> (card - 1) & 1:
+            left = deck & ~(1 << (card - 1))
+            ans.append((card, left or FULL_DECK))
+    return ans
+
+
+@functools.lru_cache(maxsize=None)
+def distribution(attack_deck, defense_deck, attack, defense):
+    """
+    input : deck bitmasks of the attacking and defending teams, attack of the attacking piece,
+        defense of the defending piece
+    output : tuple of (probability as a Fraction, result, attack deck left, defense deck left),
+        one entry per distinct outcome
+    """
+    outcomes = {}
+
+    def add(probability, result, attack_left, defense_left):
+        key = (result, attack_left, defense_left)
+        outcomes[key] = outcomes.get(key, 0) + probability
+
+    attack_draws = draws(attack_deck)
+    defense_draws = draws(defense_deck)
+    first = Fraction(1, len(attack_draws) * len(defense_draws))
+    for attack_strength, attack_left in attack_draws:
+        for defense_strength, defense_left in defense_draws:
+            attack_score = attack_strength + attack
+            defense_score = defense_strength + defense
+            if attack_score >= defense_score + 2:
+                add(first, PERFECT, attack_left, defense_left)
+            elif defense_score + 2 > attack_score > defense_score:
+                add(first, ATTACK, attack_left, defense_left)
+            elif defense_score > attack_score:
+                add(first, DEFENSE, attack_left, defense_left)
+            else:
+                second_attack = draws(attack_left)
+                second_defense = draws(defense_left)
+                second = first / (len(second_attack) * len(second_defense))
+                for attack_pick, attack_last in second_attack:
+                    for defense_pick, defense_last in second_defense:
+                        result = ATTACK if attack_pick + attack > defense_pick + defense else DEFENSE
+                        add(second, result, attack_last, defense_last)
+    return tuple((probability, result, attack_left, defense_left)
+                 for (result, attack_left, defense_left), probability in sorted(outcomes.items()))
+
+
+@functools.lru_cache(maxsize=None)
+def result_probabilities(attack_deck, defense_deck, attack, defense):
+    """
+    output : {"Plaquage parfait!" : p, "Attack wins!" : p, "Defense wins!" : p}, exact Fractions
+    """
+    ans = {name: Fraction(0) for name in RESULT_NAMES.values()}
+    for probability, result, _, _ in distribution(attack_deck, defense_deck, attack, defense):
+        ans[RESULT_NAMES[result]] += probability
+    return ans
+
+
+@functools.lru_cache(maxsize=None)
+def deck_distribution(attack_deck, defense_deck, attack, defense, result):
+    """
+    output : {(attack deck left, defense deck left) : probability knowing the result}
+    """
+    total = Fraction(0)
+    decks = {}
+    for probability, outcome_result, attack_left, defense_left in distribution(attack_deck, defense_deck,
+                                                                                attack, defense):
+        if outcome_result == result:
+            total += probability
+            decks[(attack_left, defense_left)] = decks.get((attack_left, defense_left), 0) + probability
+    return {key: probability / total for key, probability in decks.items()}
+
+
+@functools.lru_cache(maxsize=None)
+def result_chances(attack_deck, defense_deck, attack, defense):
+    """
+    For a search : one branch per possible result, with its exact probability as a float
+    and the most likely decks left after it.
+    output : tuple of (probability, engine face off outcome)
+    """
+    probabilities = result_probabilities(attack_deck, defense_deck, attack, defense)
+    ans = []
+    for result in (PERFECT, ATTACK, DEFENSE):
+        probability = probabilities[RESULT_NAMES[result]]
+        if probability:
+            decks = deck_distribution(attack_deck, defense_deck, attack, defense, result)
+            attack_left, defense_left = max(decks, key=decks.get)
+            ans.append((float(probability), encode_outcome(result, attack_left, defense_left)))
+    return tuple(ans)
@@ -0,0 +1,189 @@
+"""
+Immutable positions, for the nodes of search trees kept in memory.
+
+A `FrozenPosition` is an int packing everything an `engine.Position` holds that changes along a game,
+in 179 bits, 60 bytes for a node. What never changes is shared by every node: the characteristics
+of the pieces come from the colors, and the moves are generated and played by one scratch
+engine.Position per order of the colors, loaded with the node being expanded. A move gives a new
+FrozenPosition, its parent being left as it was. As an int, a node is hashed and compared by value,
+so that nodes key dictionaries and transpositions are found.
+
+From the low bits:
+- turn count : 16 bits
+- first team : 1 bit, set when PINK plays first
+- decks : 5 bits each, as in engine.Position
+- ball : 8 bits, square of the ball
+- moved : 12 bits, as in engine.Position
+- squares : 8 bits per piece
+- down : 3 bits per piece, 0 when it is up, 1 + turns since it went down otherwise
+
+    root = FrozenPosition.from_state(game.state)
+    child = root.play(move, outcome)            # root is left as it was
+    visits[child] = visits.get(child, 0) + 1
+"""
+from kahmate.settings import *
+from kahmate import engine
+from kahmate.engine import NPIECES, NCOLS, FULL_DECK, NO_FACE_OFF
+from kahmate.rules import Color, Team
+from kahmate.zobrist import position_hash
+
+
+FIRST = 16
+DECKS = 17
+BALL = 27
+MOVED = 35
+SQUARES = 47
+DOWN = SQUARES + 8 * NPIECES
+# a piece comes back up once it has been down for more than 3 turns
+MAX_AGE = 6
+
+ORDERS = ((Color.BLUE, Color.PINK), (Color.PINK, Color.BLUE))
+PIECE_TYPES = tuple(tuple(piece.piece_type for color in colors for piece in Team(color).pieces) for colors in ORDERS)
+
+# scratch engine.Position of each order of the colors, and the node it holds
+_scratch = [None, None]
+_loaded = [None, None]
+
+
+class FrozenPosition(int):
+    """
+    PARAMETERS :
+    turn_count, decks, ball, moved, colors -> as in engine.Position
+
+    METHODS :
+    from_position(position)     -> node of an engine.Position
+    from_state(state)           -> node of a rules.GameState
+    thaw()                      -> new engine.Position of the node
+    square(piece), death(piece) -> as in engine.Position
+    next_player(), holder(), winner()
+    legal_moves()               -> encoded moves of the next player
+    play(move, outcome)         -> node reached by the move, the node itself being unchanged
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_position(cls, position):
+        """
+        input : engine.Position
+        raise : ValueError if a piece has been down for longer than MAX_AGE turns
+        """
+        turn_count = position.turn_count
+        down = 0
+        for piece, death in enumerate(position.death):
+            if death >= 0:
+                if not 0 <= turn_count - death <= MAX_AGE:
+                    raise ValueError(f'piece {piece} down at turn {death}, turn {turn_count}')
+                down |= (turn_count - death + 1) << 3 * piece
+        return int.__new__(cls, turn_count | (position.colors[0] == Color.PINK) << FIRST
+                           | position.decks[0] << DECKS | position.decks[1] << DECKS + 5 | position.ball << BALL
+                           | position.moved << MOVED | int.from_bytes(bytes(position.square), 'little') << SQUARES
+                           | down << DOWN)
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        input : rules.GameState, refreshed
+        """
+        return cls.from_position(engine.Position.from_state(state))
+
+    @property
+    def turn_count(self):
+        return self & 0xffff
+
+    @property
+    def colors(self):
+        return ORDERS[self >> FIRST & 1]
+
+    @property
+    def decks(self):
+        return [self >> DECKS & FULL_DECK, self >> DECKS + 5 & FULL_DECK]
+
+    @property
+    def ball(self):
+        return self >> BALL & 255
+
+    @property
+    def moved(self):
+        return self >> MOVED & 0xfff
+
+    def square(self, piece):
+        return self >> SQUARES + 8 * piece & 255
+
+    def death(self, piece):
+        age = self >> DOWN + 3 * piece & 7
+        return self.turn_count - age + 1 if age else -1
+
+    def next_player(self):
+        return (self.turn_count // 2) % 2
+
+    def holder(self):
+        """
+        output : index of the piece holding the ball, -1 if the ball is free
+        """
+        ball = self.ball
+        squares = (self >> SQUARES).to_bytes(NPIECES + 5, 'little')
+        return squares.find(ball, 0, NPIECES)
+
+    def winner(self):
+        col = self.ball % NCOLS
+        if col < COLSAUX:
+            return self.colors.index(Color.PINK)
+        if col >= COLS + COLSAUX:
+            return self.colors.index(Color.BLUE)
+        return -1
+
+    def _fill(self, position):
+        """
+        Loads the node into an engine.Position of the same colors
+        """
+        board = position.board
+        for square in position.square:
+            board[square] = 0
+        position.square[:] = (self >> SQUARES & (1 << 8 * NPIECES) - 1).to_bytes(NPIECES, 'little')
+        for piece, square in enumerate(position.square):
+            board[square] = piece + 1
+        position.death[:] = [self.death(piece) for piece in range(NPIECES)]
+        position.moved = self.moved
+        position.ball = self.ball
+        position.decks[:] = self.decks
+        position.turn_count = self.turn_count
+        position.hash = position_hash(position)
+
+    def thaw(self):
+        """
+        output : new engine.Position of the node
+        """
+        first = self >> FIRST & 1
+        position = engine.Position(PIECE_TYPES[first], ORDERS[first])
+        self._fill(position)
+        return position
+
+    def _load(self):
+        """
+        output : the scratch engine.Position of the colors, holding the node
+        """
+        first = self >> FIRST & 1
+        if _loaded[first] != self:
+            if _scratch[first] is None:
+                _scratch[first] = engine.Position(PIECE_TYPES[first], ORDERS[first])
+            self._fill(_scratch[first])
+            _loaded[first] = int(self)
+        return _scratch[first]
+
+    def legal_moves(self):
+        return self._load().legal_moves()
+
+    def play(self, move, outcome=NO_FACE_OFF):
+        """
+        input : encoded move, outcome of its face off if any
+        output : the node reached
+        """
+        position = self._load()
+        position.make_move(move, outcome)
+        try:
+            return FrozenPosition.from_position(position)
+        finally:
+            position.unmake_move(move)
+
+    def __repr__(self):
+        return f'FrozenPosition(turn {self.turn_count}, ball {divmod(self.ball, NCOLS)})'
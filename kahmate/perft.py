@@ -0,0 +1,269 @@
+"""
+Perft : counts the positions reached from a position down to a given depth, to check a move generator
+against another one and to measure the speed of the engine.
+
+A ply is one move of the next player. A move with a face off leads to one branch per distinct outcome
+of `faceoff.distribution` (result and decks left), and a position where a team has scored has no moves.
+The leaves are counted by the kind of the move leading to them, the face off branches and the tries
+being counted apart as well.
+
+Two move generators are counted:
+- engine : `engine.Position`, its moves made and unmade in place
+- rules : `rules.GameState`, whose generate_displacement and generate_pass give the moves of main.Game,
+  copied for each branch as a ForcedState, its face off forced to the outcome of the branch
+Divide gives the count below each root move, so that two generators are compared move by move.
+
+    python -m kahmate.perft --depth 3                       # engine counts and nodes per second
+    python -m kahmate.perft --depth 2 --plies 30 --divide   # count below each root move
+    python -m kahmate.perft --depth 2 --compare             # engine against rules, move by move
+"""
+import argparse
+import copy
+import functools
+import random
+import time
+from collections import Counter
+from kahmate import engine, faceoff
+from kahmate.engine import CARDS, FULL_DECK, NCOLS, NO_FACE_OFF
+from kahmate.rules import KIND_NAMES, PASS, SKIP, Color, GameState, Team
+
+
+COUNTERS = ('nodes', 'displacement', 'pass', 'tackle', 'skip', 'face_offs', 'tries')
+
+
+@functools.lru_cache(maxsize=None)
+def face_off_outcomes(attack_deck, defense_deck, attack, defense):
+    """
+    output : tuple of the distinct engine outcomes of a face off
+    """
+    return tuple(engine.encode_outcome(result, attack_left, defense_left)
+                 for _, result, attack_left, defense_left in faceoff.distribution(attack_deck, defense_deck,
+                                                                                  attack, defense))
+
+
+def move_name(move):
+    """
+    output : encoded move as text, "kind piece row,col" with the pieces numbered as in engine.Position
+    """
+    kind = engine.move_kind(move)
+    if kind == SKIP:
+        return 'skip'
+    row, col = divmod(engine.move_square(move), NCOLS)
+    return f'{KIND_NAMES[kind]} {engine.move_piece(move)} {row},{col}'
+
+
+def has_face_off(move):
+    return engine.move_opponent(move) >= 0 and move & 3 != PASS
+
+
+class EngineTree:
+    """
+    Moves of an engine.Position, made and unmade in place
+
+    METHODS :
+    moves()                     -> encoded moves of the current position
+    branches(move)              -> generator of the outcomes of the move, the position being the one reached
+                                   while each one is handled
+    over()                      -> True once a team has scored
+    """
+    def __init__(self, position):
+        self.position = position
+
+    def moves(self):
+        return self.position.legal_moves()
+
+    def branches(self, move):
+        position = self.position
+        outcomes = (NO_FACE_OFF,)
+        if has_face_off(move):
+            team = position.next_player()
+            outcomes = face_off_outcomes(position.decks[team], position.decks[1 - team],
+                                         position.attack[engine.move_piece(move)],
+                                         position.defense[engine.move_opponent(move)])
+        for outcome in outcomes:
+            position.make_move(move, outcome)
+            try:
+                yield outcome
+            finally:
+                position.unmake_move(move)
+
+    def over(self):
+        return self.position.winner() >= 0
+
+
+class RulesTree:
+    """
+    Moves of a rules.GameState, encoded as the engine moves, each branch played on a copy of the state
+    """
+    def __init__(self, state):
+        self.state = state
+
+    def moves(self):
+        return [engine.from_rules_move(self.state, move) for move in self.state.legal_moves()]
+
+    def branches(self, move):
+        state = self.state
+        outcomes = (NO_FACE_OFF,)
+        if has_face_off(move):
+            pieces = state.players[0].pieces + state.players[1].pieces
+            decks = state.deck_masks()
+            team = state._next_player
+            outcomes = face_off_outcomes(decks[team], decks[1 - team], pieces[engine.move_piece(move)].attack,
+                                         pieces[engine.move_opponent(move)].defense)
+        for outcome in outcomes:
+            self.state = play_rules(state, move, outcome)
+            try:
+                yield outcome
+            finally:
+                self.state = state
+
+    def over(self):
+        return self.state.winner() is not None
+
+
+class ForcedState(GameState):
+    """
+    rules.GameState whose face offs give the engine outcome it holds instead of drawing the cards,
+    the last cards drawn being left as they were
+
+    PARAMETERS :
+    outcome : int               -> outcome of the next face off, as encoded by engine.encode_outcome
+    """
+    outcome = NO_FACE_OFF
+
+    def _face_off(self, attack_player, defense_player, attack_piece, defense_piece):
+        attack_player.strength_deck = list(CARDS[self.outcome >> 2 & FULL_DECK])
+        defense_player.strength_deck = list(CARDS[self.outcome >> 7 & FULL_DECK])
+        return faceoff.RESULT_NAMES[engine.outcome_result(self.outcome)]
+
+
+def play_rules(state, move, outcome=NO_FACE_OFF):
+    """
+    input : rules.GameState, encoded move, outcome of its face off if any
+    output : ForcedState copy of the state once the move is played, its face off giving the outcome
+    """
+    child = copy.deepcopy(state)
+    child.__class__ = ForcedState
+    child.outcome = outcome
+    child.play(engine.to_rules_move(child, move))
+    return child
+
+
+def _count(tree, depth, counts):
+    if tree.over():
+        return
+    for move in tree.moves():
+        for outcome in tree.branches(move):
+            if depth > 1:
+                _count(tree, depth - 1, counts)
+                continue
+            counts['nodes'] += 1
+            counts[KIND_NAMES[move & 3]] += 1
+            if outcome != NO_FACE_OFF:
+                counts['face_offs'] += 1
+            if tree.over():
+                counts['tries'] += 1
+
+
+def perft(tree, depth):
+    """
+    input : EngineTree or RulesTree, depth in plies
+    output : Counter of the leaves, see COUNTERS
+    """
+    counts = Counter(dict.fromkeys(COUNTERS, 0))
+    if depth == 0:
+        counts['nodes'] = 1
+    else:
+        _count(tree, depth, counts)
+    return counts
+
+
+def divide(tree, depth):
+    """
+    input : EngineTree or RulesTree, depth in plies, at least 1
+    output : {encoded root move : Counter of the leaves below it}
+    """
+    ans = {}
+    for move in ([] if tree.over() else tree.moves()):
+        counts = Counter(dict.fromkeys(COUNTERS, 0))
+        for outcome in tree.branches(move):
+            below = perft(tree, depth - 1)
+            if depth == 1:
+                below[KIND_NAMES[move & 3]] += 1
+                below['face_offs'] += outcome != NO_FACE_OFF
+                below['tries'] += tree.over()
+            counts.update(below)
+        ans[move] = counts
+    return ans
+
+
+def compare(state, depth):
+    """
+    input : rules.GameState, depth in plies
+    output : list of (move name, engine count, rules count) of the root moves whose counts differ,
+        a count being None when the move is missing
+    """
+    engine_counts = divide(EngineTree(engine.Position.from_state(state)), depth)
+    rules_counts = divide(RulesTree(state), depth)
+    return [(move_name(move), engine_counts.get(move), rules_counts.get(move))
+            for move in sorted(engine_counts.keys() | rules_counts.keys(), key=move_name)
+            if engine_counts.get(move) != rules_counts.get(move)]
+
+
+def start_state(seed=0, plies=0):
+    """
+    output : rules.GameState of a new game from the seed, then played at random for a number of plies
+    """
+    rng = random.Random(seed)
+    teams = [Team(Color.BLUE), Team(Color.PINK)]
+    for team in teams:
+        team.init_positions()
+    state = GameState(teams, rng)
+    for _ in range(plies):
+        if state.winner() is not None:
+            break
+        state.play(rng.choice(state.legal_moves()))
+    return state
+
+
+def format_counts(counts):
+    return '  '.join(f'{name} {counts[name]}' for name in COUNTERS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0, help='seed of the game')
+    parser.add_argument('--plies', type=int, default=0, help='random plies played from the start of the game')
+    parser.add_argument('--generator', default='engine', choices=['engine', 'rules'])
+    parser.add_argument('--divide', action='store_true', help='count below each root move')
+    parser.add_argument('--compare', action='store_true', help='divide with both generators, show the differences')
+    args = parser.parse_args(argv)
+
+    state = start_state(args.seed, args.plies)
+    if args.compare:
+        differences = compare(state, args.depth)
+        for name, engine_counts, rules_counts in differences:
+            print(f'{name}\n    engine  {format_counts(engine_counts) if engine_counts else "missing"}'
+                  f'\n    rules   {format_counts(rules_counts) if rules_counts else "missing"}')
+        print(f'{len(differences)} root moves differ')
+        return 1 if differences else 0
+
+    tree = EngineTree(engine.Position.from_state(state)) if args.generator == 'engine' else RulesTree(state)
+    start = time.perf_counter()
+    if args.divide:
+        moves = divide(tree, args.depth)
+        counts = Counter(dict.fromkeys(COUNTERS, 0))
+        for move in sorted(moves, key=move_name):
+            print(f'{move_name(move)}: {moves[move]["nodes"]}')
+            counts.update(moves[move])
+    else:
+        counts = perft(tree, args.depth)
+    elapsed = time.perf_counter() - start
+    print(format_counts(counts))
+    print(f'{elapsed:.2f} s  {counts["nodes"] / elapsed if elapsed else 0:,.0f} nodes/s')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,94 @@
+"""
+Frame time instrumentation of the pygame front-end.
+
+`FrameStats` times the phases of each frame of the main loop (event handling,
+move generation, Move.play, update, draw) and keeps the last frames to give
+percentiles of the frame time and of the frame rate.
+"""
+import collections
+import contextlib
+import time
+
+
+def percentile(values, p):
+    """
+    input : values, percentage between 0 and 100
+    output : nearest-rank percentile of the values, 0 if there are none
+    """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class FrameStats:
+    """
+    PARAMETERS :
+    frames : deque              -> busy time of the last frames, in seconds, waiting for events excluded
+    intervals : deque           -> time between the ends of the last frames, in seconds, the frames following
+                                   a wait for events left out
+    phases : dict               -> {phase : deque of its time in the last frames}
+
+    METHODS :
+    start_frame(waited)         -> a frame begins, once the events have arrived, waited = True if the loop
+                                   slept until they did
+    phase(name)                 -> context manager timing a phase of the current frame
+    end_frame()                 -> the frame is over, its times are recorded
+    summary()                   -> {name : (p50, p95, p99)} in milliseconds, and the fps percentiles
+    report()                    -> one line summary, for a log or an overlay
+    """
+    def __init__(self, history=600):
+        self.history = history
+        self.frames = collections.deque(maxlen=history)
+        self.intervals = collections.deque(maxlen=history)
+        self.phases = {}
+        self._current = {}
+        self._start = None
+        self._last_end = None
+
+    def start_frame(self, waited=False):
+        self._start = time.perf_counter()
+        self._current = {}
+        if waited:
+            # the time asleep is not a frame time, the rate only counts frames drawn one after the other
+            self._last_end = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._current[name] = self._current.get(name, 0) + time.perf_counter() - start
+
+    def end_frame(self):
+        end = time.perf_counter()
+        if self._start is not None:
+            self.frames.append(end - self._start)
+        if self._last_end is not None:
+            self.intervals.append(end - self._last_end)
+        self._last_end = end
+        for name, duration in self._current.items():
+            if name not in self.phases:
+                self.phases[name] = collections.deque(maxlen=self.history)
+            self.phases[name].append(duration)
+        self._current = {}
+        self._start = None
+
+    def summary(self):
+        summary = {'frame': tuple(1000 * percentile(self.frames, p) for p in (50, 95, 99))}
+        for name, durations in self.phases.items():
+            summary[name] = tuple(1000 * percentile(durations, p) for p in (50, 95, 99))
+        # the slowest frames give the lowest rates
+        summary['fps'] = tuple(1 / interval if interval else 0
+                               for interval in (percentile(self.intervals, p) for p in (50, 95, 99)))
+        return summary
+
+    def report(self):
+        summary = self.summary()
+        frame = summary.pop('frame')
+        fps = summary.pop('fps')
+        ans = f'frame {frame[0]:.2f}/{frame[1]:.2f}/{frame[2]:.2f} ms  fps {fps[0]:.0f}/{fps[1]:.0f}/{fps[2]:.0f}'
+        for name, times in summary.items():
+            ans += f'  {name} {times[0]:.2f}/{times[1]:.2f}'
+        return ans
@@ -0,0 +1,230 @@
+"""
+Binary records of whole games, streamed from files holding any number of them.
+
+A file starts with MAGIC, then each game is a fixed-size header followed by its moves:
+- header : seed, length of the moves in bytes, flags (bit 0 when the first team is PINK),
+  square of each of the 12 pieces, piece given the ball, winner (-1 for none) and number of moves
+- each move : 2 bytes, kind | piece << 2 | square << 6, bit 14 set when a face off outcome follows
+- the outcome of a face off : 2 bytes, the engine outcome (result and decks left) | opponent << 12
+
+The outcome is stored rather than the cards drawn, so that a game replays exactly without any
+random generator. The length of the moves lets a reader skip a game without decoding it.
+
+    for record in read_games('games.kahmate'):
+        if record.winner == 0:
+            replay = Replay(record)
+            position = replay.seek_turn(40)
+"""
+import bisect
+import struct
+from kahmate import engine
+from kahmate.engine import NO_FACE_OFF, RESULTS
+from kahmate.rules import PASS, SKIP, Color, Team
+from kahmate.zobrist import position_hash
+
+
+MAGIC = b'KAHMATE\x01'
+HEADER = struct.Struct('<IIB12sBbH')
+WORD = struct.Struct('<H')
+FACE_OFF = 1 << 14
+SNAPSHOT_INTERVAL = 32
+
+
+class GameRecord:
+    """
+    PARAMETERS :
+    seed : int                  -> seed the game was played with, 0 if unknown
+    colors : (Color, Color)     -> color of each team, in playing order
+    squares : bytes             -> initial square of each piece, in the order of engine.Position
+    first_holder : int          -> piece given the ball
+    winner : int                -> index of the winning team, -1 if the game was not won
+    count : int                 -> number of moves
+    payload : bytes             -> the encoded moves
+
+    METHODS :
+    from_state(state, seed)     -> record of a game played on a rules.GameState
+    from_moves(position, moves, seed) -> record of engine moves played from an initial engine.Position
+    initial_position()          -> engine.Position the game started from
+    moves()                     -> generator of the (encoded move, outcome) played, as for Position.make_move
+    to_bytes()
+    """
+    def __init__(self, seed, colors, squares, first_holder, winner, count, payload):
+        self.seed = seed
+        self.colors = tuple(colors)
+        self.squares = bytes(squares)
+        self.first_holder = first_holder
+        self.winner = winner
+        self.count = count
+        self.payload = bytes(payload)
+
+    @classmethod
+    def from_moves(cls, position, moves, seed=0, winner=None):
+        """
+        input : initial engine.Position (ball held by a piece), list of (encoded move, outcome),
+            seed of the game, winner (by default, replayed from the moves)
+        """
+        payload = bytearray()
+        final = position.copy()
+        for move, outcome in moves:
+            payload += encode_move(move, outcome)
+            if winner is None:
+                final.play(move, outcome)
+        if winner is None:
+            winner = final.winner()
+        return cls(seed, position.colors, bytes(position.square), position.holder(), winner, len(moves), payload)
+
+    @classmethod
+    def from_state(cls, state, seed=0):
+        """
+        input : rules.GameState, played from its creation, seed it was created with
+        """
+        payload = bytearray()
+        for kind, piece, square, opponent, result, decks in state.history:
+            if kind == SKIP:
+                move, outcome = engine.SKIP_MOVE, NO_FACE_OFF
+            else:
+                move = engine.encode(kind, piece, square, opponent if result is not None else -1)
+                outcome = NO_FACE_OFF
+                if result is not None:
+                    team = piece // engine.TEAM_SIZE
+                    outcome = engine.encode_outcome(RESULTS[result], decks[team], decks[1 - team])
+            payload += encode_move(move, outcome)
+        winner = state.winner()
+        winner = -1 if winner is None else [player.color for player in state.players].index(winner)
+        return cls(seed, [player.color for player in state.players], state.initial_squares, state.first_holder,
+                   winner, len(state.history), payload)
+
+    def initial_position(self):
+        """
+        output : engine.Position the game started from, full decks
+        """
+        piece_types = [piece.piece_type for color in self.colors for piece in Team(color).pieces]
+        position = engine.Position(piece_types, self.colors)
+        for piece, square in enumerate(self.squares):
+            position.square[piece] = square
+            position.board[square] = piece + 1
+        position.ball = self.squares[self.first_holder]
+        position.hash = position_hash(position)
+        return position
+
+    def moves(self):
+        """
+        output : generator of the (encoded move, outcome) of the game
+        """
+        payload = self.payload
+        index = 0
+        while index < len(payload):
+            word = payload[index] | payload[index + 1] << 8
+            index += 2
+            if word & FACE_OFF:
+                extra = payload[index] | payload[index + 1] << 8
+                index += 2
+                yield (engine.encode(word & 3, word >> 2 & 15, word >> 6 & 255, extra >> 12),
+                       extra & 0xfff)
+            else:
+                yield engine.encode(word & 3, word >> 2 & 15, word >> 6 & 255), NO_FACE_OFF
+
+    def to_bytes(self):
+        flags = 1 if self.colors[0] == Color.PINK else 0
+        return HEADER.pack(self.seed, len(self.payload), flags, self.squares, self.first_holder, self.winner,
+                           self.count) + self.payload
+
+
+def encode_move(move, outcome=NO_FACE_OFF):
+    """
+    input : encoded move and its face off outcome as played by engine.Position.make_move
+    output : bytes of the move in a record
+    """
+    word = move & 0x3fff
+    if outcome & 3:
+        return WORD.pack(word | FACE_OFF) + WORD.pack(outcome | engine.move_opponent(move) << 12)
+    return WORD.pack(word)
+
+
+def write_games(path, records, append=True):
+    """
+    input : path of the file, iterable of GameRecord, append to the file rather than overwriting it
+    output : number of games written
+    """
+    count = 0
+    with open(path, 'ab' if append else 'wb') as file:
+        if file.tell() == 0:
+            file.write(MAGIC)
+        for record in records:
+            file.write(record.to_bytes())
+            count += 1
+    return count
+
+
+def read_games(path, moves=True):
+    """
+    input : path of a file of records, moves = False to skip the moves and only read the headers
+    output : generator of the GameRecord of the file, read one at a time
+    """
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a file of game records')
+        while True:
+            header = file.read(HEADER.size)
+            if not header:
+                return
+            if len(header) < HEADER.size:
+                raise ValueError(f'{path} is truncated')
+            seed, length, flags, squares, first_holder, winner, count = HEADER.unpack(header)
+            if moves:
+                payload = file.read(length)
+                if len(payload) < length:
+                    raise ValueError(f'{path} is truncated')
+            else:
+                file.seek(length, 1)
+                payload = b''
+            colors = (Color.PINK, Color.BLUE) if flags & 1 else (Color.BLUE, Color.PINK)
+            yield GameRecord(seed, colors, squares, first_holder, winner, count, payload)
+
+
+class Replay:
+    """
+    Positions of a recorded game, reached from the closest snapshot rather than from the start.
+
+    PARAMETERS :
+    record : GameRecord
+    moves : list of (move, outcome) -> the moves of the game
+    turns : list of int         -> turn count before each move, and at the end
+    interval : int              -> number of moves between two snapshots
+
+    METHODS :
+    seek(ply) : engine.Position -> position after the first ply moves
+    seek_turn(turn)             -> position when the turn count first reaches turn
+    """
+    def __init__(self, record, interval=SNAPSHOT_INTERVAL):
+        self.record = record
+        self.moves = list(record.moves())
+        self.interval = interval
+        self.turns = [0]
+        for move, _ in self.moves:
+            self.turns.append(self.turns[-1] + (engine.move_kind(move) != PASS))
+        self._snapshots = [record.initial_position()]
+
+    def __len__(self):
+        return len(self.moves)
+
+    def seek(self, ply):
+        """
+        input : number of moves played, from 0 to len(self)
+        output : position once they are played
+        """
+        if not 0 <= ply <= len(self.moves):
+            raise IndexError(f'ply {ply} out of 0..{len(self.moves)}')
+        index = min(ply // self.interval, len(self._snapshots) - 1)
+        position = self._snapshots[index].copy()
+        for played in range(index * self.interval, ply):
+            position.play(*self.moves[played])
+            if (played + 1) % self.interval == 0 and (played + 1) // self.interval == len(self._snapshots):
+                self._snapshots.append(position.copy())
+        return position
+
+    def seek_turn(self, turn):
+        """
+        output : position before the first move of the turn count, or at the end of the game
+        """
+        return self.seek(min(bisect.bisect_left(self.turns, turn), len(self.moves)))
@@ -0,0 +1,57 @@
+"""
+Dirty rectangle rendering of the pygame front-end.
+
+The game describes what it draws over the static background as regions, each one
+a rectangle of the window with a hashable content. `DirtyTracker` compares them
+with the previous frame and returns the rectangles whose content changed, so that
+only those are pushed with pg.display.update(rects), and nothing at all is
+redrawn while the game is idle.
+"""
+import pygame as pg
+from kahmate.settings import *
+
+
+def square_rect(position):
+    """
+    input : [row, col] of a square
+    output : its rectangle in the window
+    """
+    return pg.Rect(position[1] * GRIDWIDTH, position[0] * GRIDWIDTH, GRIDWIDTH, GRIDWIDTH)
+
+
+class DirtyTracker:
+    """
+    PARAMETERS :
+    _contents : dict            -> {region : (rect, content)} of the last frame drawn
+    _full : boolean             -> the whole window has to be redrawn
+
+    METHODS :
+    invalidate()                -> the next frame will be redrawn entirely
+    dirty_rects(regions)        -> rectangles which changed since the last call
+    """
+    def __init__(self):
+        self._contents = {}
+        self._full = True
+
+    def invalidate(self):
+        self._full = True
+
+    def dirty_rects(self, regions):
+        """
+        input : {region : (rect, content)} of the frame to draw
+        output : list of the rectangles to redraw and push, empty if nothing changed
+        """
+        if self._full:
+            self._full = False
+            self._contents = regions
+            return [pg.Rect(0, 0, WIDTH, HEIGHT)]
+        rects = []
+        for region, (rect, content) in regions.items():
+            previous = self._contents.get(region)
+            if previous is None or previous[1] != content:
+                rects.append(rect)
+        for region, (rect, _) in self._contents.items():
+            if region not in regions:
+                rects.append(rect)
+        self._contents = regions
+        return rects
@@ -0,0 +1,323 @@
+"""
+Random playouts of many games at once, in lock-step, on NumPy arrays.
+
+A `Batch` holds the same fields as `engine.Position`, one row per game:
+- square : (games, 12) square of each piece
+- death : (games, 12) turn_death of each piece, -1 when it is up
+- moved : (games, 12) whether the piece has moved this turn
+- board : (games, NSQUARES) 0 for an empty square, piece + 1 otherwise
+- ball, turn : (games,) square of the ball and turn count
+- decks : (games, 2) bitmask of the cards left in each deck
+
+Every step, the next player of each game plays one of its legal moves picked
+uniformly at random, as `random.choice(position.legal_moves())` would: the
+moves are generated as in `engine.Position.legal_moves`, the face offs drawn as
+in `engine.face_off_outcome` and the moves applied as in `make_move`, for all
+the games together. The moves and outcomes use the encoding of `engine`.
+"""
+import numpy as np
+from kahmate.settings import *
+from kahmate.tables import NROWS, NCOLS, NSQUARES
+from kahmate.rules import DISPLACEMENT, PASS, TACKLE, SKIP, Color, REACH, PATH, SPEEDS
+from kahmate.engine import TEAM_SIZE, NPIECES, FULL_DECK, PERFECT, ATTACK, DEFENSE, SKIP_MOVE, CARDS
+
+
+MAX_TURNS = 400
+
+# displacements are described by their offset from the square of the piece
+OFFSETS = [(row, col) for row in range(-4, 5) for col in range(-4, 5) if 0 < abs(row) + abs(col) <= 4]
+OFFSET_INDEX = np.full((9, 9), -1, dtype=np.int16)
+for _index, (_row, _col) in enumerate(OFFSETS):
+    OFFSET_INDEX[_row + 4, _col + 4] = _index
+
+# TARGET[team, speed, square, offset] = square reached, -1 if the piece cannot go there
+TARGET = np.full((2, max(SPEEDS) + 1, NSQUARES, len(OFFSETS)), -1, dtype=np.int16)
+for _team in range(2):
+    for _speed in SPEEDS:
+        for _square in range(NSQUARES):
+            _from_row, _from_col = divmod(_square, NCOLS)
+            for _row, _col, _target in REACH[_team][_speed][_square]:
+                TARGET[_team, _speed, _square, OFFSET_INDEX[_row - _from_row + 4, _col - _from_col + 4]] = _target
+
+# CROSSED[square, offset] = cells crossed on the way to the square at the offset, in order, -1 padded
+PATH_LENGTH = 3
+CROSSED = np.full((NSQUARES, len(OFFSETS), PATH_LENGTH), -1, dtype=np.int16)
+for _square in range(NSQUARES):
+    _from_row, _from_col = divmod(_square, NCOLS)
+    for _index, (_row, _col) in enumerate(OFFSETS):
+        if 0 <= _from_row + _row < NROWS and 0 <= _from_col + _col < NCOLS:
+            _cells = PATH[_square * NSQUARES + _square + _row * NCOLS + _col]
+            CROSSED[_square, _index, :len(_cells)] = [cell for _, _, cell in _cells]
+
+# cards of each deck bitmask : how many, and the k-th one
+DECK_SIZE = np.array([len(cards) for cards in CARDS], dtype=np.int8)
+DECK_CARD = np.zeros((FULL_DECK + 1, 5), dtype=np.int8)
+for _mask, _cards in enumerate(CARDS):
+    DECK_CARD[_mask, :len(_cards)] = _cards
+
+
+def draw_cards(decks, rng):
+    """
+    Same as engine.draw_card, for an array of decks
+    output : cards picked, decks left
+    """
+    index = (rng.random(len(decks)) * DECK_SIZE[decks]).astype(np.int8)
+    cards = DECK_CARD[decks, index]
+    decks = decks & ~(1 << (cards - 1))
+    return cards, np.where(decks == 0, FULL_DECK, decks)
+
+
+class Batch:
+    """
+    PARAMETERS :
+    square, death, moved, board, ball, turn, decks -> see the module docstring
+    speed, attack, defense      -> (games, 12) characteristics of each piece
+    back : (games, 2)           -> column offset of a ball lost by each team
+    try_team : (games, 2)       -> index of the team winning when the ball is beyond each try line
+    winner : (games,)           -> index of the winning team, -1 while the game goes on
+
+    METHODS :
+    legal_moves(games)          -> encoded moves and their legality for the games
+    sample_outcomes(games, moves, rng) -> face off outcome of each move
+    apply(games, moves, outcomes) -> plays a move in each of the games
+    run(rng, max_turns)         -> plays all the games until they are won or drawn
+    """
+    def __init__(self, positions):
+        """
+        input : list of engine.Position, one per game
+        """
+        self.square = np.array([position.square for position in positions], dtype=np.int16)
+        self.death = np.array([position.death for position in positions], dtype=np.int32)
+        self.moved = np.array([[position.moved >> piece & 1 for piece in range(NPIECES)]
+                               for position in positions], dtype=bool)
+        self.board = np.array([bytearray(position.board) for position in positions], dtype=np.int8)
+        self.ball = np.array([position.ball for position in positions], dtype=np.int16)
+        self.turn = np.array([position.turn_count for position in positions], dtype=np.int32)
+        self.decks = np.array([position.decks for position in positions], dtype=np.int8)
+        self.speed = np.array([position.speed for position in positions], dtype=np.int8)
+        self.attack = np.array([position.attack for position in positions], dtype=np.int8)
+        self.defense = np.array([position.defense for position in positions], dtype=np.int8)
+        self.back = np.array([position.back for position in positions], dtype=np.int16)
+        self.try_team = np.array([[position.colors.index(Color.PINK), position.colors.index(Color.BLUE)]
+                                  for position in positions], dtype=np.int8)
+        self.winner = np.full(len(positions), -1, dtype=np.int8)
+        self._update_winner(np.arange(len(positions)))
+
+    def __len__(self):
+        return len(self.ball)
+
+    def _update_winner(self, games):
+        col = self.ball[games] % NCOLS
+        winner = np.where(col < COLSAUX, self.try_team[games, 0], -1)
+        self.winner[games] = np.where(col >= COLS + COLSAUX, self.try_team[games, 1], winner)
+
+    def _at(self, array, games, index):
+        """
+        output : array[games, index], games broadcast to the shape of index
+        """
+        games = games.reshape((-1,) + (1,) * (index.ndim - 1))
+        return array.ravel()[games * array.shape[1] + index]
+
+    def _candidates(self, games):
+        """
+        input : indices of the games
+        output : (candidates, legal), legal of shape (len(games), CANDIDATES) telling which candidate moves
+            are legal : the displacement or tackle of each piece of the next player to each offset,
+            then its passes to each teammate. The candidates are decoded by _select
+        """
+        team = (self.turn[games] // 2) % 2
+        pieces = team[:, None] * TEAM_SIZE + np.arange(TEAM_SIZE)
+        squares = self._at(self.square, games, pieces).astype(np.int32)
+        first = ((1 - team) * TEAM_SIZE)[:, None, None]
+        ball = self.ball[games].astype(np.int32)
+        holder = self._at(self.board, games, ball[:, None])[:, 0].astype(np.int32) - 1
+
+        # displacements and tackles
+        targets = TARGET[team[:, None], self._at(self.speed, games, pieces), squares].astype(np.int32)
+        occupants = self._at(self.board, games, targets.clip(0)).astype(np.int32) - 1
+        can_move = (self._at(self.death, games, pieces) < 0) & ~self._at(self.moved, games, pieces)
+        reachable = (targets >= 0) & can_move[:, :, None]
+        displacement = reachable & (occupants < 0)
+        tackle = reachable & (occupants == holder[:, None, None]) & (occupants >= first) \
+            & (occupants < first + TEAM_SIZE)
+        # passes of the ball holder, if it is in the team and up
+        has_ball = (holder >= team * TEAM_SIZE) & (holder < team * TEAM_SIZE + TEAM_SIZE)
+        holder = holder.clip(0)
+        has_ball &= self._at(self.death, games, holder[:, None])[:, 0] < 0
+        row, col = np.divmod(ball, NCOLS)
+        friend_row, friend_col = np.divmod(squares, NCOLS)
+        mini = np.where(team == 0, np.maximum(1, col - 2), np.minimum(COLS + 4, col + 1))
+        maxi = np.where(team == 0, col, np.minimum(COLS + 4, col + 3))
+        passes = has_ball[:, None] & (friend_row >= np.maximum(1, row - 2)[:, None]) \
+            & (friend_row < np.minimum(ROWS + 1, row + 3)[:, None]) \
+            & (friend_col >= mini[:, None]) & (friend_col < maxi[:, None])
+        pass_offsets = OFFSET_INDEX[(friend_row - row[:, None] + 4).clip(0, 8),
+                                    (friend_col - col[:, None] + 4).clip(0, 8)].clip(0)
+
+        legal = np.concatenate([(displacement | tackle).reshape(len(games), -1), passes], 1)
+        return (team, squares, ball, holder, targets, occupants, tackle, pass_offsets), legal
+
+    def _select(self, candidates, rows, index):
+        """
+        input : output of _candidates, row of the game and index of the candidate of each move wanted
+        output : kind, piece, origin square, offset index, target square and tackled opponent of the moves
+        """
+        team, squares, ball, holder, targets, occupants, tackle, pass_offsets = candidates
+        is_pass = index >= TEAM_SIZE * len(OFFSETS)
+        slot = np.where(is_pass, index - TEAM_SIZE * len(OFFSETS), index // len(OFFSETS))
+        reach = index % len(OFFSETS)
+        tackled = tackle[rows, slot, reach] & ~is_pass
+        kind = np.where(is_pass, PASS, np.where(tackled, TACKLE, DISPLACEMENT))
+        piece = np.where(is_pass, holder[rows], team[rows] * TEAM_SIZE + slot)
+        origin = np.where(is_pass, ball[rows], squares[rows, slot])
+        offset = np.where(is_pass, pass_offsets[rows, slot], reach)
+        target = np.where(is_pass, squares[rows, slot], targets[rows, slot, reach])
+        return kind, piece, origin, offset, target, np.where(tackled, occupants[rows, slot, reach], -1)
+
+    def _encode(self, games, kind, piece, origin, offset, target, tackled):
+        """
+        output : encoded moves, with the face off opponent found on the path of the displacements and passes
+        """
+        team = (self.turn[games] // 2) % 2
+        first = (1 - team) * TEAM_SIZE
+        first = first.reshape(first.shape + (1,) * kind.ndim)
+        crossed = CROSSED[origin, offset].astype(np.int32)
+        occupants = self._at(self.board, games, crossed.clip(0)).astype(np.int32) - 1
+        standing = (crossed >= 0) & (occupants >= first) & (occupants < first + TEAM_SIZE) \
+            & (self._at(self.death, games, occupants.clip(0)) < 0)
+        opponents = np.full(kind.shape, -1, dtype=np.int32)
+        for rank in range(PATH_LENGTH):
+            opponents = np.where(standing[..., rank], occupants[..., rank], opponents)
+        opponents = np.where(kind == TACKLE, tackled, opponents)
+        return kind | piece << 2 | target << 6 | (opponents + 1) << 14
+
+    def legal_moves(self, games):
+        """
+        input : indices of the games
+        output : (moves, legal), encoded candidate moves and their legality, see _candidates
+        """
+        candidates, legal = self._candidates(games)
+        rows = np.arange(len(games))[:, None]
+        index = np.arange(legal.shape[1])[None, :]
+        return self._encode(games, *self._select(candidates, rows, index)), legal
+
+    def sample_moves(self, games, rng):
+        """
+        output : one legal move of each game picked uniformly, SKIP_MOVE when there is none
+        """
+        candidates, legal = self._candidates(games)
+        counts = legal.sum(1)
+        picks = (rng.random(len(games)) * counts).astype(np.int32)
+        chosen = np.argmax(np.cumsum(legal, 1, dtype=np.int16) > picks[:, None], 1)
+        rows = np.arange(len(games))
+        moves = self._encode(games, *self._select(candidates, rows, chosen))
+        return np.where(counts > 0, moves, SKIP_MOVE)
+
+    def sample_outcomes(self, games, moves, rng):
+        """
+        Same draws as engine.face_off_outcome, for every move with a face off
+        output : face off outcome of each move, NO_FACE_OFF (0) if it has none
+        """
+        team = (self.turn[games] // 2) % 2
+        piece = moves >> 2 & 15
+        opponent = (moves >> 14) - 1
+        face_off = (opponent >= 0) & (moves & 3 != PASS)
+        attack_deck = self.decks[games, team]
+        defense_deck = self.decks[games, 1 - team]
+        attack_card, attack_deck = draw_cards(attack_deck, rng)
+        defense_card, defense_deck = draw_cards(defense_deck, rng)
+        attack = self.attack[games, piece].astype(np.int16)
+        defense = self.defense[games, opponent.clip(0)].astype(np.int16)
+        attack_score = attack_card + attack
+        defense_score = defense_card + defense
+        tie = attack_score == defense_score
+        attack_pick, tie_attack_deck = draw_cards(attack_deck, rng)
+        defense_pick, tie_defense_deck = draw_cards(defense_deck, rng)
+        attack_deck = np.where(tie, tie_attack_deck, attack_deck)
+        defense_deck = np.where(tie, tie_defense_deck, defense_deck)
+        result = np.where(attack_score >= defense_score + 2, PERFECT,
+                          np.where(attack_score > defense_score, ATTACK,
+                                   np.where(defense_score > attack_score, DEFENSE,
+                                            np.where(attack_pick + attack > defense_pick + defense, ATTACK, DEFENSE))))
+        outcomes = result | attack_deck.astype(np.int32) << 2 | defense_deck.astype(np.int32) << 7
+        return np.where(face_off, outcomes, 0)
+
+    def apply(self, games, moves, outcomes):
+        """
+        Same as engine.Position.make_move, for one move and its outcome in each of the games
+        """
+        kind = moves & 3
+        piece = moves >> 2 & 15
+        target = (moves >> 6 & 255).astype(np.int16)
+        opponent = (moves >> 14) - 1
+        result = outcomes & 3
+        turn = self.turn[games]
+        team = (turn // 2) % 2
+        ball = self.ball[games]
+        square = self.square[games, piece]
+
+        # face offs
+        fought = result > 0
+        self.decks[games[fought], team[fought]] = outcomes[fought] >> 2 & FULL_DECK
+        self.decks[games[fought], 1 - team[fought]] = outcomes[fought] >> 7 & FULL_DECK
+        acting = (kind == DISPLACEMENT) | (kind == TACKLE)
+        attacker_down = acting & (result == DEFENSE)
+        self.death[games[attacker_down], piece[attacker_down]] = turn[attacker_down]
+        defender_down = acting & fought & (result != DEFENSE)
+        self.death[games[defender_down], opponent[defender_down]] = turn[defender_down]
+
+        # displacements
+        displaced = (kind == DISPLACEMENT) & (result != DEFENSE)
+        moving = games[displaced]
+        self.board[moving, square[displaced]] = 0
+        self.board[moving, target[displaced]] = piece[displaced] + 1
+        self.square[moving, piece[displaced]] = target[displaced]
+        had_ball = (kind == DISPLACEMENT) & (ball == square)
+        ball = np.where(had_ball & displaced, target, ball)
+        ball = np.where(had_ball & ~displaced, square + self.back[games, team], ball)
+        displacement = kind == DISPLACEMENT
+        self.moved[games[displacement], piece[displacement]] = True
+
+        # tackles and passes
+        tackled = (kind == TACKLE) & (result != DEFENSE)
+        ball = np.where(tackled & (result == PERFECT), square, ball)
+        lost = self.square[games, opponent.clip(0)] + self.back[games, 1 - team]
+        ball = np.where(tackled & (result == ATTACK), lost, ball)
+        ball = np.where(kind == PASS, target, ball)
+        self.ball[games] = ball
+
+        # end of the action, pieces down for long enough come back up
+        ending = kind != PASS
+        second = games[ending & (turn % 2 == 1)]
+        self.moved[second[:, None], ((turn[ending & (turn % 2 == 1)] // 2) % 2)[:, None] * TEAM_SIZE
+                   + np.arange(TEAM_SIZE)] = False
+        turn = turn + ending
+        self.turn[games] = turn
+        death = self.death[games]
+        self.death[games] = np.where((death > -1) & (death + 3 < turn[:, None]), -1, death)
+        self._update_winner(games)
+
+    def run(self, rng, max_turns=MAX_TURNS):
+        """
+        action : plays random moves in every game until it is won or reaches max_turns
+        """
+        playing = np.flatnonzero((self.winner < 0) & (self.turn < max_turns))
+        while len(playing):
+            moves = self.sample_moves(playing, rng)
+            self.apply(playing, moves, self.sample_outcomes(playing, moves, rng))
+            playing = playing[(self.winner[playing] < 0) & (self.turn[playing] < max_turns)]
+
+
+def rollout(positions, games=100, max_turns=MAX_TURNS, seed=None):
+    """
+    input : list of engine.Position, number of random games played from each one,
+        turn count at which a game is drawn, seed of the random generator
+    output : {'win_rates' : (positions, 2) share of the games won by each team,
+              'draw_rates' : (positions,), 'mean_turns' : (positions,) mean turn count at the end of the games}
+    """
+    batch = Batch([position for position in positions for _ in range(games)])
+    batch.run(np.random.default_rng(seed), max_turns)
+    winner = batch.winner.reshape(len(positions), games)
+    return {'win_rates': np.stack([(winner == 0).mean(1), (winner == 1).mean(1)], 1),
+            'draw_rates': (winner < 0).mean(1),
+            'mean_turns': batch.turn.reshape(len(positions), games).mean(1)}
@@ -0,0 +1,560 @@
+"""
+Rules of the game, with no dependency on pygame.
+
+Everything needed to play a game headless lives here: the pieces, the teams and
+their strength decks, the board and the `GameState` which generates the legal
+moves and applies them. The pygame front-end (`kahmate.model` and `main`) only
+draws what this module computes.
+
+A move is described by a tuple (kind, piece, target, face_off_opponent):
+- DISPLACEMENT : target is the [row, col] destination
+- PASS         : target is the piece receiving the ball
+- TACKLE       : target is the opponent piece holding the ball
+- SKIP         : (SKIP, None, None, None), only when the next player has no other move
+"""
+import enum
+import random
+from typing import Optional
+from kahmate.settings import *
+from kahmate import tables
+from kahmate.zobrist import PIECE_SQUARE, BALL, MOVED, DECK, down_key, turn_key
+
+
+DISPLACEMENT = 0
+PASS = 1
+TACKLE = 2
+SKIP = 3
+KIND_NAMES = {DISPLACEMENT: 'displacement', PASS: 'pass', TACKLE: 'tackle', SKIP: 'skip'}
+
+PERFECT_TACKLE = "Plaquage parfait!"
+ATTACK_WINS = "Attack wins!"
+DEFENSE_WINS = "Defense wins!"
+
+
+class Color(enum.Enum):
+    PINK = 'pink'
+    BLUE = 'blue'
+
+
+class PieceType(enum.Enum):
+    """
+    The various possible types of a piece.
+    [speed, attack_strength, defense_strength, name]
+    """
+    REGULAR = [3, 0, 0, 'regular']
+    BIG = [2, 2, 1, 'big']
+    TOUGH = [3, 1, 0, 'tough']
+    FAST = [4, -1, 1, 'fast']
+    SMART = [3, 0, 1, 'smart']
+
+    def __getitem__(self, index):
+        return self.value[index]
+
+
+# squares reachable by a piece of each team, for each speed
+SPEEDS = sorted({piece_type[0] for piece_type in PieceType})
+REACH = tables.reach_table(SPEEDS)
+
+# squares crossed by a displacement or a pass, passes reach 2 rows and 2 columns away
+PATH, THROUGH = tables.path_table(max(SPEEDS + [4]))
+
+
+class Level(enum.Enum):
+    """
+    The various possible levels of an AI.
+    """
+
+    EASY = "easy"
+    NORMAL = "normal"
+    HARD = "hard"
+
+
+class Piece:
+    """
+    A piece is defined by :
+    - its type
+    - its position
+    - if it has the ball or not
+    - if it is down (cannot play) or not
+    """
+    def __init__(self,  piece_type: PieceType):
+        self._piece_type = piece_type
+        self.position = []
+        self.has_ball = False
+        self.is_down = False
+        self.turn_death = -1
+        self.has_moved = False
+
+    @ property
+    def speed(self):
+        return self._piece_type.value[0]
+
+    @property
+    def attack(self):
+        return self._piece_type.value[1]
+
+    @property
+    def defense(self):
+        return self._piece_type.value[2]
+
+    @property
+    def name(self):
+        return self._piece_type.value[3]
+
+    @property
+    def piece_type(self):
+        return self._piece_type
+
+    def screen_position(self):
+        x = self.position[1] * GRIDWIDTH + (GRIDWIDTH - PIECESIZE) / 2
+        y = self.position[0] * GRIDWIDTH + (GRIDWIDTH - PIECESIZE) / 2
+        return x, y
+
+    def __str__(self):
+        ans = "The " + self.piece_type.name + " piece is located at " + str(self.position)
+        return ans
+
+
+class Team:
+    """
+    A team is defined by:
+    - the list of its pieces
+    - its color
+    - its strength card deck
+    """
+
+    def __init__(self, color):
+        self.pieces = [Piece(piece_type) for piece_type in PieceType]
+        self.pieces.append(Piece(PieceType.REGULAR))
+        self._color = color
+        self.strength_deck = [i for i in range(1, 6)]
+        self.last_strength_picked = None
+
+    @property
+    def color(self):
+        return self._color
+
+    def init_positions(self):
+        if self._color == Color.PINK:
+            init_pos = PINK_POS
+        else:
+            init_pos = BLUE_POS
+        i = 0
+        for piece in self.pieces:
+            piece.position = init_pos[i]
+            i += 1
+
+    def pick_strength(self, rng=None):
+        # swap a random card with the last one and pop it, no need to shuffle the whole deck
+        index = (random if rng is None else rng).randrange(len(self.strength_deck))
+        self.strength_deck[index], self.strength_deck[-1] = self.strength_deck[-1], self.strength_deck[index]
+        self.last_strength_picked = self.strength_deck.pop()
+
+        if len(self.strength_deck) == 0:
+            self.strength_deck = [i for i in range(1, 6)]
+
+        return self.last_strength_picked
+
+    def reset_picked_strength(self):
+        self.last_strength_picked = None
+
+
+class Board:
+    def __init__(self):
+        self.matrix = [[None for _ in range(COLS+2*COLSAUX)] for _ in range(ROWS + 2*ROWSAUX)]
+        self._selected_piece: None
+
+    def update_board(self, players):
+        self.matrix = [[None for _ in range(COLS + 2*COLSAUX)] for _ in range(ROWS + 2*ROWSAUX)]
+        for player in players:
+            for piece in player.pieces:
+                self.matrix[piece.position[0]][piece.position[1]] = piece
+
+
+class GameState:
+    """
+    PARAMETERS :
+    players : list of Team      -> the two teams, in playing order
+    team_of : dict              -> index of the team of each piece
+    _next_player : int          -> index of the next player
+    ball_position : [int, int]  -> position of the ball
+    board : Board               -> contains the players' pieces in a more practical way
+    turn_count : int            -> used to decide whose turn it is and when to resuscitate a piece
+    hash : int                  -> Zobrist hash of the state, updated by each move (see zobrist)
+    first_holder : int          -> index of the piece given the ball, in players[0].pieces + players[1].pieces
+    initial_squares : bytes     -> square of each piece when the game started, in the same order
+    history : list              -> (kind, piece, target square, face off opponent, result, decks) of each action,
+                                   pieces as indices, decks = deck bitmasks after the face off if there was one
+    rng : random generator      -> draws of the strength cards, None for the random module
+
+    METHODS :
+    next_player() : Team        -> outputs the next player
+    generate_displacement(piece) -> list of the displacements and tackles of the piece
+    generate_pass(piece)        -> list of the passes of the piece
+    blockers(position)          -> face off opponents of every displacement or pass from the position
+    legal_moves()               -> list of every move of the next player
+    play(move)                  -> applies a move, outputs the result of the face off if any
+    refresh()                   -> update the ball's owner and which piece is down
+    compute_hash() : int        -> hash of the state computed from scratch
+    winner() : Color            -> color of the winning team, None while the game goes on
+    """
+    def __init__(self, players, rng=None):
+        """
+        Entry : list of Team, each with its pieces already placed
+            rng : random generator choosing the piece starting with the ball and drawing the strength cards,
+                the random module by default
+        Output : state ready to play, the ball given to a random piece
+        """
+        self.players = players
+        self.rng = rng
+        rng = random if rng is None else rng
+        self._next_player = 0
+        self.team_of = {piece: index for index, player in enumerate(players) for piece in player.pieces}
+        self.index_of = {piece: index for index, piece in enumerate(players[0].pieces + players[1].pieces)}
+
+        # define ball
+        random_player = rng.choice(self.players)
+        random_piece = rng.choice(random_player.pieces)
+        random_piece.has_ball = True
+        self.ball_position = random_piece.position
+        self.first_holder = self.index_of[random_piece]
+        self.initial_squares = bytes(piece.position[0] * tables.NCOLS + piece.position[1] for piece in self.index_of)
+        self.history = []
+
+        # define board
+        self.board = Board()
+        self.board.update_board(self.players)
+
+        self.turn_count = 0
+        self.hash = self.compute_hash()
+
+    def _piece_key(self, piece):
+        """
+        output : xor of the keys of the square of the piece, of its has_moved and of its turn_death
+        """
+        index = self.index_of[piece]
+        key = PIECE_SQUARE[index][piece.position[0] * tables.NCOLS + piece.position[1]]
+        if piece.has_moved:
+            key ^= MOVED[index]
+        if piece.is_down:
+            key ^= down_key(index, piece.turn_death)
+        return key
+
+    def _ball_key(self):
+        return BALL[self.ball_position[0] * tables.NCOLS + self.ball_position[1]]
+
+    def deck_masks(self):
+        """
+        output : bitmask of the cards left in the deck of each player, bit k for card k + 1
+        """
+        masks = []
+        for player in self.players:
+            mask = 0
+            for card in player.strength_deck:
+                mask |= 1 << (card - 1)
+            masks.append(mask)
+        return tuple(masks)
+
+    def _decks_key(self):
+        masks = self.deck_masks()
+        return DECK[0][masks[0]] ^ DECK[1][masks[1]]
+
+    def _log(self, kind, piece, target, face_off_opponent=None, result=None):
+        """
+        Keeps the action in the history, to be recorded
+        """
+        self.history.append((kind, self.index_of[piece] if piece is not None else -1,
+                             target[0] * tables.NCOLS + target[1] if target is not None else -1,
+                             self.index_of[face_off_opponent] if face_off_opponent is not None else -1,
+                             result, self.deck_masks() if result is not None else None))
+
+    def compute_hash(self):
+        """
+        output : hash of the state, the same as engine.Position.from_state(self).hash
+        """
+        key = self._ball_key() ^ self._decks_key() ^ turn_key(self.turn_count)
+        for piece in self.index_of:
+            key ^= self._piece_key(piece)
+        return key
+
+    def next_player(self):
+        """
+        output : team
+        """
+        return self.players[self._next_player]
+
+    def other_player(self):
+        """
+        output : team waiting for its turn
+        """
+        return self.players[(self._next_player + 1) % 2]
+
+    def refresh(self):
+        """
+        If a piece has the same position as the ball, it takes it
+        If a piece has been down for long enough, it comes back up
+        """
+        for player in self.players:
+            for piece in player.pieces:
+                if piece.position == self.ball_position and not piece.has_ball:
+                    piece.has_ball = True
+                if -1 < piece.turn_death + 3 < self.turn_count:
+                    if piece.is_down:
+                        self.hash ^= down_key(self.index_of[piece], piece.turn_death)
+                    piece.is_down = False
+                    piece.turn_death = -1
+
+    def winner(self):
+        """
+        output : color of the team which brought the ball in the opposite try zone, None otherwise
+        """
+        if self.ball_position[1] < COLSAUX:
+            return Color.PINK
+        if self.ball_position[1] >= COLS + COLSAUX:
+            return Color.BLUE
+        return None
+
+    def opponent_search(self, search_position, piece_position):
+        """
+        inputs : search_position = position of the pass or of the displacement desire
+                piece_position = position of the active piece
+        output : face off opponent if there is an opponent between the two positions
+        """
+        face_off_opponent = None
+        from_square = piece_position[0] * tables.NCOLS + piece_position[1]
+        cells = PATH.get(from_square * tables.NSQUARES + search_position[0] * tables.NCOLS + search_position[1])
+        if cells is None:
+            cells = tables.path_cells(piece_position[0], piece_position[1], search_position[0], search_position[1])
+        for case_x, case_y, _ in cells:
+            if self.board.matrix[case_x][case_y] is not None:
+                possible_foo = self.board.matrix[case_x][case_y]
+                if self.team_of[possible_foo] != self._next_player and not possible_foo.is_down:
+                    face_off_opponent = possible_foo
+        return face_off_opponent
+
+    def blockers(self, piece_position):
+        """
+        input : position of the active piece
+        output : {target square : face off opponent} for every target within reach which has one,
+            found in a single pass over the opponents standing
+        """
+        found = {}
+        rank_found = {}
+        through = THROUGH[piece_position[0] * tables.NCOLS + piece_position[1]]
+        for opponent in self.other_player().pieces:
+            if not opponent.is_down:
+                for target, rank in through.get(opponent.position[0] * tables.NCOLS + opponent.position[1], ()):
+                    if rank > rank_found.get(target, -1):
+                        found[target] = opponent
+                        rank_found[target] = rank
+        return found
+
+    def generate_displacement(self, piece: Optional[Piece]):
+        """
+        input : piece to move
+        output : if the piece is in the right team, list of the displacements and tackles possible for the piece
+        """
+        moves = []
+        team = self.team_of.get(piece)
+        if team == self._next_player and not piece.is_down and not piece.has_moved:
+            matrix = self.board.matrix
+            position = piece.position
+            blockers = self.blockers(position)
+            for i, j, square in REACH[team][piece.speed][position[0] * tables.NCOLS + position[1]]:
+                possible_opponent = matrix[i][j]
+                if possible_opponent is None:
+                    moves.append((DISPLACEMENT, piece, [i, j], blockers.get(square)))
+                elif possible_opponent.has_ball and self.team_of[possible_opponent] != team:
+                    moves.append((TACKLE, piece, possible_opponent, None))
+        return moves
+
+    def generate_pass(self, piece: Optional[Piece]):
+        """
+        input : piece holding the ball
+        output : if the piece is in the right team, list of the passes possible for the piece
+        """
+        moves = []
+        if self.team_of.get(piece) == self._next_player and not piece.is_down and piece.has_ball:
+            blockers = self.blockers(piece.position)
+            for i in range(max(1, piece.position[0]-2), min(ROWS+1, piece.position[0]+3)):
+                if self._next_player == 0:
+                    mini = max(1, piece.position[1] - 2)
+                    maxi = piece.position[1]
+                else:
+                    mini = min(COLS+4, piece.position[1]+1)
+                    maxi = min(COLS+4, piece.position[1]+3)
+                for j in range(mini, maxi):
+                    if self.board.matrix[i][j] is not None:
+                        possible_friend = self.board.matrix[i][j]
+                        if self.team_of[possible_friend] == self._next_player:
+                            face_off_opponent = blockers.get(i * tables.NCOLS + j)
+                            moves.append((PASS, piece, possible_friend, face_off_opponent))
+        return moves
+
+    def legal_moves(self):
+        """
+        output : list of every move the next player can play, only SKIP if he cannot do anything
+        """
+        moves = []
+        for piece in self.next_player().pieces:
+            moves += self.generate_displacement(piece)
+            moves += self.generate_pass(piece)
+        return moves or [(SKIP, None, None, None)]
+
+    def face_off(self, attack_piece: Piece, defense_piece: Piece):
+        """
+        input : attack_piece = piece that want to move or pass the ball
+            defense_piece = piece which is in the way
+        output : result of the face off as a str
+        """
+        attack_player = self.players[self._next_player]
+        defense_player = self.players[(self._next_player + 1) % 2]
+        self.hash ^= self._decks_key()
+        try:
+            return self._face_off(attack_player, defense_player, attack_piece, defense_piece)
+        finally:
+            self.hash ^= self._decks_key()
+
+    def _face_off(self, attack_player, defense_player, attack_piece, defense_piece):
+        """
+        Draws of the face off, the keys of the decks being out of the hash
+        """
+        attack_strength = attack_player.pick_strength(self.rng)
+        defense_strength = defense_player.pick_strength(self.rng)
+
+        attack_score = attack_strength + attack_piece.attack
+        defense_score = defense_strength + defense_piece.defense
+        if attack_score >= defense_score + 2:
+            return PERFECT_TACKLE
+        if defense_score + 2 > attack_score > defense_score:
+            return ATTACK_WINS
+        if defense_score > attack_score:
+            return DEFENSE_WINS
+        else:
+            attack_pick = attack_player.pick_strength(self.rng) + attack_piece.attack
+            defense_pick = defense_player.pick_strength(self.rng) + defense_piece.defense
+            if attack_score >= defense_score + 2:
+                return PERFECT_TACKLE
+            if attack_pick > defense_pick:
+                return ATTACK_WINS
+            else:
+                return DEFENSE_WINS
+
+    def end_action(self):
+        """
+        Counts one action of the next player, the other player takes the hand after two actions
+        """
+        if self.turn_count % 2 == 1:
+            for piece in self.next_player().pieces:
+                if piece.has_moved:
+                    self.hash ^= MOVED[self.index_of[piece]]
+                piece.has_moved = False
+        self.hash ^= turn_key(self.turn_count) ^ turn_key(self.turn_count + 1)
+        self.turn_count += 1
+        self._next_player = (self.turn_count // 2) % 2
+
+    def displace(self, piece: Piece, new_position, face_off_opponent: Optional[Piece]):
+        """
+        action : if no face off -> the piece is moved to new position
+            if face off -> face off, pieces displaced of put down according to the result, next_player updated
+        output : result of the face off, None if there was none
+        """
+        result_face_off = None
+        changed = self._ball_key() ^ self._piece_key(piece)
+        if face_off_opponent is not None:
+            changed ^= self._piece_key(face_off_opponent)
+        self.hash ^= changed
+        if face_off_opponent is None:
+            piece.position = new_position
+            if piece.has_ball:
+                self.ball_position = new_position
+        else:
+            result_face_off = self.face_off(piece, face_off_opponent)
+            if result_face_off == DEFENSE_WINS:
+                position = piece.position
+                if piece.has_ball:
+                    piece.has_ball = False
+                    if self.next_player().color == Color.PINK:
+                        self.ball_position = [position[0], position[1] + 1]
+                    else:
+                        self.ball_position = [position[0], position[1] - 1]
+                piece.is_down = True
+                piece.turn_death = self.turn_count
+            else:
+                piece.position = new_position
+                if piece.has_ball:
+                    self.ball_position = new_position
+                face_off_opponent.is_down = True
+                face_off_opponent.turn_death = self.turn_count
+        self.board.update_board(self.players)
+        piece.has_moved = True
+        changed = self._ball_key() ^ self._piece_key(piece)
+        if face_off_opponent is not None:
+            changed ^= self._piece_key(face_off_opponent)
+        self.hash ^= changed
+        self._log(DISPLACEMENT, piece, new_position, face_off_opponent, result_face_off)
+        self.end_action()
+        return result_face_off
+
+    def pass_ball(self, piece: Piece, new_piece: Piece):
+        """
+        action : the ball changes player, the face off of a blocked pass is still to be implemented
+        """
+        self.hash ^= self._ball_key() ^ BALL[new_piece.position[0] * tables.NCOLS + new_piece.position[1]]
+        self._log(PASS, piece, new_piece.position)
+        self.ball_position = new_piece.position
+        piece.has_ball = False
+        new_piece.has_ball = True
+        self.board.update_board(self.players)
+
+    def tackle(self, piece: Piece, opponent: Piece):
+        """
+        action : face off between the piece and the ball holder, pieces put down according to the result
+        output : result of the face off
+        """
+        self.hash ^= self._ball_key() ^ self._piece_key(piece) ^ self._piece_key(opponent)
+        result_face_off = self.face_off(piece, opponent)
+        if result_face_off == DEFENSE_WINS:
+            piece.is_down = True
+            piece.turn_death = self.turn_count
+        if result_face_off == PERFECT_TACKLE:
+            opponent.has_ball = False
+            opponent.is_down = True
+            opponent.turn_death = self.turn_count
+            piece.has_ball = True
+            self.ball_position = piece.position
+        if result_face_off == ATTACK_WINS:
+            opponent.has_ball = False
+            opponent.is_down = True
+            opponent.turn_death = self.turn_count
+            position = opponent.position
+            if self.other_player().color == Color.PINK:
+                self.ball_position = [position[0], position[1] + 1]
+            else:
+                self.ball_position = [position[0], position[1] - 1]
+        self.hash ^= self._ball_key() ^ self._piece_key(piece) ^ self._piece_key(opponent)
+        self.board.update_board(self.players)
+        self._log(TACKLE, piece, opponent.position, opponent, result_face_off)
+        self.end_action()
+        return result_face_off
+
+    def play(self, move):
+        """
+        input : move = (kind, piece, target, face_off_opponent) as generated by legal_moves()
+        action : applies the move then refreshes the state
+        output : result of the face off, None if there was none
+        """
+        kind, piece, target, face_off_opponent = move
+        if kind == DISPLACEMENT:
+            result_face_off = self.displace(piece, target, face_off_opponent)
+        elif kind == PASS:
+            result_face_off = None
+            self.pass_ball(piece, target)
+        elif kind == SKIP:
+            result_face_off = None
+            self._log(SKIP, None, None)
+            self.end_action()
+        else:
+            result_face_off = self.tackle(piece, target)
+        self.refresh()
+        return result_face_off
@@ -0,0 +1,334 @@
+"""
+Asyncio server hosting many games at once, played by remote clients over TCP.
+
+The protocol is one JSON object per line, with a "type":
+- client -> server :
+    {"type": "create"}                          new table, the client plays the first team
+    {"type": "join", "game": id}                the client plays the second team of the table
+    {"type": "watch", "game": id}               the client follows the game without playing
+    {"type": "moves"}                           legal moves of the client, when it is its turn
+    {"type": "move", "move": move}              plays a move
+    {"type": "state"}                           full state of the table
+- server -> client :
+    {"type": "joined", "game": id, "team": 0 or 1, or null for a spectator}
+    {"type": "start", "state": state}           sent to the table once both players are there
+    {"type": "moves", "moves": [move, ...]}
+    {"type": "played", "team": 0 or 1, "move": move, "result": str or null, "delta": delta}, sent to the table
+    {"type": "state", "state": state}           also sent to a spectator joining a game already started
+    {"type": "left", "team": 0 or 1}            the opponent has left
+    {"type": "error", "message": str}
+
+The pieces are numbered 0 to 11 as in engine.Position. A move is
+{"kind": "displacement", "piece": i, "target": [row, col]}, {"kind": "pass" or "tackle", "piece": i, "target": j}
+or {"kind": "skip"}. A state is {"turn", "ball": [row, col], "decks": [mask, mask], "cards": [card, card],
+"pieces": [[row, col, turn_death, has_moved], ...], "checksum"}, turn_death being -1 for a piece up and
+a card the last one drawn by the team, 0 before its first face off. After a move, only what
+changed is sent, as a delta.Snapshot delta: a client keeps a copy of the state up to date with
+delta.Snapshot.apply, and asks for the whole state again if the checksum does not match.
+
+A move is only played if it is among the moves generated by rules.GameState for the piece, and it is
+played by rules.GameState.play, so that the server runs without pygame. An idle table is only its state:
+no task runs for it.
+
+    python -m kahmate.server --port 8765
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+from kahmate import rules
+from kahmate.delta import Snapshot, checksum
+from kahmate.tables import NCOLS
+from kahmate.rules import DISPLACEMENT, PASS, SKIP, KIND_NAMES, Color, Team
+
+logger = logging.getLogger(__name__)
+
+KINDS = {name: kind for kind, name in KIND_NAMES.items()}
+MAX_LINE = 4096
+# bytes waiting to be sent to a client beyond which it is too slow and disconnected
+MAX_BUFFER = 1 << 16
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def new_state(rng=random):
+    """
+    output : rules.GameState of a new game, BLUE playing first
+    """
+    teams = [Team(Color.BLUE), Team(Color.PINK)]
+    for team in teams:
+        team.init_positions()
+    return rules.GameState(teams, rng)
+
+
+def state_message(state):
+    """
+    output : the state as sent to the clients
+    """
+    return {'turn': state.turn_count, 'ball': list(state.ball_position), 'decks': list(state.deck_masks()),
+            'cards': [player.last_strength_picked or 0 for player in state.players],
+            'pieces': [[piece.position[0], piece.position[1], piece.turn_death if piece.is_down else -1,
+                        int(piece.has_moved)] for piece in state.index_of],
+            'checksum': checksum(state)}
+
+
+def snapshot(message):
+    """
+    input : state as sent to the clients
+    output : delta.Snapshot of the state, for a client to apply the deltas on
+    """
+    return Snapshot(message['turn'], message['ball'][0] * NCOLS + message['ball'][1], message['decks'],
+                    [(row * NCOLS + col, turn_death, has_moved) for row, col, turn_death, has_moved in message['pieces']],
+                    message['cards'])
+
+
+def move_message(state, move):
+    """
+    input : move as generated by the state
+    output : the move as sent to the clients
+    """
+    kind, piece, target, _ = move
+    if kind == SKIP:
+        return {'kind': 'skip'}
+    message = {'kind': KIND_NAMES[kind], 'piece': state.index_of[piece]}
+    message['target'] = list(target) if kind == DISPLACEMENT else state.index_of[target]
+    return message
+
+
+def find_move(state, message):
+    """
+    input : move sent by a client for the next player of the state
+    output : the same move as generated by the state
+    raise : ProtocolError if it is not a legal move
+    """
+    if not isinstance(message, dict) or not isinstance(message.get('kind'), str) or message['kind'] not in KINDS:
+        raise ProtocolError('unknown move')
+    kind = KINDS[message['kind']]
+    if kind == SKIP:
+        moves = state.legal_moves()
+        if moves[0][0] != SKIP:
+            raise ProtocolError('skip is only allowed without any other move')
+        return moves[0]
+    pieces = list(state.index_of)
+    piece = message.get('piece')
+    if not isinstance(piece, int) or isinstance(piece, bool) or not 0 <= piece < len(pieces):
+        raise ProtocolError('unknown piece')
+    piece = pieces[piece]
+    target = message.get('target')
+    if kind == PASS:
+        moves = state.generate_pass(piece)
+    else:
+        moves = state.generate_displacement(piece)
+    for move in moves:
+        if move[0] == kind and move_message(state, move)['target'] == target:
+            return move
+    raise ProtocolError('illegal move')
+
+
+class Table:
+    """
+    One game : its state, the snapshot the last delta led to, the connection of each team (None until
+    it joins or after it left) and the connections of the spectators
+    """
+    __slots__ = ('id', 'state', 'snapshot', 'players', 'spectators')
+
+    def __init__(self, game_id, state):
+        self.id = game_id
+        self.state = state
+        self.snapshot = Snapshot.from_state(state)
+        self.players = [None, None]
+        self.spectators = set()
+
+
+class Server:
+    """
+    PARAMETERS :
+    tables : dict               -> Table of each game id
+    rng : random.Random         -> places the ball of the new games
+
+    METHODS :
+    start(host, port)           -> asyncio.Server listening for clients
+    handle(reader, writer)      -> serves one client until it disconnects
+    """
+    def __init__(self, rng=None):
+        self.tables = {}
+        self.rng = rng or random.Random()
+        self._ids = itertools.count(1)
+
+    async def start(self, host='127.0.0.1', port=8765):
+        return await asyncio.start_server(self.handle, host, port, limit=MAX_LINE)
+
+    async def handle(self, reader, writer):
+        """
+        Reads the messages of a client, one per line, and answers them
+        """
+        seat = None  # (table, team) of the client, team None for a spectator
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    break
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                    if not isinstance(message, dict):
+                        raise ProtocolError('a message is a JSON object')
+                    seat = self.dispatch(seat, message, writer)
+                except (ProtocolError, ValueError) as error:
+                    send(writer, {'type': 'error', 'message': str(error)})
+                await writer.drain()
+        finally:
+            if seat is not None:
+                self.leave(*seat, writer)
+            writer.close()
+
+    def dispatch(self, seat, message, writer):
+        """
+        input : (table, team) of the client or None, its message, its stream
+        output : the seat of the client after the message
+        """
+        kind = message.get('type')
+        if kind == 'create':
+            if seat is not None:
+                self.leave(*seat, writer)
+            table = Table(next(self._ids), new_state(self.rng))
+            table.players[0] = writer
+            self.tables[table.id] = table
+            send(writer, {'type': 'joined', 'game': table.id, 'team': 0})
+            return table, 0
+        if kind == 'join':
+            table = self.table(message)
+            if table is None or table.players[1] is not None:
+                raise ProtocolError('no such game waiting for a player')
+            if seat is not None:
+                self.leave(*seat, writer)
+            table.players[1] = writer
+            send(writer, {'type': 'joined', 'game': table.id, 'team': 1})
+            self.broadcast(table, {'type': 'start', 'state': state_message(table.state)})
+            return table, 1
+        if kind == 'watch':
+            table = self.table(message)
+            if table is None:
+                raise ProtocolError('no such game')
+            if seat is not None:
+                self.leave(*seat, writer)
+            table.spectators.add(writer)
+            send(writer, {'type': 'joined', 'game': table.id, 'team': None})
+            if None not in table.players:
+                send(writer, {'type': 'state', 'state': state_message(table.state)})
+            return table, None
+        if seat is None:
+            raise ProtocolError('create or join a game first')
+        table, team = seat
+        if kind == 'state':
+            send(writer, {'type': 'state', 'state': state_message(table.state)})
+        elif kind == 'moves':
+            moves = table.state.legal_moves() if self.to_play(table, team) else []
+            send(writer, {'type': 'moves', 'moves': [move_message(table.state, move) for move in moves]})
+        elif kind == 'move':
+            if not self.to_play(table, team):
+                raise ProtocolError('not your turn')
+            self.play(table, team, find_move(table.state, message.get('move')))
+        else:
+            raise ProtocolError(f'unknown message type {kind}')
+        return seat
+
+    def table(self, message):
+        """
+        output : Table of the game id of the message, None if there is none
+        raise : ProtocolError if the id is not an int or a str
+        """
+        game_id = message.get('game')
+        if not isinstance(game_id, (int, str)):
+            raise ProtocolError('a game id is an int or a str')
+        return self.tables.get(game_id)
+
+    def to_play(self, table, team):
+        return None not in table.players and table.state.winner() is None and table.state._next_player == team
+
+    def play(self, table, team, move):
+        """
+        The move is played on the state, then sent to the table with what it changed
+        """
+        state = table.state
+        message = move_message(state, move)
+        state.play(move)
+        result = state.history[-1][4]
+        snapshot = Snapshot.from_state(state)
+        delta = table.snapshot.diff(snapshot)
+        table.snapshot = snapshot
+        self.broadcast(table, {'type': 'played', 'team': team, 'move': message, 'result': result,
+                               'delta': delta})
+
+    def broadcast(self, table, message):
+        """
+        Sends the message to the players and the spectators of the table, encoded once
+        """
+        line = encode(message)
+        for writer in table.players:
+            if writer is not None:
+                write(writer, line)
+        for writer in table.spectators:
+            write(writer, line)
+
+    def leave(self, table, team, writer):
+        """
+        The client leaves its table, which is closed once both players have left
+        """
+        if team is None:
+            table.spectators.discard(writer)
+            return
+        table.players[team] = None
+        if table.players == [None, None]:
+            self.tables.pop(table.id, None)
+        else:
+            self.broadcast(table, {'type': 'left', 'team': team})
+
+
+def encode(message):
+    return json.dumps(message, separators=(',', ':')).encode() + b'\n'
+
+
+def write(writer, line):
+    """
+    Writes the line to the client, or disconnects it if more than MAX_BUFFER bytes would wait to be sent,
+    so that a client not reading does not make the memory of the server grow
+    """
+    if writer.is_closing():
+        return
+    if writer.transport.get_write_buffer_size() + len(line) > MAX_BUFFER:
+        logger.info('client too slow, disconnected')
+        writer.close()
+        return
+    writer.write(line)
+
+
+def send(writer, message):
+    write(writer, encode(message))
+
+
+async def serve(host, port):
+    server = Server()
+    listener = await server.start(host, port)
+    logger.info('listening on %s', ', '.join(str(socket.getsockname()) for socket in listener.sockets))
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Hosts kahmate games for remote clients.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(args.host, args.port))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,5 @@
 import enum
 from pathlib import Path
-import pygame as pg
 
 # colors
 WHITE = (255, 255, 255)
@@ -28,24 +27,19 @@ WIDTH = (COLS + 2 * COLSAUX) * GRIDWIDTH
 HEIGHT = (ROWS + 2 * ROWSAUX) * GRIDWIDTH
 TITLE = "KAHMATE"
 FPS = 60
+IDLE_TIMEOUT = 1000  # ms waited for an event when nothing changes on screen
 
 SETTINGS_PATH = Path(__file__).absolute()
 PARENT_PATH = SETTINGS_PATH.parent.parent
 IMG_PATH = PARENT_PATH / "img/"
 
-# pieces img
-BALL = pg.transform.scale(pg.image.load(IMG_PATH / 'ball.png'), (32, 32))
-LIGHTNING = pg.transform.scale(pg.image.load(IMG_PATH / 'lightning.png'), (32, 32))
+# processes searching the moves of the AI, 0 for all the cores
+AI_WORKERS = 1
 
 # initial positions, change later
 BLUE_POS = [[2, 4], [3, 4], [4, 4], [5, 4], [6, 4], [7, 4]]
 PINK_POS = [[2, 14], [3, 14], [4, 14], [5, 14], [6, 14], [7, 14]]
 
-def create_text(text, font, size, color, is_bold):
-    font = pg.font.SysFont(font, size, bold=is_bold)
-    image = font.render(text, True, color)
-    return image
-
 class Fonts(enum.Enum):
 
     TITLE = 'Verdana'
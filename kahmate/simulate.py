@@ -0,0 +1,140 @@
+"""
+Batch simulation of AI against AI games, headless, over a pool of processes.
+
+Each game is played on an `engine.Position` with the rules of `rules.GameState`
+(face offs, pieces coming back up, the ball crossing a try line) and its own
+seed, so that a batch can be replayed exactly. The results are streamed to a
+binary file of fixed-size records as the games finish.
+
+play_game and spawn_pool are the game loop and the process pool of every batch of AI games
+(kahmate.tuning, kahmate.tournament) and of the searches in other processes.
+
+    python -m kahmate.simulate --games 10000 --blue easy --pink normal --output results.bin
+"""
+import argparse
+import multiprocessing
+import random
+import struct
+import time
+from kahmate import ai, engine
+from kahmate.rules import Color, Level
+
+
+# seed, winner (index of the team, -1 for a draw), turns, face offs, duration in seconds
+RECORD = struct.Struct('<IbHHf')
+MAX_TURNS = 400
+
+
+def spawn_context():
+    """
+    output : multiprocessing context of the processes running searches and games
+    The processes are not forked from this one, which may have started pygame and its threads.
+    """
+    return multiprocessing.get_context('spawn')
+
+
+def spawn_pool(workers=None, initializer=None, initargs=()):
+    """
+    input : number of processes (all the cores by default), function called by each one as it starts
+    output : multiprocessing.Pool of spawned processes
+    """
+    return spawn_context().Pool(workers, initializer, initargs)
+
+
+def play_game(blue, pink, seed, max_turns=MAX_TURNS, random_plies=0):
+    """
+    input : searchers of the BLUE and PINK teams (anything with choose(position)), BLUE playing first,
+        seed of the game, turn count at which the game is drawn, plies played at random first
+    output : (index of the winner, -1 for a draw, turns, face offs)
+    """
+    rng = random.Random(seed)
+    position = engine.Position.initial(rng=rng)
+    searchers = (blue, pink)
+    face_offs = 0
+    ply = 0
+    while position.winner() < 0 and position.turn_count < max_turns:
+        if ply < random_plies:
+            move = rng.choice(position.legal_moves())
+        else:
+            move = searchers[position.next_player()].choose(position)
+        outcome = position.sample_outcome(move, rng)
+        if outcome != engine.NO_FACE_OFF:
+            face_offs += 1
+        position.play(move, outcome)
+        ply += 1
+    return position.winner(), position.turn_count, face_offs
+
+
+def play_record(seed, levels, max_turns=MAX_TURNS, budget=None):
+    """
+    input : seed of the game, level of the two teams (BLUE plays first), turn count at which the game is drawn,
+        budget of the searches (see ai.LEVELS), by default the node budget of the levels without time limit
+    output : (seed, winner, turns, face offs, duration)
+    """
+    start = time.perf_counter()
+    budget = budget or {}
+    blue, pink = [ai.Searcher(level, **{'time': float('inf'), **budget}) for level in levels]
+    return (seed, *play_game(blue, pink, seed, max_turns), time.perf_counter() - start)
+
+
+def _play(args):
+    return play_record(*args)
+
+
+def simulate(games, levels, output, workers=None, seed=0, max_turns=MAX_TURNS, budget=None, chunksize=4):
+    """
+    input : number of games, level of the two teams, path of the result file, number of processes
+        (all the cores by default), seed of the first game, the others following
+    output : {'games', 'wins', 'draws', 'mean_turns', 'games_per_second'}
+    """
+    start = time.perf_counter()
+    wins = [0, 0]
+    draws = 0
+    turns = 0
+    tasks = ((seed + index, levels, max_turns, budget) for index in range(games))
+    with open(output, 'wb') as file, spawn_pool(workers) as pool:
+        for result in pool.imap_unordered(_play, tasks, chunksize):
+            file.write(RECORD.pack(*result))
+            if result[1] < 0:
+                draws += 1
+            else:
+                wins[result[1]] += 1
+            turns += result[2]
+    duration = time.perf_counter() - start
+    return {'games': games, 'wins': wins, 'draws': draws, 'mean_turns': turns / games if games else 0,
+            'games_per_second': games / duration}
+
+
+def read_results(path):
+    """
+    output : generator of the (seed, winner, turns, face offs, duration) records of a result file
+    """
+    with open(path, 'rb') as file:
+        while True:
+            data = file.read(RECORD.size)
+            if len(data) < RECORD.size:
+                return
+            yield RECORD.unpack(data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Plays AI against AI games headless.')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--blue', default='easy', choices=[level.value for level in Level])
+    parser.add_argument('--pink', default='easy', choices=[level.value for level in Level])
+    parser.add_argument('--output', default='results.bin')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-turns', type=int, default=MAX_TURNS)
+    parser.add_argument('--nodes', type=int, default=None, help='node budget of every search')
+    args = parser.parse_args(argv)
+    budget = {'nodes': args.nodes} if args.nodes else None
+    summary = simulate(args.games, (Level(args.blue), Level(args.pink)), args.output, args.workers,
+                       args.seed, args.max_turns, budget)
+    print(f"{summary['games']} games : {Color.BLUE.value} {summary['wins'][0]}, {Color.PINK.value} "
+          f"{summary['wins'][1]}, draws {summary['draws']}, {summary['mean_turns']:.1f} turns on average, "
+          f"{summary['games_per_second']:.1f} games/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+"""
+Endgame tablebase : exact chances of a ball carrier close to the try line against one defender.
+
+The reduced position is the ball carrier of one team, a single piece of the other team (up,
+down, or too far to matter) and the two decks. On its turn, each team either moves its piece or
+leaves it where it is (the team moving its other pieces instead), with the face offs of the
+rules. The value of a reduced position is the probability that the carrier reaches the try
+line within HORIZON turns of its team without going down, the defender doing its best to stop
+it, with every outcome of every face off weighted by its exact probability from `faceoff`.
+
+The values are solved backwards from the try line, one turn at a time, for every square of the
+carrier from which it can still score, every square of the defender from which it can still
+reach the carrier in time and every pair of decks, then stored in a file of 16 bit integers
+(probability * 65535) read through a memory map: a lookup is an offset computed from the
+position, with no search.
+
+The file starts with MAGIC, HEADER (horizon, number of tables) and one ENTRY per table (team
+of the carrier, type of the carrier, type of the defender, offset of the table). A table is an
+array [phase][carrier square][defender][carrier deck << 5 | defender deck], phase 0 when the
+carrier's team plays, 1 when the defender's team plays, the squares and the defenders being
+numbered by `Layout`.
+
+Scope : the tables only hold one carrier against one defender, all the other pieces being out of
+reach, and games where BLUE plays first, as in main.Game and kahmate.tournament, the first team
+scoring to the right; value() is None for any other position. The default horizon is a single turn
+of the carrier's team, which already covers a carrier one move from the try line; a deeper one is
+generated with --horizon, the file growing and the generation slowing down with it.
+
+    python -m kahmate.tablebase --output tablebase.bin --horizon 1
+"""
+import argparse
+import functools
+import struct
+import time
+import numpy as np
+from kahmate.settings import *
+from kahmate import faceoff, tables
+from kahmate.tables import NCOLS, NSQUARES
+from kahmate.rules import PieceType, Color, REACH, PATH
+from kahmate.engine import TEAM_SIZE, NPIECES, FULL_DECK, DEFENSE
+
+
+MAGIC = b'KAHMATB\x01'
+HEADER = struct.Struct('<BB')
+ENTRY = struct.Struct('<BBBQ')
+HORIZON = 1
+SCALE = 65535
+DEFAULT_PATH = PARENT_PATH / 'tablebase.bin'
+
+PIECE_TYPES = list(PieceType)
+TYPE_INDEX = {(piece_type[0], piece_type[1], piece_type[2]): index for index, piece_type in enumerate(PIECE_TYPES)}
+MAX_SPEED = max(piece_type[0] for piece_type in PIECE_TYPES)
+
+# decks of the carrier and of the defender, as one index
+NDECKS = (FULL_DECK + 1) ** 2
+DECK_PAIRS = [(carrier, defender) for carrier in range(1, FULL_DECK + 1) for defender in range(1, FULL_DECK + 1)]
+
+ATTACK_PHASE = 0
+DEFENSE_PHASE = 1
+ABSENT = 0
+
+
+def try_column(team):
+    """
+    output : column the carrier of the team scores in, the first team scoring to the right
+    """
+    return COLS + COLSAUX if team == 0 else COLSAUX - 1
+
+
+def distance(team, square):
+    """
+    output : number of columns between the square and the try line of the team
+    """
+    return abs(square % NCOLS - try_column(team))
+
+
+def _squares(team, band_team, columns):
+    """
+    output : squares of the board where a piece of band_team can stand, 1 to columns away from the try
+        line of team
+    """
+    mini, maxi = tables.column_band(band_team)
+    return [row * NCOLS + col for row in range(ROWSAUX, ROWS + ROWSAUX) for col in range(mini, maxi)
+            if 0 < distance(team, row * NCOLS + col) <= columns]
+
+
+class Layout:
+    """
+    Numbering of the reduced positions of a table.
+
+    PARAMETERS :
+    carriers : list of int      -> squares of the carrier, from where it can score within the horizon
+    region : list of int        -> squares of the defender, from where it can stop the carrier in time
+    carrier_index, region_index -> numpy array of the index of each square, -1 outside
+    ndefenders : int            -> ABSENT, then each square of the region with the defender up, then down
+    """
+    def __init__(self, team, carrier_type, defender_type, horizon):
+        self.team = team
+        self.carrier_type = carrier_type
+        self.defender_type = defender_type
+        self.horizon = horizon
+        self.carriers = _squares(team, team, carrier_type[0] * horizon)
+        # a defender further away cannot reach a square the carrier goes through before it has scored
+        self.region = _squares(team, 1 - team, (carrier_type[0] + defender_type[0]) * horizon)
+        self.carrier_index = np.full(NSQUARES, -1, dtype=np.int32)
+        self.carrier_index[self.carriers] = np.arange(len(self.carriers))
+        self.region_index = np.full(NSQUARES, -1, dtype=np.int32)
+        self.region_index[self.region] = np.arange(len(self.region))
+        self.ndefenders = 1 + 2 * len(self.region)
+
+    def up(self, square):
+        index = self.region_index[square]
+        return ABSENT if index < 0 else 1 + 2 * index
+
+    def down(self, square):
+        index = self.region_index[square]
+        return ABSENT if index < 0 else 2 + 2 * index
+
+    def defender(self, state):
+        """
+        output : (square, is_down) of a defender state, None when absent
+        """
+        if state == ABSENT:
+            return None
+        return self.region[(state - 1) // 2], (state - 1) % 2 == 1
+
+    def shape(self):
+        return 2, len(self.carriers), self.ndefenders, NDECKS
+
+
+@functools.lru_cache(maxsize=None)
+def layout(team, carrier_type, defender_type, horizon):
+    return Layout(team, PIECE_TYPES[carrier_type], PIECE_TYPES[defender_type], horizon)
+
+
+@functools.lru_cache(maxsize=None)
+def crossed(from_square, to_square):
+    """
+    output : set of the squares crossed between two squares, as in the opponent search of the rules
+    """
+    cells = PATH.get(from_square * NSQUARES + to_square)
+    if cells is None:
+        cells = tables.path_cells(*divmod(from_square, NCOLS), *divmod(to_square, NCOLS))
+    return frozenset(cell for _, _, cell in cells)
+
+
+@functools.lru_cache(maxsize=None)
+def survivals(attack, defense, carrier_attacks):
+    """
+    input : attack and defense of the face off, carrier_attacks = True when the carrier attacks
+    output : (source, target, probability) numpy arrays of the outcomes the carrier stays up after,
+        from the deck index before to the deck index after
+    """
+    source, target, probabilities = [], [], []
+    for carrier_deck, defender_deck in DECK_PAIRS:
+        if carrier_attacks:
+            outcomes = faceoff.distribution(carrier_deck, defender_deck, attack, defense)
+        else:
+            outcomes = faceoff.distribution(defender_deck, carrier_deck, attack, defense)
+        for probability, result, attack_left, defense_left in outcomes:
+            if (result != DEFENSE) == carrier_attacks:
+                carrier_left, defender_left = (attack_left, defense_left) if carrier_attacks \
+                    else (defense_left, attack_left)
+                source.append(carrier_deck << 5 | defender_deck)
+                target.append(carrier_left << 5 | defender_left)
+                probabilities.append(float(probability))
+    return np.array(source), np.array(target), np.array(probabilities)
+
+
+def _expected(values, outcomes):
+    """
+    output : value for each deck index of a face off, the values after the outcomes being given
+    """
+    source, target, probabilities = outcomes
+    return np.bincount(source, weights=probabilities * values[target], minlength=NDECKS)
+
+
+def _attack_turn(layout, after):
+    """
+    input : layout, values when the defender's team plays with one turn less to go
+    output : values when the carrier's team plays
+    """
+    team = layout.team
+    speed, attack = layout.carrier_type[0], layout.carrier_type[1]
+    defense = layout.defender_type[2]
+    values = np.zeros(layout.shape()[1:])
+    scored = np.zeros(NDECKS)
+    scored[[carrier << 5 | defender for carrier, defender in DECK_PAIRS]] = 1
+    for index, square in enumerate(layout.carriers):
+        targets = REACH[team][speed][square]
+        for state in range(layout.ndefenders):
+            defender = layout.defender(state)
+            # the defender down now is up again on the turn of its team
+            if defender is None:
+                stay = ABSENT
+            else:
+                stay = layout.up(defender[0])
+            candidates = [after[index, stay]]
+            for _, _, target in targets:
+                if defender is not None and target == defender[0]:
+                    continue
+                blocked = defender is not None and not defender[1] and defender[0] in crossed(square, target)
+                if distance(team, target) == 0:
+                    value = scored
+                else:
+                    next_index = layout.carrier_index[target]
+                    if next_index < 0:
+                        continue
+                    value = after[next_index, layout.down(defender[0]) if blocked else stay]
+                if blocked:
+                    value = _expected(value, survivals(attack, defense, True))
+                candidates.append(value)
+            values[index, state] = np.max(candidates, axis=0)
+    return values
+
+
+def _defense_turn(layout, after):
+    """
+    input : layout, values when the carrier's team plays, for the same number of turns to go
+    output : values when the defender's team plays
+    """
+    team = 1 - layout.team
+    speed, attack = layout.defender_type[0], layout.defender_type[1]
+    defense = layout.carrier_type[2]
+    tackles = survivals(attack, defense, False)
+    values = np.zeros(layout.shape()[1:])
+    for index, square in enumerate(layout.carriers):
+        for state in range(layout.ndefenders):
+            defender = layout.defender(state)
+            if defender is None:
+                values[index, state] = after[index, state]
+                continue
+            if defender[1]:
+                values[index, state] = after[index, layout.up(defender[0])]
+                continue
+            down = after[index, layout.down(defender[0])]
+            candidates = [after[index, state]]
+            for _, _, target in REACH[team][speed][defender[0]]:
+                if target == square or square in crossed(defender[0], target):
+                    # a tackle, or a displacement through the carrier : the carrier only stays up if the
+                    # defense wins, and the defender is down
+                    candidates.append(_expected(down, tackles))
+                else:
+                    candidates.append(after[index, layout.up(target)])
+            values[index, state] = np.min(candidates, axis=0)
+    return values
+
+
+def solve(team, carrier_type, defender_type, horizon=HORIZON):
+    """
+    input : team of the carrier, index in PIECE_TYPES of the carrier and of the defender, number of turns
+    output : numpy array of the values, of shape layout(...).shape()
+    """
+    table_layout = layout(team, carrier_type, defender_type, horizon)
+    defense_values = np.zeros(table_layout.shape()[1:])
+    for _ in range(horizon):
+        attack_values = _attack_turn(table_layout, defense_values)
+        defense_values = _defense_turn(table_layout, attack_values)
+    return np.stack([attack_values, defense_values])
+
+
+def generate(path, horizon=HORIZON, teams=(0, 1), piece_types=None, verbose=False):
+    """
+    input : path of the file, number of turns, teams of the carrier, indexes in PIECE_TYPES of the pieces
+        (all by default)
+    output : number of tables written
+    """
+    piece_types = range(len(PIECE_TYPES)) if piece_types is None else piece_types
+    keys = [(team, carrier, defender) for team in teams for carrier in piece_types for defender in piece_types]
+    offset = len(MAGIC) + HEADER.size + ENTRY.size * len(keys)
+    entries = []
+    for key in keys:
+        entries.append(ENTRY.pack(*key, offset))
+        offset += 2 * int(np.prod(layout(*key, horizon).shape()))
+    with open(path, 'wb') as file:
+        file.write(MAGIC + HEADER.pack(horizon, len(keys)) + b''.join(entries))
+        for key in keys:
+            start = time.perf_counter()
+            values = solve(*key, horizon)
+            file.write(np.round(values * SCALE).astype('<u2').tobytes())
+            if verbose:
+                print(f'carrier of team {key[0]} {PIECE_TYPES[key[1]].name:<8} defender {PIECE_TYPES[key[2]].name:<8}'
+                      f' {time.perf_counter() - start:.1f}s')
+    return len(keys)
+
+
+class Tablebase:
+    """
+    PARAMETERS :
+    path                        -> file of the tables, read through a memory map
+    horizon : int               -> number of turns of the carrier's team the values are for
+
+    METHODS :
+    lookup(team, phase, carrier_type, carrier_square, defender_type, defender_square, down, decks)
+                                -> value of a reduced position, None if it has no table
+    value(position)             -> chances of the ball holder's team to score, None out of the tables
+    """
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        with open(path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a tablebase')
+            self.horizon, count = HEADER.unpack(file.read(HEADER.size))
+            entries = [ENTRY.unpack(file.read(ENTRY.size)) for _ in range(count)]
+        self._data = np.memmap(path, dtype='<u2', mode='r')
+        self._tables = {}
+        for team, carrier_type, defender_type, offset in entries:
+            table_layout = layout(team, carrier_type, defender_type, self.horizon)
+            _, ncarriers, ndefenders, _ = table_layout.shape()
+            self._tables[team, carrier_type, defender_type] = (offset // 2, table_layout, ncarriers, ndefenders)
+
+    def lookup(self, team, phase, carrier_type, carrier_square, defender_type, defender_square=None, down=False,
+               decks=(FULL_DECK, FULL_DECK)):
+        """
+        input : team of the carrier, ATTACK_PHASE or DEFENSE_PHASE, indexes of the types in PIECE_TYPES, squares,
+            whether the defender is down, deck bitmasks of the carrier's team and of the defender's team
+        output : probability that the carrier scores, None if there is no table for the pieces
+        """
+        table = self._tables.get((team, carrier_type, defender_type))
+        if table is None:
+            return None
+        base, table_layout, ncarriers, ndefenders = table
+        carrier = table_layout.carrier_index[carrier_square]
+        if carrier < 0:
+            return 0.0
+        if defender_square is None:
+            defender = ABSENT
+        else:
+            defender = table_layout.down(defender_square) if down else table_layout.up(defender_square)
+        index = base + ((phase * ncarriers + carrier) * ndefenders + defender) * NDECKS + (decks[0] << 5 | decks[1])
+        return int(self._data[index]) / SCALE
+
+    def value(self, position):
+        """
+        input : engine.Position, the first team scoring to the right
+        output : probability that the team of the ball holder scores within the horizon with it, None if the
+            position is not an endgame of the tables
+        """
+        if position.colors[0] != Color.BLUE:
+            return None
+        carrier = position.board[position.ball] - 1
+        if carrier < 0 or position.death[carrier] >= 0:
+            return None
+        team = carrier // TEAM_SIZE
+        if distance(team, position.square[carrier]) > position.speed[carrier] * self.horizon:
+            return 0.0
+        phase = ATTACK_PHASE if position.next_player() == team else DEFENSE_PHASE
+        moved = position.moved
+        if phase == ATTACK_PHASE and moved >> carrier & 1:
+            return None
+        # nothing but one defender may stand where a piece can get in the way of the carrier before its last move
+        columns = position.speed[carrier] * self.horizon + MAX_SPEED * (self.horizon - (phase == ATTACK_PHASE))
+        defender = None
+        for piece in range(NPIECES):
+            if piece != carrier and distance(team, position.square[piece]) <= columns:
+                if piece // TEAM_SIZE == team or defender is not None:
+                    return None
+                defender = piece
+        carrier_type = TYPE_INDEX[position.speed[carrier], position.attack[carrier], position.defense[carrier]]
+        defender_type = carrier_type
+        down = False
+        if defender is not None:
+            defender_type = TYPE_INDEX[position.speed[defender], position.attack[defender], position.defense[defender]]
+            down = position.death[defender] >= 0
+            # a defender down is up again at the end of this turn, as in the reduced positions, which only
+            # matters if it can play before the last move of the carrier
+            if down and (phase == DEFENSE_PHASE or self.horizon > 1) and \
+                    position.death[defender] != (position.turn_count // 2 + 1) * 2 - 4:
+                return None
+            if phase == DEFENSE_PHASE and not down and moved >> defender & 1:
+                return None
+        return self.lookup(team, phase, carrier_type, position.square[carrier], defender_type,
+                           None if defender is None else position.square[defender], down,
+                           (position.decks[team], position.decks[1 - team]))
+
+
+# tablebases loaded, by path, a missing file being looked for again on the next load
+_loaded = {}
+
+
+def load(path=DEFAULT_PATH):
+    """
+    output : the Tablebase of the file, None if it has not been generated
+    """
+    tablebase = _loaded.get(path)
+    if tablebase is None:
+        try:
+            tablebase = _loaded[path] = Tablebase(path)
+        except FileNotFoundError:
+            return None
+    return tablebase
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generates the endgame tablebase.')
+    parser.add_argument('--output', default=str(DEFAULT_PATH))
+    parser.add_argument('--horizon', type=int, default=HORIZON, help='turns of the carrier\'s team')
+    parser.add_argument('--types', nargs='*', choices=[piece_type.name for piece_type in PIECE_TYPES],
+                        help='types of the pieces, all by default')
+    args = parser.parse_args(argv)
+    piece_types = None
+    if args.types:
+        piece_types = [PieceType[name] for name in args.types]
+        piece_types = [PIECE_TYPES.index(piece_type) for piece_type in piece_types]
+    start = time.perf_counter()
+    count = generate(args.output, args.horizon, piece_types=piece_types, verbose=True)
+    print(f'{count} tables written to {args.output} in {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Tables precomputed once at import, shared by rules.GameState and engine.Position.
+
+Squares are numbered row * NCOLS + col, over the whole window grid.
+"""
+from kahmate.settings import *
+
+
+NROWS = ROWS + 2 * ROWSAUX
+NCOLS = COLS + 2 * COLSAUX
+NSQUARES = NROWS * NCOLS
+
+
+def column_band(team):
+    """
+    input : index of the team to play
+    output : first and last + 1 columns where its pieces can go
+    """
+    if team == 0:
+        return COLSAUX, COLS + COLSAUX + 1
+    return COLSAUX - 1, COLS + COLSAUX
+
+
+def reach_table(speeds):
+    """
+    input : the possible speeds of a piece
+    output : table[team][speed][square] = tuple of the (row, col, square) a piece can reach,
+        in the order of a row by row scan of the board
+    """
+    table = []
+    for team in range(2):
+        mini, maxi = column_band(team)
+        by_speed = {}
+        for speed in speeds:
+            by_square = []
+            for square in range(NSQUARES):
+                row, col = divmod(square, NCOLS)
+                by_square.append(tuple((i, j, i * NCOLS + j)
+                                       for i in range(1, ROWS + ROWSAUX) for j in range(mini, maxi)
+                                       if 0 < abs(i - row) + abs(j - col) <= speed))
+            by_speed[speed] = tuple(by_square)
+        table.append(by_speed)
+    return table
+
+
+def path_cells(from_row, from_col, to_row, to_col):
+    """
+    output : tuple of the (row, col, square) crossed between the two positions, from the first one,
+        with the same interpolation as the original opponent search
+    """
+    cells = []
+    distance = abs(to_row - from_row) + abs(to_col - from_col)
+    for k in range(distance - 1):
+        case_x = int(((k + 1) / distance) * to_row + ((distance - (k + 1)) / distance) * from_row)
+        case_y = int(((k + 1) / distance) * to_col + ((distance - (k + 1)) / distance) * from_col)
+        cells.append((case_x, case_y, case_x * NCOLS + case_y))
+    return tuple(cells)
+
+
+def path_table(max_distance):
+    """
+    input : longest distance of a displacement or a pass
+    output : path[from_square * NSQUARES + to_square] = path_cells between the two squares
+        through[from_square] = {cell : tuple of the (to_square, rank of the cell in the path)}
+    """
+    path = {}
+    through = []
+    for from_square in range(NSQUARES):
+        from_row, from_col = divmod(from_square, NCOLS)
+        crossing = {}
+        for to_row in range(max(0, from_row - max_distance), min(NROWS, from_row + max_distance + 1)):
+            for to_col in range(max(0, from_col - max_distance), min(NCOLS, from_col + max_distance + 1)):
+                if abs(to_row - from_row) + abs(to_col - from_col) <= max_distance:
+                    to_square = to_row * NCOLS + to_col
+                    cells = path_cells(from_row, from_col, to_row, to_col)
+                    path[from_square * NSQUARES + to_square] = cells
+                    for rank, (_, _, cell) in enumerate(cells):
+                        crossing.setdefault(cell, []).append((to_square, rank))
+        through.append({cell: tuple(targets) for cell, targets in crossing.items()})
+    return path, through
@@ -0,0 +1,139 @@
+"""
+AI moves searched in a background process, so that the window keeps drawing while an AI thinks.
+
+A `Thinker` owns one process, which keeps its transposition table from one search to the next.
+The move of an AI is searched by iterative deepening and the process sends the best move of each
+depth completed: once the deadline has passed, the best move so far is played and the rest of the
+search is stopped. On the turn of a human, the process ponders the position for the AI, so that
+the positions the human can reach are already in its table when the AI has to move.
+
+    thinker = Thinker()
+    move = thinker.think(state, level)      # once per frame, None until the move is found
+"""
+import time
+from kahmate import ai, engine, simulate, tablebase
+from kahmate.zobrist import TranspositionTable
+
+
+SEARCH, PONDER = 0, 1
+# the budget of a ponder, stopped earlier by the move of the human: a few seconds fill the table with
+# the positions the human can reach, without keeping a core busy while the human is away
+PONDER_BUDGET = {'depth': 64, 'nodes': 10 ** 8, 'time': 5}
+TABLE_CAPACITY = 1 << 18
+
+
+def _run(connection, current, tablebase_path):
+    """
+    Loop of the process : searches each request received until it is done or no longer the current one.
+    A search sends (request, depth, best move, nodes, done) after each depth completed and once done.
+    """
+    table = TranspositionTable(TABLE_CAPACITY)
+    endgames = tablebase.load(tablebase_path) if tablebase_path is not None else None
+    while True:
+        message = connection.recv()
+        if message is None:
+            return
+        request, kind, position, level, team, deadline = message
+
+        def stop():
+            return current.value != request
+
+        def report(depth, move, nodes):
+            connection.send((request, depth, move, nodes, False))
+
+        if kind == PONDER:
+            ai.Searcher(level, table=table, tablebase=endgames, stop=stop, **PONDER_BUDGET).ponder(position, team)
+        else:
+            searcher = ai.Searcher(level, deadline, table=table, tablebase=endgames, stop=stop, report=report)
+            move = searcher.choose(position)
+            connection.send((request, searcher.depth_reached, move, searcher.nodes_searched, True))
+
+
+class Thinker:
+    """
+    PARAMETERS :
+    deadline : float            -> seconds given to each move, the time of the level if None
+    depth_reached : int         -> depth of the best move found so far
+    nodes_searched : int        -> nodes searched for it
+
+    METHODS :
+    think(state, level)         -> move of the next player of the state, as generated by the state, None
+                                   until it is found
+    ponder(state, team, level)  -> searches the state for the team while the other team plays
+    close()                     -> stops the process
+    """
+    def __init__(self, deadline=None, tablebase_path=None):
+        """
+        input : deadline, tablebase_path = file of the endgame tablebase, the default one if it is there
+        """
+        if tablebase_path is None and tablebase.load() is not None:
+            tablebase_path = tablebase.DEFAULT_PATH
+        self.deadline = deadline
+        self.depth_reached = 0
+        self.nodes_searched = 0
+        self._request = 0
+        self._key = None
+        self._best = None
+        self._done = False
+        self._stop_time = 0
+        context = simulate.spawn_context()
+        self._current = context.Value('q', 0, lock=False)
+        self._connection, child = context.Pipe()
+        self._process = context.Process(target=_run, args=(child, self._current, tablebase_path), daemon=True)
+        self._process.start()
+
+    def _send(self, key, kind, state, level, team, deadline):
+        self._request += 1
+        self._current.value = self._request
+        self._key = key
+        self._best = None
+        self._done = False
+        self._connection.send((self._request, kind, engine.Position.from_state(state), level, team, deadline))
+
+    def _receive(self):
+        while self._connection.poll():
+            request, depth, move, nodes, done = self._connection.recv()
+            if request == self._request:
+                self._best = move
+                self._done = done
+                self.depth_reached = depth
+                self.nodes_searched = nodes
+
+    def think(self, state, level):
+        """
+        input : rules.GameState, refreshed, level of the AI playing it
+        output : move of the next player, as generated by the state, once the search is done or its
+            deadline has passed, None before
+        """
+        key = (SEARCH, state.hash, level)
+        if key != self._key:
+            deadline = self.deadline if self.deadline is not None else ai.LEVELS[level]['time']
+            self._send(key, SEARCH, state, level, state._next_player, deadline)
+            self._stop_time = time.perf_counter() + deadline
+        self._receive()
+        if not self._done and (self._best is None or time.perf_counter() < self._stop_time):
+            return None
+        move = self._best
+        self._current.value = -1
+        self._key = None
+        return engine.to_rules_move(state, move)
+
+    def ponder(self, state, team, level):
+        """
+        input : rules.GameState, refreshed, the other team to play, team and level of the AI
+        action : the process searches the state for the team until the next request
+        """
+        key = (PONDER, state.hash, team, level)
+        if key != self._key:
+            self._send(key, PONDER, state, level, team, None)
+
+    def close(self):
+        self._current.value = -1
+        try:
+            self._connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self._process.join(1)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._connection.close()
@@ -0,0 +1,319 @@
+"""
+Tournaments between AI configurations : a level, a search budget and a weight file.
+
+Each pairing of a round is a match of four games, each from its own seed, so that both configurations
+play both colors twice, the BLUE and PINK start positions differing. BLUE starts every game, as in
+main.Game: the bands and the pass direction of the rules are those of BLUE for the team playing first.
+The pairings are either a round robin, every configuration meeting every other one in each round, or
+a Swiss system, the configurations of close scores meeting in each round, each round paired from the
+results of the ones before.
+
+The games are played over a pool of processes and appended to a checkpoint file as they finish,
+one JSON line each after a header line with the settings of the tournament. A tournament run again
+with the same checkpoint only plays the games missing from it. The Elo ratings are the maximum
+likelihood of the results, a draw counting as half a win, with their 95% margins.
+
+    python -m kahmate.tournament --players players.json --system swiss --rounds 6 --checkpoint swiss.jsonl
+
+players.json : [{"name": "normal"}, {"name": "hard-50k", "level": "hard", "nodes": 50000},
+                {"name": "tuned", "level": "normal", "weights": "weights.json"}]
+"""
+import argparse
+import json
+import math
+import zlib
+import numpy as np
+from kahmate import ai, simulate
+from kahmate.rules import Color, Level
+
+
+MAX_TURNS = 200
+# standard deviation of the prior of the ratings, which keeps them finite for a configuration winning
+# or losing every game
+PRIOR = 1000
+MARGIN = 1.96
+
+
+class Config:
+    """
+    PARAMETERS :
+    name : str
+    level : Level
+    budget : dict               -> depth, nodes or time of the searches, the nodes of the level without time
+                                   limit by default
+    weights : str               -> weight file of the evaluation, see ai.load_weights, None for the level's
+
+    METHODS :
+    from_dict(data)             -> configuration of the players file
+    to_dict()
+    searcher()                  -> ai.Searcher playing for the configuration
+    """
+    def __init__(self, name, level=Level.NORMAL, budget=None, weights=None):
+        self.name = name
+        self.level = level
+        self.budget = budget or {}
+        self.weights = weights
+
+    @classmethod
+    def from_dict(cls, data):
+        name = data['name']
+        level = Level(data.get('level', name if name in [level.value for level in Level] else 'normal'))
+        budget = {key: data[key] for key in ('depth', 'nodes', 'time') if key in data}
+        weights = data.get('weights')
+        if weights is not None and level not in ai.load_weights(weights):
+            raise ValueError(f'{weights} has no weights for the level {level.value}')
+        return cls(name, level, budget, weights)
+
+    def to_dict(self):
+        data = {'name': self.name, 'level': self.level.value, **self.budget}
+        if self.weights is not None:
+            data['weights'] = self.weights
+        return data
+
+    def searcher(self):
+        weights = ai.load_weights(self.weights)[self.level] if self.weights is not None else None
+        return ai.Searcher(self.level, weights=weights, **{'time': float('inf'), **self.budget})
+
+
+def play_game(blue, pink, seed, max_turns=MAX_TURNS):
+    """
+    input : Config of the BLUE and PINK teams, seed of the game, turn count at which the game is drawn
+    output : (color of the winner or None for a draw, turns)
+    """
+    winner, turns, _ = simulate.play_game(blue.searcher(), pink.searcher(), seed, max_turns)
+    return (None if winner < 0 else (Color.BLUE, Color.PINK)[winner]), turns
+
+
+def _play(task):
+    game, blue, pink, max_turns = task
+    winner, turns = play_game(blue, pink, game['seed'], max_turns)
+    return {**game, 'winner': None if winner is None else winner.name, 'turns': turns}
+
+
+def match(round_number, first, second, seed):
+    """
+    output : the four games of a pairing, as dicts without their result
+    """
+    return [{'round': round_number, 'blue': blue, 'pink': pink, 'game': index,
+             'seed': zlib.crc32(f'{seed}:{round_number}:{blue}:{pink}:{index}'.encode())}
+            for blue, pink in ((first, second), (second, first)) for index in range(2)]
+
+
+def game_key(game):
+    return game['round'], game['blue'], game['pink'], game['game']
+
+
+def score(game, name):
+    """
+    output : points of the configuration in a finished game, 1 for a win, 0.5 for a draw
+    """
+    if game['winner'] is None:
+        return 0.5
+    return float((game['winner'] == Color.BLUE.name) == (game['blue'] == name))
+
+
+def standings(names, games):
+    """
+    output : {name : points} over the finished games
+    """
+    points = dict.fromkeys(names, 0.0)
+    for game in games:
+        points[game['blue']] += score(game, game['blue'])
+        points[game['pink']] += score(game, game['pink'])
+    return points
+
+
+def swiss_pairings(names, games):
+    """
+    input : names of the configurations in seeding order, finished games of the rounds before
+    output : list of the pairings of the next round, the lowest configuration without a bye yet sitting out
+        when their number is odd, without any points
+    The configurations are sorted by points, then paired from the top with the next one not met yet if any.
+    """
+    points = standings(names, games)
+    met = {(game['blue'], game['pink']) for game in games}
+    ranked = sorted(names, key=lambda name: (-points[name], names.index(name)))
+    seated = {(game['round'], name) for game in games for name in (game['blue'], game['pink'])}
+    byes = {name for round_number, _ in seated for name in names if (round_number, name) not in seated}
+    if len(ranked) % 2:
+        bye = next((name for name in reversed(ranked) if name not in byes), ranked[-1])
+        ranked.remove(bye)
+    pairings = []
+    while ranked:
+        first = ranked.pop(0)
+        second = next((name for name in ranked if (first, name) not in met), ranked[0])
+        ranked.remove(second)
+        pairings.append((first, second))
+    return pairings
+
+
+def read_checkpoint(path, settings):
+    """
+    output : finished games of the checkpoint, empty if it does not exist
+    raise : ValueError if it is the checkpoint of another tournament
+    A line cut by an interruption is dropped.
+    """
+    try:
+        with open(path) as file:
+            lines = file.readlines()
+    except FileNotFoundError:
+        return []
+    if not lines:
+        return []
+    header = json.loads(lines[0])
+    if header.get('tournament') != settings:
+        raise ValueError(f'{path} is the checkpoint of another tournament')
+    games = []
+    for line in lines[1:]:
+        try:
+            games.append(json.loads(line))
+        except ValueError:
+            break
+    return games
+
+
+def ratings(names, games):
+    """
+    input : names of the configurations, finished games
+    output : {name : (Elo rating, 95% margin)}, the ratings centred on 0
+    """
+    index = {name: i for i, name in enumerate(names)}
+    blue = np.array([index[game['blue']] for game in games], dtype=np.intp)
+    pink = np.array([index[game['pink']] for game in games], dtype=np.intp)
+    points = np.array([score(game, game['blue']) for game in games])
+    n = len(names)
+    c = math.log(10) / 400
+    rating = np.zeros(n)
+    for _ in range(100):
+        expected = 1 / (1 + np.exp(c * (rating[pink] - rating[blue])))
+        gradient = -rating / PRIOR ** 2
+        np.add.at(gradient, blue, c * (points - expected))
+        np.add.at(gradient, pink, -c * (points - expected))
+        weight = c * c * expected * (1 - expected)
+        hessian = -np.eye(n) / PRIOR ** 2
+        np.add.at(hessian, (blue, blue), -weight)
+        np.add.at(hessian, (pink, pink), -weight)
+        np.add.at(hessian, (blue, pink), weight)
+        np.add.at(hessian, (pink, blue), weight)
+        step = np.linalg.solve(hessian, gradient)
+        rating -= step
+        if np.abs(step).max() < 1e-6:
+            break
+    # covariance of the ratings once centred, the prior only deciding where their mean is
+    centre = np.eye(n) - 1 / n
+    margins = MARGIN * np.sqrt(np.diag(centre @ np.linalg.inv(-hessian) @ centre))
+    rating -= rating.mean()
+    return {name: (float(rating[i]), float(margins[i])) for name, i in index.items()}
+
+
+class Tournament:
+    """
+    PARAMETERS :
+    configs : list of Config
+    system : str                -> 'round-robin' or 'swiss'
+    rounds : int
+    checkpoint : path           -> file of the finished games
+    seed : int                  -> seed of the games
+    max_turns : int             -> turn count at which a game is drawn
+    games : list of dict        -> finished games
+
+    METHODS :
+    run(workers, report)        -> plays the games missing from the checkpoint
+    ratings()                   -> {name : (Elo, 95% margin)} of the finished games
+    table()                     -> standings as text
+    """
+    def __init__(self, configs, checkpoint, system='round-robin', rounds=1, seed=0, max_turns=MAX_TURNS):
+        names = [config.name for config in configs]
+        if len(set(names)) != len(names) or len(names) < 2:
+            raise ValueError('at least two configurations with different names are needed')
+        if system not in ('round-robin', 'swiss'):
+            raise ValueError(f'unknown system {system}')
+        self.configs = configs
+        self.names = names
+        self.system = system
+        self.rounds = rounds
+        self.checkpoint = checkpoint
+        self.seed = seed
+        self.max_turns = max_turns
+        self.settings = {'system': system, 'rounds': rounds, 'seed': seed, 'max_turns': max_turns,
+                         'players': [config.to_dict() for config in configs]}
+        self.games = read_checkpoint(checkpoint, self.settings)
+
+    def schedule(self, round_number):
+        """
+        output : games of the round, without their result
+        """
+        if self.system == 'round-robin':
+            pairings = [(first, second) for i, first in enumerate(self.names) for second in self.names[i + 1:]]
+        else:
+            pairings = swiss_pairings(self.names, [game for game in self.games if game['round'] < round_number])
+        return [game for first, second in pairings for game in match(round_number, first, second, self.seed)]
+
+    def run(self, workers=None, report=None):
+        """
+        input : number of processes (all the cores by default), function called with each game finished
+        The rounds of a round robin are played at once, those of a Swiss system one after the other.
+        """
+        configs = {config.name: config for config in self.configs}
+        done = {game_key(game) for game in self.games}
+        # written again from the games read, without a line cut by an interruption
+        with open(self.checkpoint, 'w') as file:
+            file.write(json.dumps({'tournament': self.settings}) + '\n')
+            file.writelines(json.dumps(game) + '\n' for game in self.games)
+        stages = [range(self.rounds)] if self.system == 'round-robin' else [[round_number]
+                                                                           for round_number in range(self.rounds)]
+        with simulate.spawn_pool(workers) as pool, open(self.checkpoint, 'a') as file:
+            for stage in stages:
+                tasks = [(game, configs[game['blue']], configs[game['pink']], self.max_turns)
+                         for round_number in stage for game in self.schedule(round_number)
+                         if game_key(game) not in done]
+                for game in pool.imap_unordered(_play, tasks):
+                    file.write(json.dumps(game) + '\n')
+                    file.flush()
+                    self.games.append(game)
+                    done.add(game_key(game))
+                    if report is not None:
+                        report(game)
+
+    def ratings(self):
+        return ratings(self.names, self.games)
+
+    def table(self):
+        points = standings(self.names, self.games)
+        counts = {name: sum(name in (game['blue'], game['pink']) for game in self.games) for name in self.names}
+        lines = [f'{"configuration":<20}{"games":>7}{"points":>8}{"elo":>8}{"margin":>8}']
+        for name, (rating, margin) in sorted(self.ratings().items(), key=lambda item: -item[1][0]):
+            lines.append(f'{name:<20}{counts[name]:>7}{points[name]:>8.1f}{rating:>8.0f}{margin:>8.0f}')
+        return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--players', default=None, help='JSON file of the configurations, one per level by default')
+    parser.add_argument('--system', default='round-robin', choices=['round-robin', 'swiss'])
+    parser.add_argument('--rounds', type=int, default=1)
+    parser.add_argument('--checkpoint', default='tournament.jsonl')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-turns', type=int, default=MAX_TURNS)
+    parser.add_argument('--report', type=int, default=20, help='games between two standings')
+    args = parser.parse_args(argv)
+    if args.players is None:
+        configs = [Config(level.value, level) for level in Level]
+    else:
+        with open(args.players) as file:
+            configs = [Config.from_dict(data) for data in json.load(file)]
+    tournament = Tournament(configs, args.checkpoint, args.system, args.rounds, args.seed, args.max_turns)
+    if tournament.games:
+        print(f'{len(tournament.games)} games already played')
+
+    def report(game):
+        if len(tournament.games) % args.report == 0:
+            print(tournament.table(), end='\n\n', flush=True)
+
+    tournament.run(args.workers, report)
+    print(tournament.table())
+
+
+if __name__ == '__main__':
+    main()
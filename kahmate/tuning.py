@@ -0,0 +1,176 @@
+"""
+Fits the weights of the evaluation of the AI to the results of self-play games.
+
+Games of the AI against itself are played over a pool of processes, each one from its own seed and
+a few random plies, so that a batch can be replayed exactly and its games differ. Every position where
+the AI moved is labelled with the result of its game for the team to play: 1 for a win, 0 for a loss,
+0.5 for a draw. The `ai.features` of the positions and their labels are stored in a compressed
+NumPy file. The weights are then fitted by gradient descent on the whole batch, the winning chances
+of a position being the sigmoid of its evaluation divided by SCALE, and written to the weight file
+for the level, which the Searcher of the level loads:
+
+    python -m kahmate.tuning generate --level normal --games 2000 --output normal.npz
+    python -m kahmate.tuning fit normal.npz --level normal          # writes ai.WEIGHTS_PATH
+"""
+import argparse
+import json
+import time
+import numpy as np
+from kahmate import ai, simulate
+from kahmate.rules import Level
+
+
+# evaluation points per logit of the winning chances
+SCALE = 20
+MAX_TURNS = 200
+RANDOM_PLIES = 8
+EPOCHS = 2000
+RATE = 0.5
+L2 = 1e-4
+
+
+class Recorder:
+    """
+    Searcher keeping the features of the positions it moves in, and the team it moved for
+    """
+    def __init__(self, searcher):
+        self.searcher = searcher
+        self.rows = []
+        self.teams = []
+
+    def choose(self, position):
+        self.rows.append(ai.features(position, position.next_player()))
+        self.teams.append(position.next_player())
+        return self.searcher.choose(position)
+
+
+def play_game(seed, level, max_turns=MAX_TURNS, random_plies=RANDOM_PLIES, budget=None):
+    """
+    input : seed of the game, level of the AI playing both teams, turn count at which the game is drawn,
+        plies played at random first, budget of the searches (the nodes of the level without time limit)
+    output : (features, labels) of the positions where the AI moved, as float32 arrays
+    """
+    recorder = Recorder(ai.Searcher(level, **{'time': float('inf'), **(budget or {})}))
+    winner, _, _ = simulate.play_game(recorder, recorder, seed, max_turns, random_plies)
+    labels = [0.5 if winner < 0 else float(winner == team) for team in recorder.teams]
+    return (np.array(recorder.rows, dtype=np.float32).reshape(-1, len(ai.FEATURES)),
+            np.array(labels, dtype=np.float32))
+
+
+def _play(args):
+    return play_game(*args)
+
+
+def generate(games, level, output, workers=None, seed=0, max_turns=MAX_TURNS, budget=None, chunksize=4):
+    """
+    input : number of games, level of the AI, path of the position file, number of processes
+        (all the cores by default), seed of the first game, the others following
+    output : number of positions written
+    """
+    tasks = ((seed + index, level, max_turns, RANDOM_PLIES, budget) for index in range(games))
+    features = []
+    labels = []
+    with simulate.spawn_pool(workers) as pool:
+        for game_features, game_labels in pool.imap_unordered(_play, tasks, chunksize):
+            features.append(game_features)
+            labels.append(game_labels)
+    features = np.concatenate(features) if features else np.zeros((0, len(ai.FEATURES)), np.float32)
+    labels = np.concatenate(labels) if labels else np.zeros(0, np.float32)
+    np.savez_compressed(output, features=features, labels=labels, names=np.array(ai.FEATURES))
+    return len(labels)
+
+
+def load_positions(path):
+    """
+    output : (features, labels) of a position file
+    raise : ValueError if its features are not ai.FEATURES
+    """
+    with np.load(path) as data:
+        if tuple(data['names']) != ai.FEATURES:
+            raise ValueError(f'{path} holds the features {tuple(data["names"])}, not {ai.FEATURES}')
+        return data['features'], data['labels']
+
+
+def loss(features, labels, weights):
+    """
+    output : mean cross entropy of the winning chances given by the weights
+    """
+    chances = 1 / (1 + np.exp(-features @ np.array([weights[name] for name in ai.FEATURES]) / SCALE))
+    chances = np.clip(chances, 1e-7, 1 - 1e-7)
+    return float(-np.mean(labels * np.log(chances) + (1 - labels) * np.log(1 - chances)))
+
+
+def fit(features, labels, weights=None, epochs=EPOCHS, rate=RATE, l2=L2):
+    """
+    input : features and labels of the positions, weights to start from (ai.WEIGHTS by default)
+    output : fitted weights, as a dict
+    The features are divided by their spread so that a single rate suits all of them, and not centred,
+    so that the evaluation of the other team stays the opposite.
+    """
+    weights = weights or ai.WEIGHTS
+    x = features.astype(np.float64) / SCALE
+    spread = np.sqrt(np.mean(x ** 2, axis=0))
+    spread[spread == 0] = 1
+    x /= spread
+    y = labels.astype(np.float64)
+    w = np.array([weights[name] for name in ai.FEATURES], dtype=np.float64) * spread
+    for _ in range(epochs):
+        chances = 1 / (1 + np.exp(-(x @ w)))
+        w -= rate * (x.T @ (chances - y) / len(y) + l2 * w)
+    return {name: round(float(value), 4) for name, value in zip(ai.FEATURES, w / spread)}
+
+
+def write_weights(level, weights, path=ai.WEIGHTS_PATH):
+    """
+    The weights of the level replace the ones the file held, those of the other levels are kept
+    """
+    try:
+        with open(path) as file:
+            levels = json.load(file)
+    except FileNotFoundError:
+        levels = {}
+    levels[level.value] = weights
+    with open(path, 'w') as file:
+        json.dump(levels, file, indent=4, sort_keys=True)
+        file.write('\n')
+    ai.load_weights.cache_clear()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    play = commands.add_parser('generate', help='self-play games into a position file')
+    play.add_argument('--level', default='normal', choices=[level.value for level in Level])
+    play.add_argument('--games', type=int, default=1000)
+    play.add_argument('--output', default='positions.npz')
+    play.add_argument('--workers', type=int, default=None)
+    play.add_argument('--seed', type=int, default=0)
+    play.add_argument('--max-turns', type=int, default=MAX_TURNS)
+    play.add_argument('--nodes', type=int, default=None, help='node budget of every search')
+    tune = commands.add_parser('fit', help='fit the weights of a level to position files')
+    tune.add_argument('positions', nargs='+')
+    tune.add_argument('--level', default='normal', choices=[level.value for level in Level])
+    tune.add_argument('--weights', default=str(ai.WEIGHTS_PATH), help='weight file to write')
+    tune.add_argument('--epochs', type=int, default=EPOCHS)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    level = Level(args.level)
+    if args.command == 'generate':
+        budget = {'nodes': args.nodes} if args.nodes else None
+        count = generate(args.games, level, args.output, args.workers, args.seed, args.max_turns, budget)
+        print(f'{count} positions from {args.games} games in {time.perf_counter() - start:.1f} s')
+        return
+    data = [load_positions(path) for path in args.positions]
+    features = np.concatenate([features for features, _ in data])
+    labels = np.concatenate([labels for _, labels in data])
+    initial = ai.level_weights(level)
+    weights = fit(features, labels, initial, args.epochs)
+    write_weights(level, weights, args.weights)
+    print(f'{len(labels)} positions, loss {loss(features, labels, initial):.4f} -> '
+          f'{loss(features, labels, weights):.4f} in {time.perf_counter() - start:.1f} s')
+    print(json.dumps(weights))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Zobrist hashing of positions, and a transposition table for the searches.
+
+The hash of a position is the xor of one 64 bit key per feature:
+- each piece on its square, each piece which has moved this turn, each piece down
+  with its turn_death
+- the square of the ball, the deck of each team, the turn count
+
+so that a move only xors out the keys of what it changes and xors in the new ones.
+`rules.GameState` and `engine.Position` keep their hash up to date this way, and
+give the same hash for the same position.
+"""
+import random
+from kahmate.tables import NSQUARES
+
+
+NPIECES = 12
+_rng = random.Random(0x6b61686d)
+
+PIECE_SQUARE = [[_rng.getrandbits(64) for _ in range(NSQUARES)] for _ in range(NPIECES)]
+BALL = [_rng.getrandbits(64) for _ in range(NSQUARES)]
+MOVED = [_rng.getrandbits(64) for _ in range(NPIECES)]
+DECK = [[_rng.getrandbits(64) for _ in range(32)] for _ in range(2)]
+ROOT = [_rng.getrandbits(64) for _ in range(2)]
+_DOWN_SALT = _rng.getrandbits(64)
+_TURN_SALT = _rng.getrandbits(64)
+
+# xor of the MOVED keys of each moved bitmask
+MOVED_MASK = [0] * (1 << NPIECES)
+for _mask in range(1, 1 << NPIECES):
+    _low = _mask & -_mask
+    MOVED_MASK[_mask] = MOVED_MASK[_mask ^ _low] ^ MOVED[_low.bit_length() - 1]
+
+MASK64 = (1 << 64) - 1
+
+
+def mix(value):
+    """
+    output : splitmix64 of the value, a key for features without a bounded range
+    """
+    value = (value + 0x9e3779b97f4a7c15) & MASK64
+    value = ((value ^ (value >> 30)) * 0xbf58476d1ce4e5b9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94d049bb133111eb) & MASK64
+    return value ^ (value >> 31)
+
+
+def down_key(piece, turn_death):
+    return mix(_DOWN_SALT ^ (piece << 40) ^ turn_death)
+
+
+TURN = [mix(_TURN_SALT ^ turn_count) for turn_count in range(4096)]
+
+
+def turn_key(turn_count):
+    if turn_count < 4096:
+        return TURN[turn_count]
+    return mix(_TURN_SALT ^ turn_count)
+
+
+def position_hash(position):
+    """
+    input : engine.Position
+    output : its hash, computed from scratch
+    """
+    key = BALL[position.ball] ^ MOVED_MASK[position.moved] ^ turn_key(position.turn_count)
+    key ^= DECK[0][position.decks[0]] ^ DECK[1][position.decks[1]]
+    for piece in range(NPIECES):
+        key ^= PIECE_SQUARE[piece][position.square[piece]]
+        if position.death[piece] >= 0:
+            key ^= down_key(piece, position.death[piece])
+    return key
+
+
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+
+class TranspositionTable:
+    """
+    Fixed number of slots, the slot of a position is given by the low bits of its hash.
+    A slot is replaced by a deeper search, or by any search once its entry is from an older generation.
+
+    PARAMETERS :
+    capacity : int              -> number of slots, a power of two
+    generation : int            -> incremented by new_search(), to age the entries
+
+    METHODS :
+    probe(key)                  -> (depth, value, flag, best move, legal moves) stored for the key, None otherwise
+    store(key, depth, value, flag, best_move, moves)
+    new_search()
+    """
+    def __init__(self, capacity=1 << 16):
+        assert capacity & (capacity - 1) == 0, "the capacity must be a power of two"
+        self.capacity = capacity
+        self._mask = capacity - 1
+        self._keys = [None] * capacity
+        self._entries = [None] * capacity
+        self._generations = [0] * capacity
+        self.generation = 0
+        self.hits = 0
+        self.stores = 0
+
+    def new_search(self):
+        self.generation += 1
+
+    def probe(self, key):
+        index = key & self._mask
+        if self._keys[index] == key:
+            self.hits += 1
+            return self._entries[index]
+        return None
+
+    def store(self, key, depth, value, flag, best_move=None, moves=None):
+        index = key & self._mask
+        entry = self._entries[index]
+        if entry is not None and self._keys[index] != key and entry[0] > depth \
+                and self._generations[index] == self.generation:
+            return
+        if moves is None and entry is not None and self._keys[index] == key:
+            moves = entry[4]
+        self._keys[index] = key
+        self._entries[index] = (depth, value, flag, best_move, moves)
+        self._generations[index] = self.generation
+        self.stores += 1
+
+    def clear(self):
+        self._keys = [None] * self.capacity
+        self._entries = [None] * self.capacity
+        self._generations = [0] * self.capacity
@@ -1,8 +1,13 @@
+import logging
 import random
+import time
 from kahmate.settings import *
-from kahmate import model
+from kahmate.assets import *
+from kahmate import ai, model, profiling, record, render, rules, thinking
 import pygame as pg
 
+logger = logging.getLogger(__name__)
+
 
 def get_row_col_from_mouse(pos):
     """
@@ -21,26 +26,38 @@ class Game:
     clock
     screen
     players : list of model.Players
-    _next_player : int          -> index of the next player
-    ball_position : [int, int]  -> used to display the ball
-    board : model.Board         -> contains the players' pieces in a more practical way
+    state : rules.GameState     -> positions, ball, turn count and decks, played without pygame
     valid_moves : list of moves -> possible moves for the selected piece
-    turn_count : int            -> used to decide whose turn it is and when to resuscitate a piece
+    dirty : render.DirtyTracker -> parts of the screen to update, None to redraw everything
+    stats : profiling.FrameStats -> time spent in each phase of the frames
+    seed : int                  -> seed of the random generator placing the ball and drawing the strength cards
+    record_path : path          -> file where the finished games are appended as record.GameRecord, None to keep none
 
     METHODS :
     __init__(players)        -> create a game from the names of the players and their colors
+    new_game(players, seed)  -> starts a new game without setting pygame up again
     next_player() : Player   -> outputs the next player
     update()                -> update the ball's owner, which piece is down, the screen
+    regions()               -> what is drawn over the background, to find the parts of the screen to update
     __str__()               -> creates a description of the deck in str
     opponent_search(search_pos, piece_pos) -> checks if there is an opponent between search_pos and piece_pos)
     generate_displacement(x, y) -> adds in _valid_moves a list of model.Displacement for the piece located at [x, y]
     generate_pass(x, y)         -> adds in _valid_moves a list of model.Pass for the piece located at [x, y]
     face_off(attack_piece, defense_piece) -> simulates a face off between two pieces for example in a conflict of disp
+    handle_event(event)     -> reacts to a click
+    play_ai()               -> plays the move of an AI player
+    save_record()           -> appends the finished game to the record file
     run()                   -> plays the game
     """
-    def __init__(self, players):
+    def __init__(self, players, dirty_rects=True, stats=None, record_path=None, seed=None, think_aside=True):
         """
         Entry :  list of players [(name_player1 : str, name_player2), (color_player1: model.Color, color_player2)]
+            dirty_rects : only push the parts of the window which changed, otherwise redraw everything every frame
+            stats : 'screen' or 'log' to show the frame times every second, None to only record them
+            record_path : file where each finished game is appended, see kahmate.record
+            seed : seed of the first game, a random one by default
+            think_aside : the AI searches in another process while the window keeps drawing, and ponders
+                on the turn of a human, otherwise the loop waits for its moves
         Output : Game ready to play
         """
         # init pygame
@@ -53,6 +70,27 @@ class Game:
         icon = pg.image.load(IMG_PATH/'ball.png')
         pg.display.set_icon(icon)
         pg.display.set_caption(TITLE)
+        self.dirty = render.DirtyTracker() if dirty_rects else None
+
+        # frame time instrumentation
+        self.stats = profiling.FrameStats()
+        self.stats_display = stats
+        self.stats_text = ''
+        self._stats_time = time.perf_counter()
+
+        self.record_path = record_path
+        self.think_aside = think_aside
+        self.thinker = None
+        self.new_game(players, seed)
+
+    def new_game(self, players, seed=None):
+        """
+        Entry :  same list of players as __init__, seed of the game (a random one by default)
+        Output : a new game in the same window, the images already loaded are kept
+        """
+        self.players_definition = players
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        self.recorded = False
 
         # define players
         self.players = []
@@ -63,37 +101,44 @@ class Game:
                 self.players.append(model.AIPlayer(player, color))
             else:
                 assert False, "unknown player definition"
-        self._next_player = 0
 
-        # define ball
-        random_player = random.choice(self.players)
-        random_piece = random.choice(random_player.pieces)
-        random_piece.has_ball = True
-        self.ball_position = random_piece.position
-
-        # define board
-        self.board = model.Board()
-        self.board.update_board(self.players)
+        # define ball and board
+        self.state = rules.GameState(self.players, random.Random(self.seed))
+        self.background = self.bake_background()
+        if self.dirty:
+            self.dirty.invalidate()
 
         # define move parameters
         self.valid_moves = []
-        self.turn_count = 0
         self.play_again_button = None
 
         self.main_msg = 'IT\'S ON!'
 
-    def draw_bgd(self):
-        self.screen.fill(BLACK)
-        pg.draw.rect(self.screen, BLUE, ((COLSAUX-1)*GRIDWIDTH, ROWSAUX*GRIDWIDTH, GRIDWIDTH, ROWS*GRIDWIDTH))
-        pg.draw.rect(self.screen, PINK, ((COLSAUX+COLS)*GRIDWIDTH, ROWSAUX*GRIDWIDTH, GRIDWIDTH, ROWS*GRIDWIDTH))
-        pg.draw.rect(self.screen, DARK_GREEN, (COLSAUX*GRIDWIDTH, ROWSAUX*GRIDWIDTH, COLS*GRIDWIDTH, ROWS*GRIDWIDTH))
+    def bake_background(self):
+        """
+        output : surface of everything which does not change during a game, the pitch and the decks
+        """
+        background = pg.Surface((WIDTH, HEIGHT)).convert()
+        background.fill(BLACK)
+        pg.draw.rect(background, BLUE, ((COLSAUX-1)*GRIDWIDTH, ROWSAUX*GRIDWIDTH, GRIDWIDTH, ROWS*GRIDWIDTH))
+        pg.draw.rect(background, PINK, ((COLSAUX+COLS)*GRIDWIDTH, ROWSAUX*GRIDWIDTH, GRIDWIDTH, ROWS*GRIDWIDTH))
+        pg.draw.rect(background, DARK_GREEN, (COLSAUX*GRIDWIDTH, ROWSAUX*GRIDWIDTH, COLS*GRIDWIDTH, ROWS*GRIDWIDTH))
+
+        for row in range(ROWSAUX, ROWS + ROWSAUX):
+            for col in range(row % 2 + COLSAUX, COLS + COLSAUX, 2):
+                pg.draw.rect(background, GREEN, (col*GRIDWIDTH, row*GRIDWIDTH, GRIDWIDTH, GRIDWIDTH))
 
         for player in self.players:
-            deck = pg.transform.scale(pg.image.load(IMG_PATH / 'deck.png'), (DECKSIZE, DECKSIZE))
+            deck = image('deck.png', (DECKSIZE, DECKSIZE))
             deck_rect = deck.get_rect()
             deck_rect.center = player.center_aux(3)
-            self.screen.blit(deck, deck_rect)
+            background.blit(deck, deck_rect)
+        return background
+
+    def draw_bgd(self):
+        self.screen.blit(self.background, (0, 0))
 
+        for player in self.players:
             color = BLUE if player.color == model.Color.BLUE else PINK
             is_bold = True if player == self.next_player() else False
             team_name_img = create_text(f'{player.color.value.upper()} TEAM', Fonts.TITLE.value, TextSize.TITLE.value,
@@ -107,40 +152,102 @@ class Game:
         main_msg_rect.center = WIDTH/2, ROWSAUX*GRIDWIDTH/2
         self.screen.blit(main_msg_img, main_msg_rect)
 
-        for row in range(ROWSAUX, ROWS + ROWSAUX):
-            for col in range(row % 2 + COLSAUX, COLS + COLSAUX, 2):
-                pg.draw.rect(self.screen, GREEN, (col*GRIDWIDTH, row*GRIDWIDTH, GRIDWIDTH, GRIDWIDTH))
-
     def draw(self):
         self.draw_bgd()
         for move in self.valid_moves:
             move.draw(self.screen, self.next_player())
+        if self.valid_moves:
+            self.valid_moves[0].draw_card(self.screen, self.next_player())
         for player in self.players:
             player.draw(self.screen)
-        self.screen.blit(BALL, (self.ball_position[1] * GRIDWIDTH, self.ball_position[0] * GRIDWIDTH))
+        self.screen.blit(ball(), (self.ball_position[1] * GRIDWIDTH, self.ball_position[0] * GRIDWIDTH))
+        if self.stats_display == 'screen':
+            stats_img = create_text(self.stats_text, Fonts.SUBTITLE.value, TextSize.REGULAR.value, WHITE, False)
+            stats_rect = stats_img.get_rect()
+            stats_rect.center = WIDTH/2, HEIGHT - ROWSAUX*GRIDWIDTH/2
+            self.screen.blit(stats_img, stats_rect)
+
+    @property
+    def ball_position(self):
+        return self.state.ball_position
+
+    @property
+    def board(self):
+        return self.state.board
+
+    @property
+    def turn_count(self):
+        return self.state.turn_count
+
+    @property
+    def _next_player(self):
+        return self.state._next_player
 
     def next_player(self):
         """
         output : player
         """
-        return self.players[self._next_player]
+        return self.state.next_player()
 
     def update(self):
         """
         If a player has the same position as the ball, it takes it
         If a player has been down for long enough, it comes back up
         The screen is updated
+        output : True if something was drawn
+        """
+        self.state.refresh()
+        winner = self.state.winner()
+        if winner is not None:
+            # set before the regions are compared, so that the frame of the try draws it
+            self.main_msg = f'{winner.value.upper()} TEAM WINS!!!'
+        if self.dirty is None:
+            with self.stats.phase('draw'):
+                self.draw()
+                self.game_over()
+                pg.display.update()
+            return True
+        rects = self.dirty.dirty_rects(self.regions())
+        if rects:
+            with self.stats.phase('draw'):
+                self.draw()
+                self.game_over()
+                pg.display.update(rects)
+        return bool(rects)
+
+    def regions(self):
         """
+        output : {region : (rect, content)} of everything drawn over the background, see render.DirtyTracker
+        """
+        regions = {}
+
+        def on_square(position, content):
+            region = ('square', position[0], position[1])
+            rect, contents = regions.get(region, (render.square_rect(position), ()))
+            regions[region] = (rect, contents + (content,))
+
+        for move in self.valid_moves:
+            on_square(move.second_position, (type(move).__name__, move.piece.name,
+                                             getattr(move, 'face_off_opponent', None) is not None))
         for player in self.players:
             for piece in player.pieces:
-                if piece.position == self.ball_position and not piece.has_ball:
-                    piece.has_ball = True
-                if -1 < piece.turn_death + 3 < self.turn_count:
-                    piece.is_down = False
-                    piece.turn_death = -1
-        self.draw()
-        self.game_over()
-        pg.display.update()
+                on_square(piece.position, (player.color, piece.name, piece.is_down))
+            if player.color == model.Color.BLUE:
+                panel = pg.Rect(0, 0, (COLSAUX-1)*GRIDWIDTH, HEIGHT)
+            else:
+                panel = pg.Rect((COLSAUX+COLS+1)*GRIDWIDTH, 0, (COLSAUX-1)*GRIDWIDTH, HEIGHT)
+            selected = self.valid_moves[0].piece.name if self.valid_moves and player == self.next_player() else None
+            regions[('panel', player.color)] = (panel, (player == self.next_player(),
+                                                        player.last_strength_picked, selected))
+        on_square(self.ball_position, 'ball')
+        winner = self.state.winner()
+        regions['message'] = (pg.Rect(0, 0, WIDTH, ROWSAUX*GRIDWIDTH), (self.main_msg, winner))
+        if self.stats_display == 'screen':
+            regions['stats'] = (pg.Rect(0, HEIGHT - ROWSAUX*GRIDWIDTH, WIDTH, ROWSAUX*GRIDWIDTH), self.stats_text)
+        if winner is not None:
+            regions['game over'] = (pg.Rect((COLSAUX-1)*GRIDWIDTH, ROWSAUX*GRIDWIDTH, (COLS+1)*GRIDWIDTH,
+                                            ROWS*GRIDWIDTH), winner)
+        return regions
 
     def __str__(self):
         ans = "Description of the first team :"
@@ -156,65 +263,23 @@ class Game:
                 piece_position = position of the active piece
         output : face off opponent if there is an opponent between the two positions
         """
-        face_off_opponent = None
-        distance = abs(search_position[0] - piece_position[0]) + abs(search_position[1] - piece_position[1])
-        for k in range(distance - 1):
-            case_x = int(((k + 1) / distance) * search_position[0] +
-                         ((distance - (k + 1)) / distance) * piece_position[0])
-            case_y = int(((k + 1) / distance) * search_position[1] +
-                         ((distance - (k + 1)) / distance) * piece_position[1])
-            if self.board.matrix[case_x][case_y] is not None:
-                possible_foo = self.board.matrix[case_x][case_y]
-                if possible_foo in self.players[(self._next_player + 1) % 2].pieces and not possible_foo.is_down:
-                    face_off_opponent = possible_foo
-        return face_off_opponent
+        return self.state.opponent_search(search_position, piece_position)
 
     def generate_displacement(self, x: int, y: int):
         """
         input : x, y position of the case to try
         output : if a piece in the right team has [x,y] for position, list of model.Displacement possible for the piece
         """
-        piece = self.board.matrix[x][y]
-        if piece in self.next_player().pieces and not piece.is_down and not piece.has_moved:
-            for i in range(1, ROWS+ROWSAUX):
-                if self._next_player == 0:
-                    mini = COLSAUX
-                    maxi = COLS + COLSAUX + 1
-                else:
-                    mini = COLSAUX - 1
-                    maxi = COLS + COLSAUX
-                for j in range(mini, maxi):
-                    distance_ok = 0 < abs(i-piece.position[0]) + abs(j-piece.position[1]) <= piece.speed
-                    empty_case = self.board.matrix[i][j] is None
-                    if distance_ok and empty_case:
-                        face_off_opponent = self.opponent_search([i, j], piece.position)
-                        self.valid_moves.append(model.Displacement(piece, [i, j], face_off_opponent))
-                    if distance_ok and not empty_case:
-                        possible_opponent = self.board.matrix[i][j]
-                        if possible_opponent in self.players[(self._next_player + 1) % 2].pieces and \
-                                possible_opponent.has_ball:
-                            self.valid_moves.append(model.Tackle(piece, possible_opponent))
+        for move in self.state.generate_displacement(self.board.matrix[x][y]):
+            self.valid_moves.append(model.from_rules(move))
 
     def generate_pass(self, x: int, y: int):
         """
         input : x, y position of the case to try
         output : if a piece in the right team has [x,y] for position, list of model.Pass possible for the piece
         """
-        piece = self.board.matrix[x][y]
-        if piece in self.next_player().pieces and not piece.is_down and piece.has_ball:
-            for i in range(max(1, piece.position[0]-2), min(ROWS+1, piece.position[0]+3)):
-                if self._next_player == 0:
-                    mini = max(1, piece.position[1] - 2)
-                    maxi = piece.position[1]
-                else:
-                    mini = min(COLS+4, piece.position[1]+1)
-                    maxi = min(COLS+4, piece.position[1]+3)
-                for j in range(mini, maxi):
-                    if self.board.matrix[i][j] is not None:
-                        possible_friend = self.board.matrix[i][j]
-                        if possible_friend in self.players[self._next_player].pieces:
-                            face_off_opponent = self.opponent_search([i, j], piece.position)
-                            self.valid_moves.append(model.Pass(piece, possible_friend, face_off_opponent))
+        for move in self.state.generate_pass(self.board.matrix[x][y]):
+            self.valid_moves.append(model.from_rules(move))
 
     def face_off(self, attack_piece: model.Piece, defense_piece: model.Piece):
         """
@@ -222,29 +287,7 @@ class Game:
             defense_piece = piece which is in the way
         output : result of the face off as a str
         """
-        attack_player = self.players[self._next_player]
-        defense_player = self.players[(self._next_player + 1) % 2]
-
-        attack_strength = attack_player.pick_strength()
-        defense_strength = defense_player.pick_strength()
-
-        attack_score = attack_strength + attack_piece.attack
-        defense_score = defense_strength + defense_piece.defense
-        if attack_score >= defense_score + 2:
-            return "Plaquage parfait!"
-        if defense_score + 2 > attack_score > defense_score:
-            return "Attack wins!"
-        if defense_score > attack_score:
-            return "Defense wins!"
-        else:
-            attack_pick = attack_player.pick_strength() + attack_piece.attack
-            defense_pick = defense_player.pick_strength() + defense_piece.defense
-            if attack_score >= defense_score + 2:
-                return "Plaquage parfait!"
-            if attack_pick > defense_pick:
-                return "Attack wins!"
-            else:
-                return "Defense wins!"
+        return self.state.face_off(attack_piece, defense_piece)
 
     def draw_game_over(self):
 
@@ -258,7 +301,7 @@ class Game:
         self.play_again_button.center = WIDTH/2, HEIGHT/2
         pg.draw.rect(self.screen, WHITE, self.play_again_button, border_radius=2)
 
-        arrow_img = pg.transform.scale(pg.image.load(IMG_PATH / 'arrow.png'), ARROWSIZE)
+        arrow_img = image('arrow.png', ARROWSIZE)
         arrow_rect = arrow_img.get_rect()
         arrow_rect.center = WIDTH/2 - 90, HEIGHT/2
         self.screen.blit(arrow_img, arrow_rect)
@@ -269,12 +312,99 @@ class Game:
         self.screen.blit(play_msg_img, play_msg_rect)
 
     def game_over(self):
-        if self.ball_position[1] < COLSAUX:
-            self.main_msg = 'PINK TEAM WINS!!!'
-            self.draw_game_over()
-        elif self.ball_position[1] >= COLS + COLSAUX:
-            self.main_msg = 'BLUE TEAM WINS!!!'
+        winner = self.state.winner()
+        if winner is not None:
             self.draw_game_over()
+            self.save_record()
+
+    def save_record(self):
+        """
+        The game is appended to the record file once, if there is one
+        """
+        if self.record_path is None or self.recorded:
+            return
+        record.write_games(self.record_path, [record.GameRecord.from_state(self.state, self.seed)])
+        self.recorded = True
+
+    def handle_event(self, event):
+        """
+        input : pygame event
+        action : a click selects a piece, plays one of its moves or starts a new game
+        """
+        if event.type == pg.QUIT:
+            self.running = False
+        if event.type == pg.WINDOWEXPOSED and self.dirty:
+            self.dirty.invalidate()
+        if event.type == pg.MOUSEBUTTONDOWN:
+            mouse_pos = event.pos
+            x, y = get_row_col_from_mouse(mouse_pos)
+            if self.valid_moves:
+                if [x, y] == self.valid_moves[0].piece.position:
+                    self.valid_moves = []
+                else:
+                    for move in self.valid_moves:
+                        if [x, y] == move.second_position:
+                            with self.stats.phase('play'):
+                                move.play(self)
+                            self.valid_moves = []
+            elif self.play_again_button:
+                if self.play_again_button.collidepoint(mouse_pos):
+                    self.new_game(self.players_definition)
+            else:
+                with self.stats.phase('generation'):
+                    self.generate_displacement(x, y)
+                    self.generate_pass(x, y)
+
+    def play_ai(self):
+        """
+        If the next player is an AI, it chooses its move within the time of its level and plays it.
+        Thinking aside, the move is only played on the frame it is found, and an AI ponders on the turn of
+        a human.
+        output : True if a move was played
+        """
+        player = self.next_player()
+        if self.state.winner() is not None:
+            return False
+        if not isinstance(player, model.AIPlayer):
+            opponent = self.state.other_player()
+            if self.think_aside and isinstance(opponent, model.AIPlayer):
+                self.get_thinker().ponder(self.state, self.players.index(opponent), opponent.level)
+            return False
+        with self.stats.phase('ai'):
+            if self.think_aside:
+                move = self.get_thinker().think(self.state, player.level)
+                if move is None:
+                    return False
+            else:
+                move = ai.choose_move(self.state, player.level)
+        self.valid_moves = []
+        with self.stats.phase('play'):
+            if move[0] == rules.SKIP:
+                self.state.play(move)
+            else:
+                model.from_rules(move).play(self)
+        return True
+
+    def get_thinker(self):
+        """
+        output : thinking.Thinker of the AI players, started on its first use
+        """
+        if self.thinker is None:
+            self.thinker = thinking.Thinker()
+        return self.thinker
+
+    def show_stats(self):
+        """
+        Every second, the frame time percentiles are logged or prepared for the overlay
+        """
+        now = time.perf_counter()
+        if self.stats_display is None or now - self._stats_time < 1:
+            return
+        self._stats_time = now
+        if self.stats_display == 'log':
+            logger.info(self.stats.report())
+        else:
+            self.stats_text = self.stats.report()
 
     def run(self):
         """
@@ -283,31 +413,31 @@ class Game:
             generation of the possible displacements and passes stored in _valid_moves
         once movements have been calculated :
             wait for a movement to be selected and play it
+        When nothing changed on screen, the loop sleeps until the next event instead of spinning,
+        otherwise the clock caps it at FPS frames per second.
         """
+        idle = False
         while self.running:
-
-            for event in pg.event.get():
+            if idle:
+                events = [pg.event.wait(IDLE_TIMEOUT)] + pg.event.get()
+            else:
+                events = pg.event.get()
+            self.stats.start_frame(idle)
+            with self.stats.phase('events'):
+                for event in events:
+                    self.handle_event(event)
+            with self.stats.phase('update'):
+                drawn = self.update()
+            # a move played after the update is only drawn on the next frame
+            played = self.play_ai()
+            self.stats.end_frame()
+            self.show_stats()
+            idle = not drawn and not played and not isinstance(self.next_player(), model.AIPlayer)
+            if not idle:
                 self.clock.tick(FPS)
-                if event.type == pg.QUIT:
-                    self.running = False
-                if event.type == pg.MOUSEBUTTONDOWN:
-                    mouse_pos = pg.mouse.get_pos()
-                    x, y = get_row_col_from_mouse(mouse_pos)
-                    if self.valid_moves:
-                        if [x, y] == self.valid_moves[0].piece.position:
-                            self.valid_moves = []
-                        else:
-                            for move in self.valid_moves:
-                                if [x, y] == move.second_position:
-                                    move.play(self)
-                                    self.valid_moves = []
-                    elif self.play_again_button:
-                        if self.play_again_button.collidepoint(mouse_pos):
-                            self.__init__([('BLUE', model.Color.BLUE), ('PINK', model.Color.PINK)])
-                    else:
-                        self.generate_displacement(x, y)
-                        self.generate_pass(x, y)
-            self.update()
+        if self.thinker is not None:
+            self.thinker.close()
+            self.thinker = None
 
 
 if __name__ == "__main__":
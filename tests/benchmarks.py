@@ -0,0 +1,243 @@
+"""
+Benchmarks of the hot paths of the rules, the engine and the drawing, on fixed seeds.
+
+Each benchmark reports operations per second, the best of a few repeats. They are
+compared with the baselines stored in benchmarks.json, and the run fails when one of
+them is slower than its baseline by more than the threshold.
+
+    python tests/benchmarks.py                  # run and compare with the baselines
+    python tests/benchmarks.py --update         # run and store the results as the new baselines
+    python tests/benchmarks.py playout draw     # only the benchmarks whose name contains one of the words
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+from kahmate import engine, model, rules
+from kahmate.settings import *
+
+
+BASELINES = Path(__file__).with_name('benchmarks.json')
+THRESHOLD = 0.3
+MIN_TIME = 0.2
+REPEATS = 5
+
+
+def crowded_states(count=8, seed=0, plies=30):
+    """
+    output : rules.GameState played randomly for a while from fixed seeds, the pieces mixed in the middle
+    """
+    rng = random.Random(seed)
+    states = []
+    while len(states) < count:
+        teams = [rules.Team(rules.Color.BLUE), rules.Team(rules.Color.PINK)]
+        for team in teams:
+            team.init_positions()
+        state = rules.GameState(teams, random.Random(rng.random()))
+        for _ in range(plies):
+            state.play(rng.choice(state.legal_moves()))
+            if state.winner() is not None:
+                break
+        else:
+            states.append(state)
+    return states
+
+
+def measure(function, number):
+    """
+    input : function running `number` operations
+    output : best operations per second over REPEATS runs of at least MIN_TIME seconds
+    """
+    best = 0
+    for _ in range(REPEATS):
+        runs = 0
+        start = time.perf_counter()
+        while True:
+            function()
+            runs += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= MIN_TIME:
+                break
+        best = max(best, runs * number / elapsed)
+    return best
+
+
+def bench_generation():
+    states = crowded_states()
+
+    def run():
+        for state in states:
+            for piece in state.next_player().pieces:
+                state.generate_displacement(piece)
+                state.generate_pass(piece)
+    return run, len(states) * 6
+
+
+def bench_opponent_search():
+    states = crowded_states()
+    rng = random.Random(1)
+    searches = []
+    for state in states:
+        for piece in state.next_player().pieces:
+            for _ in range(10):
+                target = [min(max(1, piece.position[0] + rng.randint(-2, 2)), ROWS),
+                          min(max(COLSAUX, piece.position[1] + rng.randint(-2, 2)), COLS + COLSAUX - 1)]
+                searches.append((state, target, piece.position))
+
+    def run():
+        for state, target, position in searches:
+            state.opponent_search(target, position)
+    return run, len(searches)
+
+
+def bench_update_board():
+    states = crowded_states()
+
+    def run():
+        for state in states:
+            state.board.update_board(state.players)
+    return run, len(states)
+
+
+def bench_face_off():
+    states = crowded_states()
+    pairs = [(state, state.next_player().pieces[i], state.other_player().pieces[j])
+             for state in states for i in range(6) for j in range(6)]
+
+    def run():
+        for state, attack, defense in pairs:
+            state.face_off(attack, defense)
+    return run, len(pairs)
+
+
+class _Table:
+    """
+    What model.Move.play needs of a main.Game
+    """
+    def __init__(self, state):
+        self.state = state
+
+
+def bench_move_play():
+    seeds = list(range(4))
+    plies = 40
+
+    def run():
+        for seed in seeds:
+            rng = random.Random(seed)
+            teams = [rules.Team(rules.Color.BLUE), rules.Team(rules.Color.PINK)]
+            for team in teams:
+                team.init_positions()
+            table = _Table(rules.GameState(teams, rng))
+            for _ in range(plies):
+                move = rng.choice(table.state.legal_moves())
+                if move[0] == rules.SKIP:
+                    table.state.play(move)
+                else:
+                    model.from_rules(move).play(table)
+                table.state.refresh()
+    return run, len(seeds) * plies
+
+
+def bench_playout():
+    starts = [engine.Position.initial(rng=random.Random(seed)) for seed in range(4)]
+
+    def run():
+        rng = random.Random(0)
+        for start in starts:
+            position = start.copy()
+            while position.winner() < 0 and position.turn_count < 400:
+                move = rng.choice(position.legal_moves())
+                position.play(move, position.sample_outcome(move, rng))
+    return run, len(starts)
+
+
+def bench_batch_rollout():
+    from kahmate import rollout
+    starts = [engine.Position.initial(rng=random.Random(seed)) for seed in range(4)]
+
+    def run():
+        rollout.rollout(starts, games=64, max_turns=100, seed=0)
+    return run, len(starts) * 64
+
+
+def bench_draw():
+    import main
+    game = main.Game([('BLUE', model.Color.BLUE), ('PINK', model.Color.PINK)], seed=0)
+    game.generate_displacement(*game.next_player().pieces[1].position)
+
+    def run():
+        game.draw()
+    return run, 1
+
+
+BENCHMARKS = {
+    'generation': bench_generation,
+    'opponent_search': bench_opponent_search,
+    'update_board': bench_update_board,
+    'face_off': bench_face_off,
+    'move_play': bench_move_play,
+    'playout': bench_playout,
+    'batch_rollout': bench_batch_rollout,
+    'draw': bench_draw,
+}
+
+
+def run_benchmarks(names=None):
+    """
+    input : names of the benchmarks to run, all by default
+    output : {name : operations per second}
+    """
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if names and not any(word in name for word in names):
+            continue
+        function, number = setup()
+        results[name] = measure(function, number)
+    return results
+
+
+def compare(results, baselines, threshold=THRESHOLD):
+    """
+    output : list of (name, ops/sec, baseline ops/sec) of the benchmarks slower than their baseline by more
+        than the threshold
+    """
+    return [(name, value, baselines[name]) for name, value in results.items()
+            if name in baselines and value < baselines[name] * (1 - threshold)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('names', nargs='*', help='only run the benchmarks whose name contains one of these')
+    parser.add_argument('--update', action='store_true', help='store the results as the new baselines')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='slowdown allowed, 0.3 = 30%%')
+    parser.add_argument('--baselines', type=Path, default=BASELINES)
+    args = parser.parse_args(argv)
+
+    baselines = json.loads(args.baselines.read_text()) if args.baselines.exists() else {}
+    results = run_benchmarks(args.names)
+    print(f'{"benchmark":<16}{"ops/sec":>14}{"baseline":>14}{"change":>10}')
+    for name, value in results.items():
+        baseline = baselines.get(name)
+        change = f'{value / baseline - 1:+.0%}' if baseline else ''
+        print(f'{name:<16}{value:>14,.0f}{baseline or 0:>14,.0f}{change:>10}')
+
+    if args.update:
+        baselines.update({name: round(value, 1) for name, value in results.items()})
+        args.baselines.write_text(json.dumps(baselines, indent=4, sort_keys=True) + '\n')
+        return 0
+    regressions = compare(results, baselines, args.threshold)
+    for name, value, baseline in regressions:
+        print(f'REGRESSION {name}: {value:,.0f} ops/sec, baseline {baseline:,.0f}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,19 @@
-from kahmate import model
+import random
+import subprocess
+import time
+import sys
+from kahmate import engine, model, rules
 from kahmate.settings import *
 import main
 
 
+def new_state():
+    teams = [rules.Team(rules.Color.BLUE), rules.Team(rules.Color.PINK)]
+    for team in teams:
+        team.init_positions()
+    return rules.GameState(teams)
+
+
 def test_initialisation_piece():
     piece1 = model.Piece(model.PieceType.BIG)
     piece1.position = [100, 100]
@@ -80,3 +91,799 @@ def test_face_off():
     game.running = False
     face_off = game.face_off(game.players[0].pieces[0], game.players[0].pieces[1])
     assert face_off == "Attack wins!" or face_off == "Defense wins!" or face_off == "Plaquage parfait!"
+
+
+def test_rules_without_pygame():
+    code = "import sys, kahmate.rules; assert 'pygame' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_state_displacement():
+    state = new_state()
+    piece = state.players[0].pieces[1]
+    moves = state.generate_displacement(piece)
+    assert len(moves) == 5
+    move = [move for move in moves if move[2] == [3, 6]][0]
+    assert state.play(move) is None
+    assert piece.position == [3, 6] and piece.has_moved
+    assert state.board.matrix[3][6] is piece
+    assert state.turn_count == 1
+    assert state.generate_displacement(piece) == []
+
+
+def test_position_follows_rules():
+    random.seed(3)
+    state = new_state()
+    position = engine.Position.from_state(state)
+    # the undo stack is only allocated by the first move made
+    assert position._undo is None and position.copy()._undo is None
+    initial = position.key()
+    played = []
+    for _ in range(200):
+        moves = state.legal_moves()
+        if not moves or state.winner() is not None:
+            break
+        assert [engine.from_rules_move(state, move) for move in moves] == position.legal_moves()
+        move = random.choice(moves)
+        code = engine.from_rules_move(state, move)
+        team = state._next_player
+        result = state.play(move)
+        outcome = engine.NO_FACE_OFF
+        if result is not None:
+            outcome = engine.encode_outcome(engine.RESULTS[result],
+                                            engine.deck_mask(state.players[team].strength_deck),
+                                            engine.deck_mask(state.players[1 - team].strength_deck))
+        position.make_move(code, outcome)
+        played.append(code)
+        assert position.key() == engine.Position.from_state(state).key()
+    assert len(played) > 20
+    for code in reversed(played):
+        position.unmake_move(code)
+    assert position.key() == initial
+
+
+def test_zobrist_hash_follows_moves():
+    from kahmate import zobrist
+    random.seed(5)
+    state = new_state()
+    position = engine.Position.from_state(state)
+    hashes = [position.hash]
+    played = []
+    for _ in range(150):
+        if state.winner() is not None:
+            break
+        move = random.choice(state.legal_moves())
+        code = engine.from_rules_move(state, move)
+        team = state._next_player
+        result = state.play(move)
+        outcome = engine.NO_FACE_OFF
+        if result is not None:
+            outcome = engine.encode_outcome(engine.RESULTS[result],
+                                            engine.deck_mask(state.players[team].strength_deck),
+                                            engine.deck_mask(state.players[1 - team].strength_deck))
+        position.make_move(code, outcome)
+        played.append(code)
+        hashes.append(position.hash)
+        assert state.hash == state.compute_hash() == position.hash == zobrist.position_hash(position)
+    for code in reversed(played):
+        hashes.pop()
+        position.unmake_move(code)
+        assert position.hash == hashes[-1]
+    # the same displacements in another order lead to the same hash
+    position = engine.Position.initial(rng=random.Random(1))
+    moves = [move for move in position.legal_moves()
+             if engine.move_kind(move) == engine.DISPLACEMENT and engine.move_opponent(move) < 0]
+    first = [move for move in moves if engine.move_piece(move) == 0][0]
+    second = [move for move in moves if engine.move_piece(move) == 5
+              and engine.move_square(move) != engine.move_square(first)][0]
+    other = position.copy()
+    position.play(first)
+    position.play(second)
+    other.play(second)
+    other.play(first)
+    assert position.hash == other.hash and position.key() == other.key()
+
+
+def test_transposition_table():
+    from kahmate import zobrist
+    table = zobrist.TranspositionTable(4)
+    table.store(1, 3, 0.5, zobrist.EXACT, 7, [7, 8])
+    assert table.probe(1) == (3, 0.5, zobrist.EXACT, 7, [7, 8]) and table.probe(5) is None
+    # a shallower search of another position does not replace a deeper one of the same search
+    table.store(5, 1, 2.0, zobrist.LOWER)
+    assert table.probe(5) is None and table.probe(1)[0] == 3
+    table.new_search()
+    table.store(5, 1, 2.0, zobrist.LOWER)
+    assert table.probe(5)[:3] == (1, 2.0, zobrist.LOWER) and table.probe(1) is None
+    # the legal moves are kept when the same position is stored again
+    table.store(6, 0, 1.0, zobrist.EXACT, None, [1, 2])
+    table.store(6, 2, 1.5, zobrist.UPPER, 2)
+    assert table.probe(6) == (2, 1.5, zobrist.UPPER, 2, [1, 2])
+
+
+def test_reach_table():
+    for team in range(2):
+        mini, maxi = (COLSAUX, COLS + COLSAUX + 1) if team == 0 else (COLSAUX - 1, COLS + COLSAUX)
+        for speed in [2, 3, 4]:
+            for row in range(1, ROWS + ROWSAUX):
+                for col in range(COLSAUX - 1, COLS + COLSAUX + 1):
+                    expected = [[i, j] for i in range(1, ROWS + ROWSAUX) for j in range(mini, maxi)
+                                if 0 < abs(i - row) + abs(j - col) <= speed]
+                    reach = rules.REACH[team][speed][row * engine.NCOLS + col]
+                    assert [[i, j] for i, j, _ in reach] == expected
+
+
+def test_blockers_match_opponent_search():
+    random.seed(5)
+    state = new_state()
+    for _ in range(60):
+        position = engine.Position.from_state(state)
+        for piece in state.next_player().pieces:
+            blockers = state.blockers(piece.position)
+            square = piece.position[0] * engine.NCOLS + piece.position[1]
+            compact_blockers = position.blockers(square)
+            for i in range(1, ROWS + ROWSAUX):
+                for j in range(COLSAUX - 1, COLS + COLSAUX + 1):
+                    if 0 < abs(i - piece.position[0]) + abs(j - piece.position[1]) <= 4:
+                        opponent = state.opponent_search([i, j], piece.position)
+                        assert blockers.get(i * engine.NCOLS + j) is opponent
+                        target = i * engine.NCOLS + j
+                        assert compact_blockers.get(target, -1) == position.opponent_search(target, square)
+        moves = state.legal_moves()
+        if not moves or state.winner() is not None:
+            break
+        state.play(random.choice(moves))
+
+
+def test_images_shared():
+    game = main.Game([('BLUE', model.Color.BLUE), ('PINK', model.Color.PINK)])
+    game.running = False
+    other = model.HumanPlayer("Jacques", model.Color.BLUE)
+    assert other.pieces_img['big'] is game.players[0].pieces_img['big']
+    game.new_game(game.players_definition)
+    assert game.players[1].strength_deck_img[3] is model.image('card_pink_3.png', CARDSIZE)
+
+
+def test_texts_rendered_once():
+    game = main.Game([('BLUE', model.Color.BLUE), ('PINK', model.Color.PINK)])
+    game.running = False
+    game.generate_displacement(*game.players[0].pieces[3].position)
+    assert game.valid_moves
+    game.draw()
+    hits = model.create_text.cache_info().hits
+    model.info_card.cache_clear()
+    game.draw()
+    assert model.info_card.cache_info().misses == 1
+    assert model.create_text.cache_info().hits > hits
+    assert model.create_text("speed", Fonts.SUBTITLE.value, 14, BLACK, False) is \
+        model.create_text("speed", Fonts.SUBTITLE.value, 14, BLACK, False)
+
+
+def test_dirty_rects():
+    game = main.Game([('BLUE', model.Color.BLUE), ('PINK', model.Color.PINK)])
+    game.running = False
+    assert len(game.dirty.dirty_rects(game.regions())) == 1
+    assert game.dirty.dirty_rects(game.regions()) == []
+    game.generate_displacement(*game.players[0].pieces[1].position)
+    rects = game.dirty.dirty_rects(game.regions())
+    assert len(rects) == len(game.valid_moves) + 1
+    game.valid_moves[0].play(game)
+    game.valid_moves = []
+    game.state.refresh()
+    rects = game.dirty.dirty_rects(game.regions())
+    assert 2 < len(rects) < 12
+    # the frame of the try draws the message of the winner, nothing is left for the next one
+    game.state.ball_position = [3, COLS + COLSAUX]
+    assert game.update() and game.main_msg == 'BLUE TEAM WINS!!!'
+    assert game.dirty.dirty_rects(game.regions()) == []
+
+
+def test_run_events_and_stats():
+    game = main.Game([('BLUE', model.Color.BLUE), ('PINK', model.Color.PINK)], stats='screen')
+    row, col = game.players[0].pieces[1].position
+    main.pg.event.post(main.pg.event.Event(main.pg.MOUSEBUTTONDOWN, pos=(col * GRIDWIDTH + 5, row * GRIDWIDTH + 5),
+                                           button=1))
+    main.pg.event.post(main.pg.event.Event(main.pg.QUIT))
+    game.run()
+    assert game.valid_moves
+    summary = game.stats.summary()
+    assert {'frame', 'fps', 'events', 'generation', 'update'} <= set(summary)
+    assert game.stats.report().startswith('frame')
+
+
+def test_percentile():
+    from kahmate import profiling
+    assert profiling.percentile([], 50) == 0
+    assert profiling.percentile(list(range(101)), 95) == 95
+    stats = profiling.FrameStats()
+    for waited in (False, False, True, False):
+        stats.start_frame(waited)
+        stats.end_frame()
+    # the frame after a wait for events has no interval
+    assert len(stats.frames) == 4 and len(stats.intervals) == 2
+
+
+def test_ai_answers_in_time():
+    from kahmate import ai
+    random.seed(2)
+    state = new_state()
+    position = engine.Position.from_state(state)
+    key = position.key()
+    for level in (model.Level.EASY, model.Level.HARD):
+        move = ai.Searcher(level).choose(position)
+        assert position.key() == key
+        assert move in position.legal_moves()
+    # the clock is looked at every 128 nodes, a search past its deadline stops at the first look
+    searcher = ai.Searcher(model.Level.HARD, deadline=0)
+    assert searcher.choose(position) in position.legal_moves()
+    assert searcher.nodes_searched == 128 and position.key() == key
+
+
+def test_ai_scores_a_try():
+    from kahmate import ai
+    random.seed(0)
+    state = new_state()
+    for player in state.players:
+        for piece in player.pieces:
+            piece.has_ball = False
+    carrier = state.players[0].pieces[3]
+    carrier.position = [1, 12]
+    carrier.has_ball = True
+    state.ball_position = carrier.position
+    state.board.update_board(state.players)
+    move = ai.choose_move(state, model.Level.NORMAL)
+    state.play(move)
+    assert state.winner() == rules.Color.BLUE
+
+
+def test_parallel_search():
+    import pickle
+    from kahmate import ai
+    position = engine.Position.initial(rng=random.Random(2))
+    copy = pickle.loads(pickle.dumps(position))
+    assert copy.key() == position.key() and copy.hash == position.hash
+    budget = {'depth': 2, 'nodes': 10 ** 9, 'time': float('inf')}
+    scores = ai.Searcher(**budget).root_scores(position, position.legal_moves())[-1]
+    searcher = ai.ParallelSearcher(workers=2, **budget)
+    try:
+        move = searcher.choose(position)
+        assert scores[move] == max(scores.values())
+        assert searcher.depth_reached == 2
+        assert len(searcher.nodes_per_second()) == 2 and min(searcher.nodes_per_second()) > 0
+    finally:
+        searcher.close()
+    # choose_move keeps the pool of the last level only
+    state = new_state()
+    try:
+        for level in (model.Level.EASY, model.Level.NORMAL):
+            assert ai.choose_move(state, level, 0.2, workers=2) in state.legal_moves()
+        assert list(ai._parallel) == [(model.Level.NORMAL, 0.2, 2)]
+    finally:
+        ai.close_parallel()
+    assert not ai._parallel
+
+
+def test_thinking():
+    from kahmate import ai, thinking
+    random.seed(4)
+    state = new_state()
+    position = engine.Position.from_state(state)
+    reports = []
+    searcher = ai.Searcher(depth=3, nodes=10 ** 9, time=float('inf'), report=lambda *report: reports.append(report))
+    move = searcher.choose(position)
+    assert [depth for depth, _, _ in reports] == [1, 2, 3] and reports[-1][1] == move
+    stopped = ai.Searcher(depth=64, nodes=10 ** 9, time=float('inf'), stop=lambda: True)
+    assert stopped.choose(position) in position.legal_moves() and stopped.nodes_searched <= 128
+    # pondering for the other team fills the table its next search starts from
+    table = ai.TranspositionTable()
+    ai.Searcher(depth=2, nodes=10 ** 9, time=float('inf'), table=table).ponder(position, 1 - position.next_player())
+    stores = table.stores
+    assert stores > 0
+    position.play(move, position.sample_outcome(move, random.Random(0)))
+    ai.Searcher(depth=1, nodes=10 ** 9, time=float('inf'), table=table).choose(position)
+    assert table.hits > 0
+
+    thinker = thinking.Thinker(deadline=0.3)
+    try:
+        thinker.ponder(state, 1 - state._next_player, model.Level.NORMAL)
+        pondering = thinker._current.value
+        time.sleep(0.1)
+        # the search of the move cancels the ponder, and think does not wait for it
+        assert thinker.think(state, model.Level.HARD) is None
+        assert thinker._current.value != pondering and thinker._key[0] == thinking.SEARCH
+        move = None
+        start = time.perf_counter()
+        while move is None and time.perf_counter() - start < 60:
+            move = thinker.think(state, model.Level.HARD)
+            time.sleep(1 / FPS)
+        assert move in state.legal_moves() and thinker.depth_reached >= 1
+    finally:
+        thinker.close()
+
+
+def test_perft():
+    from kahmate import perft
+    position = engine.Position.initial(rng=random.Random(0))
+    counts = perft.perft(perft.EngineTree(position), 2)
+    assert counts['nodes'] == 3120 and counts['displacement'] == 3120
+    moves = perft.divide(perft.EngineTree(position), 2)
+    assert sum(below['nodes'] for below in moves.values()) == 3120 and len(moves) == 61
+    drawn = random.getstate()
+    assert perft.start_state(1, 50).compute_hash() == perft.start_state(1, 50).compute_hash()
+    assert random.getstate() == drawn
+    for seed in range(3):
+        for plies in (0, 30, 50):
+            state = perft.start_state(seed, plies)
+            assert perft.compare(state, 1) == []
+            counts = perft.perft(perft.EngineTree(engine.Position.from_state(state)), 2)
+            assert counts['nodes'] == sum(counts[name] for name in ('displacement', 'pass', 'tackle', 'skip'))
+    assert perft.main(['--depth', '1', '--plies', '30', '--compare']) == 0
+
+
+def test_tuning(tmp_path):
+    import numpy as np
+    from kahmate import ai, tuning
+    features, labels = tuning.play_game(0, model.Level.EASY, max_turns=40)
+    assert features.shape == (len(labels), len(ai.FEATURES)) and len(labels) > 0
+    assert set(labels.tolist()) <= {0, 0.5, 1}
+    path = tmp_path / 'positions.npz'
+    count = tuning.generate(3, model.Level.EASY, path, workers=1, max_turns=40)
+    features, labels = tuning.load_positions(path)
+    assert len(labels) == count and features.dtype == np.float32
+    # labels drawn from known weights are fitted better than by the default ones
+    rng = np.random.default_rng(0)
+    features = rng.normal(size=(4000, len(ai.FEATURES))).astype(np.float32) * 5
+    truth = {name: weight for name, weight in zip(ai.FEATURES, (30, 10, -5, 2, 0, 8, 1))}
+    chances = 1 / (1 + np.exp(-features @ np.array(list(truth.values())) / tuning.SCALE))
+    labels = (rng.random(4000) < chances).astype(np.float32)
+    weights = tuning.fit(features, labels)
+    assert tuning.loss(features, labels, weights) < tuning.loss(features, labels, ai.WEIGHTS)
+    assert abs(weights['ball'] - 30) < 6 and abs(weights['attack']) < 3
+    tuning.write_weights(model.Level.HARD, weights, tmp_path / 'weights.json')
+    assert ai.load_weights(tmp_path / 'weights.json') == {model.Level.HARD: weights}
+    assert ai.Searcher(model.Level.EASY).weights == ai.level_weights(model.Level.EASY)
+
+
+def test_analyze():
+    import io
+    import json
+    import analyze
+    from kahmate import perft, server
+    lines = []
+    for seed in range(6):
+        message = server.state_message(perft.start_state(seed, seed * 9))
+        message['id'] = f'position {seed}'
+        lines.append(json.dumps(message))
+    lines[3:3] = ['not a position', '', '{"pieces": []}']
+    budget = {'depth': 1}
+    output = io.StringIO()
+    assert analyze.run(iter(lines), output, model.Level.EASY, budget, workers=0, batch=2) == 8
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [result['id'] for result in results] == [f'position {seed}' for seed in range(3)] + [4, 6] + \
+        [f'position {seed}' for seed in range(3, 6)]
+    assert 'error' in results[3] and 'error' in results[4]
+    for seed, result in zip(range(6), results[:3] + results[5:]):
+        state = perft.start_state(seed, seed * 9)
+        position = engine.Position.from_state(state)
+        assert result['moves'] == [analyze.move_message(position, move) for move in position.legal_moves()]
+        assert result['best'] in result['moves'] and result['depth'] == 1
+        assert len(result['moves']) == len(state.legal_moves())
+    parallel = io.StringIO()
+    assert analyze.run(iter(lines), parallel, model.Level.EASY, budget, workers=1, batch=1, window=1) == 8
+    assert parallel.getvalue() == output.getvalue()
+
+
+def test_tournament(tmp_path):
+    import pytest
+    from kahmate import tournament
+    games = tournament.match(0, 'a', 'b', 0)
+    assert sorted(game['blue'] for game in games) == ['a', 'a', 'b', 'b']
+    assert len({game['seed'] for game in games}) == len({tournament.game_key(game) for game in games}) == 4
+    results = [{**game, 'winner': 'BLUE' if game['blue'] == 'a' else 'PINK'} for game in games * 6] + \
+        [{**game, 'winner': None} for game in games * 2]
+    rated = tournament.ratings(['a', 'b'], results)
+    # 28 points of 32 make 400 * log10(7) = 338 Elo, a bit less with the prior
+    assert 300 < rated['a'][0] - rated['b'][0] < 338 and abs(rated['a'][0] + rated['b'][0]) < 1e-6
+    assert 0 < rated['a'][1] < 400
+    names = ['a', 'b', 'c']
+    first = tournament.swiss_pairings(names, [])
+    assert first == [('a', 'b')]
+    played = [{**game, 'winner': 'BLUE'} for game in tournament.match(0, 'a', 'b', 0)]
+    # c had the bye, b gets the next one
+    assert tournament.swiss_pairings(names, played) == [('a', 'c')]
+
+    configs = [tournament.Config('easy', model.Level.EASY, {'depth': 1, 'nodes': 200}),
+               tournament.Config('normal', model.Level.NORMAL, {'depth': 1, 'nodes': 400})]
+    checkpoint = tmp_path / 'tournament.jsonl'
+    finished = []
+    tournament.Tournament(configs, checkpoint, max_turns=4).run(workers=1, report=finished.append)
+    assert len(finished) == 4
+    resumed = tournament.Tournament(configs, checkpoint, max_turns=4)
+    assert len(resumed.games) == 4
+    resumed.run(workers=1, report=finished.append)
+    assert len(finished) == 4 and 'easy' in resumed.table()
+    with pytest.raises(ValueError):
+        tournament.Tournament(configs, checkpoint, max_turns=5)
+
+
+def test_frozen_position():
+    import sys
+    from kahmate.frozen import FrozenPosition
+    rng = random.Random(5)
+    for colors in [(model.Color.BLUE, model.Color.PINK), (model.Color.PINK, model.Color.BLUE)]:
+        position = engine.Position.initial(colors, rng)
+        node = FrozenPosition.from_position(position)
+        while position.winner() < 0 and position.turn_count < 200:
+            thawed = node.thaw()
+            assert thawed.key() == position.key() and thawed.hash == position.hash
+            assert node.legal_moves() == position.legal_moves()
+            assert node.holder() == position.holder() and node.winner() == position.winner()
+            move = rng.choice(position.legal_moves())
+            outcome = position.sample_outcome(move, rng)
+            parent = int(node)
+            child = node.play(move, outcome)
+            assert node == parent
+            position.play(move, outcome)
+            assert child == FrozenPosition.from_position(position) and hash(child) == hash(int(child))
+            node = child
+        assert node.winner() == position.winner() and sys.getsizeof(node) <= 64
+    state = new_state()
+    assert FrozenPosition.from_state(state).thaw().key() == engine.Position.from_state(state).key()
+
+
+def test_delta():
+    from kahmate import delta
+    rng = random.Random(3)
+    changed = set()
+    for _ in range(5):
+        state = new_state()
+        copy = delta.Snapshot.from_state(state)
+        before = copy.copy()
+        for _ in range(200):
+            state.play(rng.choice(state.legal_moves()))
+            after = delta.Snapshot.from_state(state)
+            message = before.diff(after)
+            assert message['checksum'] == delta.checksum(state)
+            changed.update(message)
+            copy.apply(message)
+            assert copy == after
+            before = after
+            if state.winner() is not None:
+                break
+    assert changed == {'turn', 'ball', 'decks', 'cards', 'pieces', 'checksum'}
+    # the cards of the last face off are part of the checksum
+    assert after.cards != [0, 0] and delta.Snapshot(after.turn, after.ball, after.decks, after.pieces).checksum() \
+        != after.checksum()
+
+
+def test_server():
+    import asyncio
+    import json
+    import pytest
+    from kahmate import delta, server
+
+    async def client(port):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+
+        async def ask(message=None, answers=1):
+            if message is not None:
+                writer.write(json.dumps(message).encode() + b'\n')
+            return [json.loads(await reader.readline()) for _ in range(answers)]
+        return ask, writer
+
+    class SlowWriter:
+        # a client which reads nothing, the bytes sent to it piling up
+        def __init__(self):
+            self.transport = self
+            self.size = 0
+            self.closed = False
+
+        def get_write_buffer_size(self):
+            return self.size
+
+        def write(self, line):
+            self.size += len(line)
+
+        def is_closing(self):
+            return self.closed
+
+        def close(self):
+            self.closed = True
+
+    slow = SlowWriter()
+    while not slow.closed:
+        server.send(slow, {'type': 'moves', 'moves': []})
+    assert slow.size <= server.MAX_BUFFER
+
+    async def scenario():
+        host = server.Server(random.Random(0))
+        listener = await host.start('127.0.0.1', 0)
+        port = listener.sockets[0].getsockname()[1]
+        blue, blue_writer = await client(port)
+        pink, pink_writer = await client(port)
+        watcher, _ = await client(port)
+        joined, = await blue({'type': 'create'})
+        assert joined == {'type': 'joined', 'game': joined['game'], 'team': 0}
+        assert (await watcher({'type': 'watch', 'game': [joined['game']]}))[0]['type'] == 'error'
+        assert (await watcher({'type': 'watch', 'game': joined['game']}))[0]['team'] is None
+        answers = await pink({'type': 'join', 'game': joined['game']}, 2)
+        assert [answer['type'] for answer in answers] == ['joined', 'start']
+        started, _ = await blue({'type': 'moves'}, 2)
+        assert started == answers[1]
+        # the spectator keeps a copy of the state from the deltas
+        started, = await watcher()
+        copy = server.snapshot(started['state'])
+        assert copy.checksum() == started['state']['checksum']
+        stale = copy.copy()
+        assert (await pink({'type': 'moves'}))[0] == {'type': 'moves', 'moves': []}
+        assert (await pink({'type': 'move', 'move': {'kind': 'skip'}}))[0]['message'] == 'not your turn'
+        players = [blue, pink]
+        for _ in range(6):
+            table = host.tables[joined['game']]
+            team = table.state._next_player
+            moves, = await players[team]({'type': 'moves'})
+            assert len(moves['moves']) == len(table.state.legal_moves())
+            move = moves['moves'][-1]
+            if move['kind'] == 'displacement':
+                illegal = dict(move, target=[0, 0])
+                assert (await players[team]({'type': 'move', 'move': illegal}))[0]['type'] == 'error'
+                unknown = dict(move, piece=True)
+                assert (await players[team]({'type': 'move', 'move': unknown}))[0]['message'] == 'unknown piece'
+            played, = await players[team]({'type': 'move', 'move': move})
+            assert played['type'] == 'played' and played['move'] == move
+            # the opponent and the spectator were sent the move too
+            broadcast, current = await players[1 - team]({'type': 'state'}, 2)
+            assert broadcast == played and current['state'] == server.state_message(table.state)
+            assert (await watcher())[0] == played
+            copy.apply(played['delta'])
+            assert copy == server.snapshot(current['state']) == delta.Snapshot.from_state(table.state)
+            assert len(json.dumps(played['delta'])) < len(json.dumps(current['state'])) / 2
+        with pytest.raises(delta.Desync):
+            stale.apply(played['delta'])
+        # many tables, idle or not, on the same server
+        others = [await client(port) for _ in range(50)]
+        for ask, _ in others:
+            await ask({'type': 'create'})
+        assert len(host.tables) == 51
+        for _, writer in others:
+            writer.close()
+        pink_writer.close()
+        left, = await blue()
+        assert left == {'type': 'left', 'team': 1}
+        blue_writer.close()
+        listener.close()
+        await listener.wait_closed()
+        while host.tables:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(scenario())
+    # every legal move is found back from its message, anything else is rejected
+    state = new_state()
+    for move in state.legal_moves():
+        message = server.move_message(state, move)
+        assert server.move_message(state, server.find_move(state, message)) == message
+    piece = server.move_message(state, state.legal_moves()[0])['piece']
+    for message in [None, [], {'kind': 'fly'}, {'kind': ['pass']}, {'kind': 'pass', 'piece': -1},
+                    {'kind': 'pass', 'piece': str(piece)}, {'kind': 'displacement', 'piece': True},
+                    {'kind': 'displacement', 'piece': piece, 'target': [0, 0]}, {'kind': 'skip'}]:
+        with pytest.raises(server.ProtocolError):
+            server.find_move(state, message)
+
+
+def test_tablebase(tmp_path):
+    from fractions import Fraction
+    from kahmate import ai, faceoff, tablebase
+    from kahmate.tables import NCOLS
+    path = tmp_path / 'tablebase.bin'
+    assert tablebase.load(path) is None
+    assert tablebase.generate(path, teams=(0,), piece_types=[3, 1]) == 4
+    table = tablebase.load(path)
+    assert table is not None and tablebase.load(path) is table
+
+    def outcomes(position, move):
+        opponent = engine.move_opponent(move)
+        if opponent < 0:
+            return [(1, engine.NO_FACE_OFF)]
+        team = position.next_player()
+        return [(probability, engine.encode_outcome(result, attack_deck, defense_deck))
+                for probability, result, attack_deck, defense_deck in
+                faceoff.distribution(position.decks[team], position.decks[1 - team],
+                                     position.attack[engine.move_piece(move)], position.defense[opponent])]
+
+    def expected(position, move, value):
+        total = 0
+        for probability, outcome in outcomes(position, move):
+            position.make_move(move, outcome)
+            total += probability * value()
+            position.unmake_move(move)
+        return total
+
+    def first(piece):
+        return next(move for move in position.legal_moves() if engine.move_piece(move) == piece)
+
+    def carrier_scores():
+        # the carrier, piece 3, moves or is left where it is
+        return max([Fraction(0)] + [expected(position, move, lambda: position.winner() == 0)
+                                    for move in position.legal_moves() if engine.move_piece(move) == 3])
+
+    def defense():
+        # the defender, piece 7, moves or pieces 8 and 9 play both actions
+        played = []
+        for piece in (8, 9):
+            move = first(piece)
+            position.make_move(move)
+            played.append(move)
+        best = carrier_scores()
+        for move in reversed(played):
+            position.unmake_move(move)
+
+        def answer():
+            if position.death[3] >= 0:
+                return 0
+            move = first(8)
+            position.make_move(move)
+            value = carrier_scores()
+            position.unmake_move(move)
+            return value
+        for move in position.legal_moves():
+            if engine.move_piece(move) == 7:
+                best = min(best, expected(position, move, answer))
+        return best
+
+    rng = random.Random(1)
+    fast_big = tablebase.layout(0, 3, 1, 1)
+    chances = set()
+    for test in range(60):
+        position = engine.Position.initial(rng=rng)
+        position.board[:] = bytes(len(position.board))
+        carrier = rng.choice(fast_big.carriers)
+        defender = rng.choice([square for square in fast_big.region if square != carrier])
+        squares = {3: carrier, 7: defender, 1: 2 * NCOLS + 4, 2: 5 * NCOLS + 4, 8: 2 * NCOLS + 3, 9: 6 * NCOLS + 3}
+        spare = [row * NCOLS + col for row in (0, 9) for col in range(5)]
+        position.turn_count = 4 if test % 2 == 0 else 2
+        for piece in range(12):
+            position.death[piece] = -1 if piece in squares else 100
+            position.square[piece] = squares[piece] if piece in squares else spare.pop()
+            position.board[position.square[piece]] = piece + 1
+        if test % 3 == 0:
+            position.death[7] = position.turn_count - 2
+        position.ball = carrier
+        position.moved = 0
+        position.decks = [rng.randrange(1, 32), rng.randrange(1, 32)]
+        value = carrier_scores() if test % 2 == 0 else defense()
+        assert abs(table.value(position) - value) < 1e-4
+        chances.add(float(value))
+    assert len(chances) > 5
+    # the searcher counts the chances of the endgames at its leaves
+    searcher = ai.Searcher(ai.Level.EASY, tablebase=table, time=float('inf'))
+    assert searcher.choose(position) in position.legal_moves()
+    assert table.value(engine.Position.initial(rng=random.Random(0))) == 0
+
+
+def test_simulate(tmp_path):
+    from kahmate import simulate
+    output = tmp_path / 'results.bin'
+    levels = (model.Level.EASY, model.Level.EASY)
+    summary = simulate.simulate(4, levels, output, workers=2, seed=10, max_turns=60)
+    records = list(simulate.read_results(output))
+    assert len(records) == 4 and summary['games'] == 4
+    assert sorted(record[0] for record in records) == [10, 11, 12, 13]
+    assert summary['wins'][0] + summary['wins'][1] + summary['draws'] == 4
+    assert simulate.play_record(11, levels, 60)[:4] == [record for record in records if record[0] == 11][0][:4]
+
+
+def test_rollout_follows_engine():
+    import numpy as np
+    from kahmate import rollout
+    rng = random.Random(4)
+    for _ in range(4):
+        position = engine.Position.initial(rng=rng)
+        batch = rollout.Batch([position])
+        games = np.arange(1)
+        while position.winner() < 0 and position.turn_count < 100:
+            moves, legal = batch.legal_moves(games)
+            assert sorted(moves[0][legal[0]].tolist()) == sorted(position.legal_moves())
+            move = rng.choice(position.legal_moves())
+            outcome = position.sample_outcome(move, rng)
+            batch.apply(games, np.array([move]), np.array([outcome]))
+            position.play(move, outcome)
+            assert batch.square[0].tolist() == position.square and batch.death[0].tolist() == position.death
+            assert (batch.ball[0], batch.turn[0], batch.decks[0].tolist()) == \
+                (position.ball, position.turn_count, position.decks)
+            assert bytes(batch.board[0].astype(np.uint8)) == bytes(position.board)
+            assert batch.winner[0] == position.winner()
+
+
+def test_rollout():
+    import numpy as np
+    from kahmate import rollout
+    start = engine.Position.initial(rng=random.Random(2))
+    # the ball given to the blue piece closest to the pink try line, with nobody in its way
+    near_try = start.copy()
+    near_try.ball = near_try.square[0] = (near_try.square[0] // engine.NCOLS) * engine.NCOLS + COLS + COLSAUX - 1
+    near_try.board = bytearray(engine.NSQUARES)
+    for piece, square in enumerate(near_try.square):
+        near_try.board[square] = piece + 1
+    summary = rollout.rollout([start, near_try], games=200, max_turns=60, seed=1)
+    assert summary['win_rates'].shape == (2, 2)
+    assert np.allclose(summary['win_rates'].sum(1) + summary['draw_rates'], 1)
+    assert summary['win_rates'][1][0] > summary['win_rates'][0][0]
+    assert 0 < summary['mean_turns'][0] <= 60
+    # the draws of the face offs follow the exact distribution
+    from kahmate import faceoff
+    batch = rollout.Batch([start] * 20000)
+    move = engine.encode(engine.DISPLACEMENT, 1, 50, 8)
+    outcomes = batch.sample_outcomes(np.arange(20000), np.full(20000, move), np.random.default_rng(0))
+    for probability, result, attack_deck, defense_deck in faceoff.distribution(
+            engine.FULL_DECK, engine.FULL_DECK, start.attack[1], start.defense[8]):
+        share = np.mean(outcomes == engine.encode_outcome(result, attack_deck, defense_deck))
+        assert abs(share - probability) < 0.02
+
+
+def test_game_record(tmp_path):
+    from kahmate import record
+    path = tmp_path / 'games.kahmate'
+    random.seed(8)
+    state = rules.GameState(new_state().players, random.Random(8))
+    keys = [engine.Position.from_state(state).key()]
+    while state.winner() is None and len(state.history) < 300:
+        state.play(random.choice(state.legal_moves()))
+        keys.append(engine.Position.from_state(state).key())
+    position = engine.Position.initial(rng=random.Random(3))
+    moves = []
+    for _ in range(40):
+        move = position.legal_moves()[0]
+        outcome = position.sample_outcome(move)
+        moves.append((move, outcome))
+        position.play(move, outcome)
+    start = engine.Position.initial(rng=random.Random(3))
+    assert record.write_games(path, [record.GameRecord.from_state(state, 8)]) == 1
+    record.write_games(path, [record.GameRecord.from_moves(start, moves, 3)])
+    first, second = record.read_games(path)
+    assert (first.seed, first.count, second.seed, second.count) == (8, len(state.history), 3, 40)
+    assert first.winner == (-1 if state.winner() is None else 0 if state.winner() == rules.Color.BLUE else 1)
+    assert 2 * first.count <= len(first.payload) <= 4 * first.count
+    assert list(second.moves()) == [(move if outcome else engine.encode(engine.move_kind(move),
+                                     engine.move_piece(move), engine.move_square(move)), outcome)
+                                    for move, outcome in moves]
+    replay = record.Replay(first, interval=8)
+    for ply in [len(keys) - 1, 0, 17, 9, len(keys) // 2]:
+        assert replay.seek(ply).key() == keys[ply]
+    assert replay.seek_turn(10).turn_count == 10
+    assert record.Replay(second).seek(40).key() == position.key()
+    assert [game.count for game in record.read_games(path, moves=False)] == [first.count, 40]
+
+
+def test_benchmarks():
+    import benchmarks
+    benchmarks.MIN_TIME = 0.01
+    results = benchmarks.run_benchmarks(['update_board', 'face_off'])
+    assert sorted(results) == ['face_off', 'update_board'] and all(value > 0 for value in results.values())
+    baselines = {'face_off': results['face_off'] * 2, 'update_board': results['update_board']}
+    assert benchmarks.compare(results, baselines, 0.25) == [('face_off', results['face_off'],
+                                                             results['face_off'] * 2)]
+
+
+def test_face_off_probabilities():
+    from fractions import Fraction
+    from kahmate import faceoff
+    probabilities = faceoff.result_probabilities(engine.FULL_DECK, engine.FULL_DECK, 0, 0)
+    assert probabilities == {rules.PERFECT_TACKLE: Fraction(6, 25), rules.ATTACK_WINS: Fraction(94, 400),
+                             rules.DEFENSE_WINS: Fraction(21, 40)}
+    rng = random.Random(0)
+    for attack_deck, defense_deck, attack, defense in [(0b00101, 0b11010, 2, 1), (0b10001, 0b00011, -1, 1)]:
+        distribution = faceoff.distribution(attack_deck, defense_deck, attack, defense)
+        assert sum(probability for probability, _, _, _ in distribution) == 1
+        counts = {}
+        for _ in range(20000):
+            outcome = engine.face_off_outcome(attack_deck, defense_deck, attack, defense, rng)
+            counts[outcome] = counts.get(outcome, 0) + 1
+        for probability, result, attack_left, defense_left in distribution:
+            frequency = counts.get(engine.encode_outcome(result, attack_left, defense_left), 0) / 20000
+            assert abs(frequency - probability) < 0.015
+
+
+def test_pick_strength_draws_every_card():
+    team = rules.Team(rules.Color.BLUE)
+    assert sorted(team.pick_strength() for _ in range(5)) == [1, 2, 3, 4, 5]
+    assert team.strength_deck == [1, 2, 3, 4, 5]